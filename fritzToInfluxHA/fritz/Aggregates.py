@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+"""Module Aggregates
+
+This module includes a class for aggregates of device measurements per location.
+
+Aggregates are computed in one pass over the devices of a measurement cycle
+for every location (all sublocations) and every location/sublocation
+configured for the devices:
+- total power of all devices ("location_power")
+- sum of the energy consumed since the previous cycle ("location_energy_delta")
+- maximum temperature, including thermostat temperatures ("location_temperature_max")
+- number of devices contributing ("location_devices")
+
+Only measurements configured for a device contribute to its aggregates.
+Aggregates are written with tags "location" and "sublocation"; location
+totals have no sublocation tag. Lines are routed with AGGREGATES_AIN.
+"""
+from .LineProtocol import seriesKey, timestamp, formatLine
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Route key of aggregate measurements in InfluxRouter
+AGGREGATES_AIN = "aggregates"
+
+class LocationTotals:
+    """
+    Class representing the aggregates of one location or sublocation in one cycle
+    """
+    __slots__ = ("devices", "power", "energyDelta", "temperatureMax")
+
+    def __init__(self):
+        self.devices = 0
+        self.power = None
+        self.energyDelta = None
+        self.temperatureMax = None
+
+    def add(self, power, energyDelta, temperature):
+        self.devices = self.devices + 1
+        if power is not None:
+            self.power = power if self.power is None else self.power + power
+        if energyDelta is not None:
+            self.energyDelta = energyDelta if self.energyDelta is None else self.energyDelta + energyDelta
+        if temperature is not None:
+            if self.temperatureMax is None or temperature > self.temperatureMax:
+                self.temperatureMax = temperature
+
+class Aggregates:
+    """
+    Class representing the aggregation of device measurements per location
+    """
+    def __init__(self, sublocations=True):
+        """
+        Constructor for Aggregates
+
+        sublocations: specifies whether aggregates per location/sublocation
+                      are computed in addition to those per location
+        """
+        self.sublocations = sublocations
+        # Energy meter reading per device in the previous cycle
+        self.lastEnergy = {}
+        self.totals = {}
+        self._seriesKeys = {}
+
+    def getSeriesKey(self, measurement, location, sublocation):
+        ref = (measurement, location, sublocation)
+        key = self._seriesKeys.get(ref)
+        if key is None:
+            key = seriesKey(measurement, {
+                "location" : location,
+                "sublocation" : sublocation
+            })
+            self._seriesKeys[ref] = key
+        return key
+
+    def energyDelta(self, ain, energy):
+        """
+        Return the energy consumed since the previous cycle
+
+        Returns None for the first reading and if the meter has been reset.
+        """
+        last = self.lastEnergy.get(ain)
+        self.lastEnergy[ain] = energy
+        if last is None or energy < last:
+            return None
+        return energy - last
+
+    def update(self, devices, precision="ns"):
+        """
+        Aggregate the values of up-to-date monitored devices with location
+
+        Returns a list of (measurement, line) with the aggregates of this cycle.
+        """
+        totals = {}
+        found = set()
+        measurementTime = None
+        for dev in devices:
+            found.add(dev.ain)
+            if not dev.isMonitored or not dev.upToDate or not dev.location:
+                continue
+            # Zero values count, although they are not written per device
+            power = None
+            if dev.measurements.get("power"):
+                power = dev.power
+            energy = None
+            if dev.measurements.get("energy"):
+                energy = dev.energy
+            temperature = None
+            for measurement in ("temperature", "tist"):
+                value = getattr(dev, measurement)
+                if dev.measurements.get(measurement) and value is not None:
+                    if temperature is None or value > temperature:
+                        temperature = value
+            if power is None and energy is None and temperature is None:
+                continue
+            energyDelta = None
+            if energy is not None:
+                energyDelta = self.energyDelta(dev.ain, energy)
+
+            groups = [(dev.location, None)]
+            if self.sublocations and dev.sublocation:
+                groups.append((dev.location, dev.sublocation))
+            for group in groups:
+                total = totals.get(group)
+                if total is None:
+                    total = LocationTotals()
+                    totals[group] = total
+                total.add(power, energyDelta, temperature)
+            if dev.measurementTime and (measurementTime is None or dev.measurementTime > measurementTime):
+                measurementTime = dev.measurementTime
+
+        # Forget devices no longer registered at the Fritz!Box
+        for ain in list(self.lastEnergy.keys()):
+            if ain not in found:
+                del self.lastEnergy[ain]
+
+        self.totals = totals
+        ts = None
+        if measurementTime:
+            ts = timestamp(measurementTime, precision)
+        lines = []
+        for (location, sublocation), total in totals.items():
+            for measurement, value in (
+                ("location_power", total.power),
+                ("location_energy_delta", total.energyDelta),
+                ("location_temperature_max", total.temperatureMax),
+                ("location_devices", total.devices),
+            ):
+                line = formatLine(self.getSeriesKey(measurement, location, sublocation), value, ts)
+                if line is not None:
+                    lines.append((measurement, line))
+        return lines
+
+    def getMetrics(self):
+        """
+        Return metrics of the aggregation
+        """
+        return {
+            "aggregateGroups" : len(self.totals),
+        }
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+"""Module AhaDecoder
+
+This module decodes device elements of the AHA (AVM Home Automation) device list.
+
+Device type and capabilities are derived from the functionbitmask.
+Values are parsed in one pass over the device element using per-capability parser tables.
+"""
+from enum import Enum
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Supported device types
+class HaDeviceType(Enum):
+    SWITCH = 1
+    REPEATER = 2
+    LAMP = 3
+    THERMOSTAT = 4
+    SENSOR = 5
+    BUTTON = 6
+    BLIND = 7
+    UNKNOWN = 9
+
+# Bits of the AHA functionbitmask
+BIT_LIGHT = 1 << 2
+BIT_ALARM = 1 << 4
+BIT_BUTTON = 1 << 5
+BIT_THERMOSTAT = 1 << 6
+BIT_POWERMETER = 1 << 7
+BIT_TEMPERATURE = 1 << 8
+BIT_SWITCH = 1 << 9
+BIT_REPEATER = 1 << 10
+BIT_ONOFF = 1 << 15
+BIT_LEVEL = 1 << 16
+BIT_COLOR = 1 << 17
+BIT_BLIND = 1 << 18
+BIT_HUMIDITY = 1 << 20
+
+# Device type by functionbitmask bit in order of priority
+_TYPES = (
+    (BIT_SWITCH, HaDeviceType.SWITCH),
+    (BIT_THERMOSTAT, HaDeviceType.THERMOSTAT),
+    (BIT_LIGHT, HaDeviceType.LAMP),
+    (BIT_BLIND, HaDeviceType.BLIND),
+    (BIT_REPEATER, HaDeviceType.REPEATER),
+    (BIT_BUTTON, HaDeviceType.BUTTON),
+    (BIT_TEMPERATURE, HaDeviceType.SENSOR),
+    (BIT_HUMIDITY, HaDeviceType.SENSOR),
+    (BIT_ALARM, HaDeviceType.SENSOR),
+)
+
+# Device type by product name for devices without functionbitmask
+_PRODUCTS = {
+    "FRITZ!DECT 200" : HaDeviceType.SWITCH,
+    "FRITZ!DECT 210" : HaDeviceType.SWITCH,
+    "FRITZ!DECT Repeater 100" : HaDeviceType.REPEATER,
+}
+
+# Capability flags of FritzHaDevice by functionbitmask bit
+_CAPABILITIES = (
+    (BIT_SWITCH | BIT_ONOFF, "hasState"),
+    (BIT_POWERMETER, "hasPower"),
+    (BIT_TEMPERATURE, "hasTemperature"),
+    (BIT_THERMOSTAT, "hasThermostat"),
+    (BIT_HUMIDITY, "hasHumidity"),
+    (BIT_LEVEL, "hasLevel"),
+)
+
+def _text(txt):
+    return txt
+
+def _int(txt):
+    return int(txt)
+
+def _milli(txt):
+    return int(txt)/1000
+
+def _deci(txt):
+    return int(txt)/10
+
+def _halfDegree(txt):
+    # 253 (off) and 254 (on) are no temperatures
+    val = int(txt)
+    if val > 250:
+        return None
+    return val/2
+
+# Parsers for direct children of the device element: tag -> (attribute, converter)
+_DEVICE_PARSERS = {
+    "name" : ("name", _text),
+    "present" : ("present", _text),
+    "battery" : ("battery", _int),
+}
+
+# Parsers per capability element: element tag -> child tag -> (attribute, converter)
+_PARSERS = {
+    "switch" : {
+        "state" : ("state", _text),
+    },
+    "simpleonoff" : {
+        "state" : ("state", _text),
+    },
+    "powermeter" : {
+        "voltage" : ("voltage", _milli),
+        "power" : ("power", _milli),
+        "energy" : ("energy", _milli),
+    },
+    "temperature" : {
+        "celsius" : ("temperature", _deci),
+    },
+    "hkr" : {
+        "tist" : ("tist", _halfDegree),
+        "tsoll" : ("tsoll", _halfDegree),
+        "battery" : ("battery", _int),
+    },
+    "humidity" : {
+        "rel_humidity" : ("humidity", _int),
+    },
+    "levelcontrol" : {
+        "levelpercentage" : ("level", _int),
+    },
+}
+
+def normalizeAin(ain):
+    """
+    Return AIN without blanks
+    """
+    return ain.strip().replace(" ", "")
+
+def decodeType(dev, haDev):
+    """
+    Set device type and capabilities from the attributes of the device element
+    """
+    bitmask = dev.attrib.get("functionbitmask")
+    product = dev.attrib.get("productname")
+    if bitmask is None:
+        haDev.type = _PRODUCTS.get(product, HaDeviceType.UNKNOWN)
+        if haDev.type == HaDeviceType.SWITCH:
+            haDev.hasState = True
+        elif haDev.type == HaDeviceType.REPEATER:
+            haDev.hasTemperature = True
+        if dev.find("powermeter") is not None:
+            haDev.hasPower = True
+        if dev.find("temperature") is not None:
+            haDev.hasTemperature = True
+        return
+
+    bitmask = int(bitmask)
+    haDev.functionBitmask = bitmask
+    haDev.type = HaDeviceType.UNKNOWN
+    for bit, haType in _TYPES:
+        if bitmask & bit:
+            haDev.type = haType
+            break
+    for bits, flag in _CAPABILITIES:
+        if bitmask & bits:
+            setattr(haDev, flag, True)
+
+def decodeValues(dev, haDev):
+    """
+    Set device values from the device element in one pass over its children
+    """
+    for child in dev:
+        parser = _DEVICE_PARSERS.get(child.tag)
+        if parser:
+            _apply(haDev, parser, child.text)
+            continue
+        parsers = _PARSERS.get(child.tag)
+        if parsers:
+            for sub in child:
+                parser = parsers.get(sub.tag)
+                if parser:
+                    _apply(haDev, parser, sub.text)
+
+def _apply(haDev, parser, txt):
+    attr, conv = parser
+    if txt is None or txt == "":
+        return
+    try:
+        setattr(haDev, attr, conv(txt))
+    except ValueError:
+        logger.warning("Invalid value for %s of device ain=%s: %s", attr, haDev.ain, txt)
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+"""Module Analytics
+
+This module includes classes for streaming statistics and event detection per device.
+
+Statistics are updated incrementally with every measurement cycle and need
+constant memory per device:
+- exponentially weighted moving average (EWMA) and variance of power
+- duty cycle (EWMA of the share of cycles with power above onThreshold)
+- standby baseline (EWMA of power while in standby range)
+- EWMA of temperature
+
+Derived values are written as measurements "power_ewma", "power_stddev",
+"duty_cycle", "standby_baseline" and "temperature_ewma".
+Threshold events are written as measurement "event" with tag "type"
+and value 1 when the condition starts and 0 when it ends.
+Lines are routed like the measurement they are derived from
+(power or temperature/tist) and like their own measurement name.
+"""
+import math
+from .LineProtocol import seriesKey, timestamp, formatLine
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Default parameters, may be overridden per device
+DEFAULTS = {
+    "alpha" : 0.1,
+    "onThreshold" : 5.0,
+    "standbyThreshold" : 2.0,
+    "standbyCycles" : 30,
+    "dutyCycleMin" : None,
+    "dutyCycleMax" : None,
+    "maxTemperature" : 40.0,
+    "anomalyZScore" : 4.0,
+    "minSamples" : 10,
+}
+
+# Event types
+EVENT_STANDBY = "standby"
+EVENT_DUTY_CYCLE_LOW = "duty_cycle_low"
+EVENT_DUTY_CYCLE_HIGH = "duty_cycle_high"
+EVENT_OVERHEAT = "overheat"
+EVENT_POWER_ANOMALY = "power_anomaly"
+
+class DeviceStats:
+    """
+    Class representing the incremental statistics of one device
+    """
+    __slots__ = ("samples", "powerMean", "powerVar", "dutyCycle", "standbyCount",
+                 "standbyBaseline", "temperatureMean", "active")
+
+    def __init__(self):
+        self.samples = 0
+        self.powerMean = None
+        self.powerVar = 0.0
+        self.dutyCycle = None
+        self.standbyCount = 0
+        self.standbyBaseline = None
+        self.temperatureMean = None
+        # Event types currently active
+        self.active = set()
+
+    def updatePower(self, power, p):
+        """
+        Update power statistics and return True if power is an anomaly
+        """
+        anomaly = False
+        if self.powerMean is None:
+            self.powerMean = power
+            self.dutyCycle = 1.0 if power > p["onThreshold"] else 0.0
+        else:
+            # Check before update so that the outlier does not hide itself
+            std = math.sqrt(self.powerVar)
+            if self.samples >= p["minSamples"] and std > 0 and abs(power - self.powerMean) > p["anomalyZScore"] * std:
+                anomaly = True
+            alpha = p["alpha"]
+            diff = power - self.powerMean
+            incr = alpha * diff
+            self.powerMean = self.powerMean + incr
+            self.powerVar = (1 - alpha) * (self.powerVar + diff * incr)
+            on = 1.0 if power > p["onThreshold"] else 0.0
+            self.dutyCycle = self.dutyCycle + alpha * (on - self.dutyCycle)
+        self.samples = self.samples + 1
+
+        if 0 < power < p["standbyThreshold"]:
+            self.standbyCount = self.standbyCount + 1
+            if self.standbyBaseline is None:
+                self.standbyBaseline = power
+            else:
+                self.standbyBaseline = self.standbyBaseline + p["alpha"] * (power - self.standbyBaseline)
+        else:
+            self.standbyCount = 0
+        return anomaly
+
+    def updateTemperature(self, temperature, p):
+        if self.temperatureMean is None:
+            self.temperatureMean = temperature
+        else:
+            self.temperatureMean = self.temperatureMean + p["alpha"] * (temperature - self.temperatureMean)
+
+class Analytics:
+    """
+    Class representing the analytics stage of the measurement pipeline
+    """
+    def __init__(self, defaults=None):
+        """
+        Constructor for Analytics
+
+        defaults: parameters overriding DEFAULTS for all devices
+        """
+        self.defaults = dict(DEFAULTS)
+        if defaults:
+            self.defaults.update(defaults)
+        self.params = {}
+        self.stats = {}
+        self._seriesKeys = {}
+        self.events = 0
+
+    def setDeviceParams(self, devices):
+        """
+        Set parameters per device from the "analytics" entry of the device configuration
+        """
+        self.params = {}
+        for dev in devices:
+            if "analytics" in dev:
+                p = dict(self.defaults)
+                p.update(dev["analytics"])
+                self.params[dev["ain"]] = p
+
+    def getSeriesKey(self, dev, measurement, eventType=None):
+        ref = (dev.ain, dev.location, dev.sublocation, measurement, eventType)
+        key = self._seriesKeys.get(ref)
+        if key is None:
+            key = seriesKey(measurement, {
+                "ain" : dev.ain,
+                "location" : dev.location,
+                "sublocation" : dev.sublocation,
+                "type" : eventType
+            })
+            self._seriesKeys[ref] = key
+        return key
+
+    def addLine(self, lines, dev, measurement, source, value, ts, eventType=None):
+        line = formatLine(self.getSeriesKey(dev, measurement, eventType), value, ts)
+        if line is not None:
+            lines.append((dev.ain, measurement, source, line))
+
+    def setEvent(self, dev, stats, eventType, source, condition, lines, ts):
+        """
+        Write an event if the condition has changed
+        """
+        if condition == (eventType in stats.active):
+            return
+        if condition:
+            stats.active.add(eventType)
+            self.events = self.events + 1
+            logger.warning("Event %s started for device ain=%s name=%s", eventType, dev.ain, dev.name)
+        else:
+            stats.active.discard(eventType)
+            logger.info("Event %s ended for device ain=%s name=%s", eventType, dev.ain, dev.name)
+        self.addLine(lines, dev, "event", source, 1 if condition else 0, ts, eventType)
+
+    def update(self, devices, precision="ns"):
+        """
+        Update statistics with the values of up-to-date monitored devices
+
+        Returns a list of (ain, measurement, source measurement, line) with derived measurements and events.
+        """
+        lines = []
+        found = set()
+        for dev in devices:
+            found.add(dev.ain)
+            if not dev.upToDate or not dev.isMonitored:
+                continue
+            stats = self.stats.get(dev.ain)
+            if stats is None:
+                stats = DeviceStats()
+                self.stats[dev.ain] = stats
+            p = self.params.get(dev.ain, self.defaults)
+            ts = None
+            if dev.measurementTime:
+                ts = timestamp(dev.measurementTime, precision)
+
+            if dev.power is not None:
+                anomaly = stats.updatePower(dev.power, p)
+                self.addLine(lines, dev, "power_ewma", "power", stats.powerMean, ts)
+                self.addLine(lines, dev, "power_stddev", "power", math.sqrt(stats.powerVar), ts)
+                self.addLine(lines, dev, "duty_cycle", "power", stats.dutyCycle, ts)
+                self.addLine(lines, dev, "standby_baseline", "power", stats.standbyBaseline, ts)
+                if anomaly:
+                    self.events = self.events + 1
+                    logger.warning("Power anomaly for device ain=%s name=%s: %s W (mean %.1f W)", dev.ain, dev.name, dev.power, stats.powerMean)
+                    self.addLine(lines, dev, "event", "power", 1, ts, EVENT_POWER_ANOMALY)
+                self.setEvent(dev, stats, EVENT_STANDBY, "power", stats.standbyCount >= p["standbyCycles"], lines, ts)
+                if stats.samples >= p["minSamples"]:
+                    if p["dutyCycleMin"] is not None:
+                        self.setEvent(dev, stats, EVENT_DUTY_CYCLE_LOW, "power", stats.dutyCycle < p["dutyCycleMin"], lines, ts)
+                    if p["dutyCycleMax"] is not None:
+                        self.setEvent(dev, stats, EVENT_DUTY_CYCLE_HIGH, "power", stats.dutyCycle > p["dutyCycleMax"], lines, ts)
+
+            source = "temperature"
+            temperature = dev.temperature
+            if temperature is None:
+                source = "tist"
+                temperature = dev.tist
+            if temperature is not None:
+                stats.updateTemperature(temperature, p)
+                self.addLine(lines, dev, "temperature_ewma", source, stats.temperatureMean, ts)
+                if p["maxTemperature"] is not None:
+                    self.setEvent(dev, stats, EVENT_OVERHEAT, source, temperature > p["maxTemperature"], lines, ts)
+
+        # Forget devices no longer registered at the Fritz!Box
+        for ain in list(self.stats.keys()):
+            if ain not in found:
+                del self.stats[ain]
+        return lines
+
+    def getMetrics(self):
+        """
+        Return metrics of the analytics stage
+        """
+        active = 0
+        for stats in self.stats.values():
+            active = active + len(stats.active)
+        return {
+            "analyticsEvents" : self.events,
+            "analyticsActiveEvents" : active,
+        }
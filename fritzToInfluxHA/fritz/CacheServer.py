@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""Module CacheServer
+
+This module includes a small HTTP/JSON server for the ValueCache.
+
+The server listens on a local TCP port, on a Unix socket or on a socket
+passed by systemd socket activation. It runs in a background thread.
+Responses carry an ETag. Requests with a matching If-None-Match header
+are answered with 304 Not Modified.
+"""
+import os
+import json
+import socket
+import threading
+import socketserver
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the ValueCache of the server
+    """
+    server_version = "fritzToInfluxHA"
+
+    def do_GET(self):
+        # AINs of Fritz!DECT devices contain blanks
+        path = unquote(self.path.split("?", 1)[0])
+        res = self.server.cache.getResponse(path)
+        if res is None:
+            body = json.dumps({"error" : "Not found: " + path}).encode("utf-8")
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        etag, body = res
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Client addresses of Unix sockets are empty
+        logger.debug(format, *args)
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class CacheServer:
+    """
+    Class representing the HTTP server for the ValueCache
+    """
+    def __init__(self, cache, host="127.0.0.1", port=8095, socketPath=None, sock=None):
+        """
+        Constructor for CacheServer
+
+        host, port: local TCP address
+        socketPath: path of a Unix socket (replaces host and port)
+        sock:       listening socket passed by systemd (replaces all addresses).
+                    It stays open after close(), so that a new server can take it over.
+        """
+        self.cache = cache
+        self.socketPath = None
+        self.inherited = sock is not None
+        if sock is not None:
+            if sock.family == socket.AF_UNIX:
+                self.server = ThreadingUnixHTTPServer(sock.getsockname(), CacheRequestHandler, bind_and_activate=False)
+            else:
+                self.server = ThreadingHTTPServer(sock.getsockname()[0:2], CacheRequestHandler, bind_and_activate=False)
+            self.server.socket.close()
+            self.server.socket = sock
+            logger.info("Cache server listening on socket passed by systemd")
+        elif socketPath:
+            if os.path.exists(socketPath):
+                os.unlink(socketPath)
+            self.server = ThreadingUnixHTTPServer(socketPath, CacheRequestHandler)
+            self.socketPath = socketPath
+            logger.info("Cache server listening on %s", socketPath)
+        else:
+            self.server = ThreadingHTTPServer((host, port), CacheRequestHandler)
+            logger.info("Cache server listening on %s:%s", host, port)
+        self.server.cache = cache
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fritzToInfluxHA-cache", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stop the server
+        """
+        self.server.shutdown()
+        if not self.inherited:
+            self.server.server_close()
+        if self.socketPath and os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+"""Module Capture
+
+This module includes transports for recording and replaying Fritz!Box requests.
+
+A transport provides get(url, timeout) like requests.Session, which is
+the default transport of FritzBox. CaptureRecorder wraps the HTTP session of
+FritzBox instances and records request/response pairs with timing to a
+gzip-compressed JSON lines archive. Credentials are scrubbed: user names, login responses and
+challenges are replaced and valid SIDs are replaced by a fixed SID.
+ReplayTransport feeds a capture back to FritzBox at recorded or
+accelerated speed.
+"""
+import re
+import gzip
+import json
+import time
+import threading
+import requests
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+CAPTURE_VERSION = 1
+
+INVALID_SID = "0000000000000000"
+# Replaces all valid SIDs
+SCRUBBED_SID = "5c0bbed5c0bbed00"
+# Replace challenges so that responses cannot be used to attack the password.
+# Iteration counts of 1 keep replayed PBKDF2 logins cheap.
+SCRUBBED_PBKDF2_CHALLENGE = "2$1$00$1$00"
+SCRUBBED_MD5_CHALLENGE = "00000000"
+
+# Query parameters replaced in recorded URLs (SIDs are replaced by scrubSid)
+_SCRUBBED_PARAMS = {
+    "username" : "user",
+    "response" : "scrubbed",
+}
+
+_RE_SID = re.compile(r"<SID>([0-9a-fA-F]*)</SID>")
+_RE_CHALLENGE = re.compile(r"<Challenge>([^<]*)</Challenge>")
+_RE_USER = re.compile(r"(<User[^>]*>)[^<]*(</User>)")
+
+class CaptureEndError(Exception):
+    """
+    Exception raised when a replayed capture has no more responses
+    """
+    def __init__(self, message="End of capture"):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+def scrubSid(sid):
+    if sid == INVALID_SID or sid == "":
+        return sid
+    return SCRUBBED_SID
+
+def scrubUrl(url):
+    """
+    Return path and query of the URL with credentials and SIDs replaced
+    """
+    parts = urlsplit(url)
+    query = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        if key == "sid":
+            value = scrubSid(value)
+        elif key in _SCRUBBED_PARAMS:
+            value = _SCRUBBED_PARAMS[key]
+        query.append((key, value))
+    path = parts.path
+    if query:
+        path = path + "?" + urlencode(query, safe="$")
+    return path
+
+def _scrubChallenge(match):
+    if match.group(1).startswith("2$"):
+        return "<Challenge>" + SCRUBBED_PBKDF2_CHALLENGE + "</Challenge>"
+    return "<Challenge>" + SCRUBBED_MD5_CHALLENGE + "</Challenge>"
+
+def scrubBody(body):
+    """
+    Return the response body with SIDs, challenges and user names replaced
+    """
+    body = _RE_SID.sub(lambda m: "<SID>" + scrubSid(m.group(1)) + "</SID>", body)
+    body = _RE_CHALLENGE.sub(_scrubChallenge, body)
+    body = _RE_USER.sub(r"\1user\2", body)
+    return body
+
+class CaptureRecorder:
+    """
+    Class representing a recording of requests to a gzip-compressed capture file
+
+    Requests are recorded through the transports returned by wrap().
+    Entries are written as JSON lines:
+        {"t": start offset, "d": duration, "u": scrubbed URL,
+         "s": status code, "b": body} or {..., "e": exception class name}
+    """
+    def __init__(self, path):
+        """
+        Constructor for CaptureRecorder
+
+        path: capture file (gzip-compressed JSON lines)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.entries = 0
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.writeEntry({"version" : CAPTURE_VERSION, "time" : time.time()})
+        logger.info("Recording Fritz!Box requests to %s", path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def wrap(self, transport):
+        """
+        Return a transport which sends requests with the given transport and records them
+
+        Used as transport factory of FritzBox, which passes its pooled HTTP session.
+        """
+        return RecordingTransport(self, transport)
+
+    def writeEntry(self, entry):
+        """
+        Write an entry to the capture file
+
+        Entries of requests completing after close() (e.g. a late logoff) are not recorded.
+        """
+        with self.lock:
+            if self.file is None:
+                logger.warning("Capture file %s closed: request %s not recorded", self.path, entry.get("u"))
+                return
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.file.flush()
+            if "u" in entry:
+                self.entries = self.entries + 1
+
+    def close(self):
+        """
+        Close the capture file
+        """
+        with self.lock:
+            if self.file:
+                self.file.close()
+            self.file = None
+
+class RecordingTransport:
+    """
+    Class representing a transport whose requests are recorded by a CaptureRecorder
+    """
+    def __init__(self, recorder, transport):
+        self.recorder = recorder
+        self.transport = transport
+
+    def get(self, url, timeout=None):
+        """
+        Send the request with the wrapped transport and record it
+        """
+        t = time.monotonic()
+        entry = {"t" : round(t - self.recorder.start, 6), "u" : scrubUrl(url)}
+        try:
+            resp = self.transport.get(url, timeout=timeout)
+        except requests.RequestException as error:
+            entry["d"] = round(time.monotonic() - t, 6)
+            entry["e"] = error.__class__.__name__
+            self.recorder.writeEntry(entry)
+            raise
+        entry["d"] = round(time.monotonic() - t, 6)
+        entry["s"] = resp.status_code
+        entry["b"] = scrubBody(resp.text)
+        self.recorder.writeEntry(entry)
+        return resp
+
+class ReplayResponse:
+    """
+    Class representing a replayed response with the attributes used by FritzBox
+    """
+    def __init__(self, url, status, text):
+        self.url = url
+        self.status_code = status
+        self.text = text
+        try:
+            self.reason = HTTPStatus(status).phrase
+        except ValueError:
+            self.reason = ""
+
+class ReplayTransport:
+    """
+    Class representing a transport which replays a capture
+
+    Responses are returned in recorded order. URLs of requests are not
+    required to match; differing paths are logged.
+    """
+    def __init__(self, path, speed=0.0):
+        """
+        Constructor for ReplayTransport
+
+        speed: replay speed relative to the recording (e.g. 10 = 10 times faster).
+               0 replays without delays.
+        """
+        self.path = path
+        self.speed = speed
+        self.entries = []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CAPTURE_VERSION:
+                raise ValueError("Unsupported capture version in " + path)
+            try:
+                for line in f:
+                    if line.strip():
+                        self.entries.append(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # Recording has been interrupted: use the complete entries
+                logger.warning("Capture %s is truncated after %s entries", path, len(self.entries))
+        self.pos = 0
+        self.start = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def rewind(self):
+        self.pos = 0
+        self.start = None
+
+    def get(self, url, timeout=None):
+        """
+        Return the next recorded response
+        """
+        if self.pos >= len(self.entries):
+            raise CaptureEndError
+        entry = self.entries[self.pos]
+        self.pos = self.pos + 1
+
+        if self.speed > 0:
+            now = time.monotonic()
+            if self.start is None:
+                self.start = now - entry["t"] / self.speed
+            delay = self.start + (entry["t"] + entry["d"]) / self.speed - now
+            if delay > 0:
+                time.sleep(delay)
+
+        path = scrubUrl(url).split("?", 1)[0]
+        if path != entry["u"].split("?", 1)[0]:
+            logger.warning("Replay mismatch: request %s, recorded %s", path, entry["u"])
+        if "e" in entry:
+            raise getattr(requests, entry["e"], requests.ConnectionError)("Replayed " + entry["e"])
+        return ReplayResponse(url, entry["s"], entry["b"])
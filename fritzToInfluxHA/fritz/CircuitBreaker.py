@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""Module CircuitBreaker
+
+This module includes a circuit breaker protecting the Fritz!Box from
+requests while it is not reachable.
+
+After a number of consecutive failures, the circuit is opened and requests
+are rejected until a retry time is reached. The delay grows exponentially
+with jitter for every failed retry. The first request after the delay
+(half-open state) decides whether the circuit is closed again or reopened.
+"""
+import time
+import random
+from enum import Enum
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Circuit states
+class CircuitState(Enum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+class CircuitBreaker:
+    """
+    Class representing a circuit breaker with jittered exponential backoff
+    """
+    def __init__(self, failureThreshold=3, baseDelay=2.0, maxDelay=600.0, jitter=0.2):
+        """
+        Constructor for CircuitBreaker
+
+        failureThreshold: number of consecutive failures which open the circuit
+        baseDelay:        delay in seconds after the circuit has been opened the first time
+        maxDelay:         maximum delay in seconds
+        jitter:           relative random variation of the delay (0.2 = +/-20%)
+        """
+        self.failureThreshold = failureThreshold
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self.jitter = jitter
+
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.consecutiveOpens = 0
+        self.retryAt = 0.0
+
+        self.totalFailures = 0
+        self.totalOpens = 0
+
+    def allowRequest(self):
+        """
+        Check whether a request may be sent
+
+        If the delay of an open circuit has passed, the circuit becomes half-open
+        and the request is allowed as probe.
+        """
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() < self.retryAt:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            logger.info("Circuit half-open: probing Fritz!Box")
+        return True
+
+    @property
+    def closed(self):
+        """
+        True if requests are sent normally, i.e. neither rejected nor probing
+        """
+        return self.state == CircuitState.CLOSED
+
+    def recordSuccess(self):
+        """
+        Record a successful request
+        """
+        if self.state != CircuitState.CLOSED:
+            logger.info("Circuit closed: Fritz!Box reachable again")
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.consecutiveOpens = 0
+
+    def recordFailure(self):
+        """
+        Record a failed request and open the circuit if required
+        """
+        self.failures = self.failures + 1
+        self.totalFailures = self.totalFailures + 1
+        if self.state == CircuitState.HALF_OPEN or self.failures >= self.failureThreshold:
+            self.open()
+
+    def open(self):
+        """
+        Open the circuit and calculate the retry time
+        """
+        delay = min(self.maxDelay, self.baseDelay * (2 ** self.consecutiveOpens))
+        delay = delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.retryAt = time.monotonic() + delay
+        self.state = CircuitState.OPEN
+        self.consecutiveOpens = self.consecutiveOpens + 1
+        self.totalOpens = self.totalOpens + 1
+        logger.warning("Circuit open after %s failures: next retry in %.1f sec.", self.failures, delay)
+
+    def retryIn(self):
+        """
+        Return the number of seconds until requests are allowed again
+        """
+        if self.state != CircuitState.OPEN:
+            return 0.0
+        return max(0.0, self.retryAt - time.monotonic())
+
+    def getMetrics(self):
+        """
+        Return metrics of the circuit breaker
+        """
+        return {
+            "breakerState" : self.state.value,
+            "breakerFailures" : self.failures,
+            "breakerTotalFailures" : self.totalFailures,
+            "breakerTotalOpens" : self.totalOpens,
+        }
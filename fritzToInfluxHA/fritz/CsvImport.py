@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""Module CsvImport
+
+This module includes a class for importing CSV files written by
+FritzBox.writeDataToCsv into InfluxDB.
+
+Files (optionally gzip-compressed) are streamed in chunks of rows,
+so that memory consumption does not depend on the file size.
+Chunks are written by parallel workers. After each chunk which has been
+written completely together with all preceding chunks, the number of
+imported rows is saved in a checkpoint file so that an interrupted
+import can be resumed.
+"""
+import os
+import csv
+import gzip
+import json
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .LineProtocol import seriesKey, timestamp, LineBuffer
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Columns written by FritzBox.writeDataToCsv
+CSVCOLUMNS = ["Time", "AIn", "Type", "Name", "Location", "Sublocation", "State", "Present", "Voltage", "Power", "Energy", "Temperature"]
+
+# Measurements by CSV column with default state tag (see FritzHaDevice.MEASUREMENTS)
+_MEASUREMENTS = (
+    ("voltage", 8, None),
+    ("power", 9, None),
+    ("energy", 10, None),
+    ("temperature", 11, "1"),
+)
+
+class CsvImportError(Exception):
+    """
+    Base exception class for this module
+    """
+    def __init__(self, message="Error while importing CSV file"):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+class CsvImport:
+    """
+    Class representing an import of CSV files into InfluxDB
+    """
+    def __init__(self, sink, org, bucket, precision="s", batchRows=5000, workers=4):
+        """
+        Constructor for CsvImport
+
+        sink:      object with write() method, e.g. InfluxSink
+        batchRows: number of CSV rows per write request
+        workers:   number of parallel write requests
+        """
+        self.sink = sink
+        self.org = org
+        self.bucket = bucket
+        self.precision = precision
+        self.batchRows = batchRows
+        self.workers = workers
+        self._seriesKeys = {}
+
+        self.rows = 0
+        self.points = 0
+        self.skipped = 0
+
+    @staticmethod
+    def checkpointFile(path):
+        """
+        Return the path of the checkpoint file for a CSV file
+        """
+        return path + ".checkpoint"
+
+    def readCheckpoint(self, path):
+        """
+        Return the number of rows already imported from the given CSV file
+        """
+        cpFile = self.checkpointFile(path)
+        if not os.path.exists(cpFile):
+            return 0
+        with open(cpFile, 'r') as f:
+            cp = json.load(f)
+        return cp["rows"]
+
+    def writeCheckpoint(self, path, rows, complete=False):
+        """
+        Save the number of rows imported from the given CSV file
+        """
+        cpFile = self.checkpointFile(path)
+        tmpFile = cpFile + ".tmp"
+        with open(tmpFile, 'w') as f:
+            json.dump({"rows" : rows, "complete" : complete}, f)
+        os.replace(tmpFile, cpFile)
+
+    def getSeriesKey(self, measurement, ain, location, sublocation, state):
+        """
+        Return the series key for the given measurement and tags from a cache
+        """
+        ref = (measurement, ain, location, sublocation, state)
+        key = self._seriesKeys.get(ref)
+        if key is None:
+            key = seriesKey(measurement, {
+                "ain" : ain,
+                "location" : location,
+                "sublocation" : sublocation,
+                "state" : state
+            })
+            self._seriesKeys[ref] = key
+        return key
+
+    def convertRow(self, row, buffer):
+        """
+        Append the measurements of one CSV row to the given LineBuffer
+
+        Like FritzHaDevice.serializeMeasurements, empty and zero values are not written.
+        """
+        if len(row) < len(CSVCOLUMNS) or row[0] == "":
+            self.skipped = self.skipped + 1
+            return
+        try:
+            # Times in CSV files are local times
+            ts = timestamp(datetime.datetime.fromisoformat(row[0]), self.precision)
+        except ValueError:
+            self.skipped = self.skipped + 1
+            return
+        for measurement, col, defaultState in _MEASUREMENTS:
+            txt = row[col]
+            if txt == "":
+                continue
+            try:
+                value = float(txt)
+            except ValueError:
+                continue
+            if not value:
+                continue
+            state = row[6]
+            if not state and defaultState:
+                state = defaultState
+            buffer.append(self.getSeriesKey(measurement, row[1], row[4], row[5], state), value, ts)
+
+    def writeBatch(self, payload):
+        """
+        Write one batch of line protocol data
+        """
+        if len(payload) > 0:
+            self.sink.write(bucket=self.bucket, org=self.org, record=payload, write_precision=self.precision)
+
+    def importFile(self, path):
+        """
+        Import one CSV file, resuming from its checkpoint
+        """
+        done = self.readCheckpoint(path)
+        if done > 0:
+            logger.info("Resuming import of %s after %s rows", path, done)
+        else:
+            logger.info("Importing %s", path)
+
+        if path.endswith(".gz"):
+            f = gzip.open(path, 'rt', newline='')
+        else:
+            f = open(path, 'r', newline='')
+
+        pending = deque()
+        with f, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            if header[0:len(CSVCOLUMNS)] != CSVCOLUMNS:
+                raise CsvImportError("Unexpected CSV header in " + path + ": " + ",".join(header))
+
+            rowNo = 0
+            buffer = LineBuffer()
+            batchRows = 0
+            for row in reader:
+                rowNo = rowNo + 1
+                if rowNo <= done:
+                    continue
+                self.convertRow(row, buffer)
+                batchRows = batchRows + 1
+                if batchRows >= self.batchRows:
+                    self.submit(executor, pending, path, buffer, rowNo)
+                    buffer = LineBuffer()
+                    batchRows = 0
+            self.submit(executor, pending, path, buffer, rowNo)
+            while pending:
+                self.complete(pending, path)
+        self.writeCheckpoint(path, rowNo, True)
+        logger.info("Import of %s completed: %s rows", path, rowNo)
+
+    def submit(self, executor, pending, path, buffer, rowNo):
+        """
+        Submit a batch to the workers
+
+        At most one batch per worker is queued, so that memory stays bounded.
+        """
+        while len(pending) >= self.workers:
+            self.complete(pending, path)
+        pending.append((executor.submit(self.writeBatch, buffer.getvalue()), rowNo, len(buffer)))
+
+    def complete(self, pending, path):
+        """
+        Wait for the oldest batch and save the checkpoint
+
+        Points are counted only after they have been written.
+        """
+        future, rowNo, points = pending.popleft()
+        future.result()
+        self.rows = rowNo
+        self.points = self.points + points
+        self.writeCheckpoint(path, rowNo)
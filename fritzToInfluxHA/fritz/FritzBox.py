@@ -25,14 +25,14 @@
 This module includes classes for an abstraction of a Fritz!Box.
 """
 import requests
-import hashlib
 import os
 import xml.etree.ElementTree as ET
-from enum import Enum
 import datetime
-import influxdb_client
-from .FritzHaDevice import FritzHaDevice
-from .FritzHaDevice import FritzHaDeviceInfluxWriteError
+from .FritzHaDevice import FritzHaDevice, defaultMeasurements as allMeasurements
+from .AhaDecoder import HaDeviceType, normalizeAin, decodeType, decodeValues
+from .CircuitBreaker import CircuitBreaker
+from .LoginResponse import loginResponse, isPbkdf2Challenge
+from .SampleIdentity import alignTime
 
 #Setup logging
 import logging
@@ -40,13 +40,6 @@ import logging_plus
 logger = logging_plus.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
-# Supported device types
-class HaDeviceType(Enum):
-    SWITCH = 1
-    REPEATER = 2
-    LAMP = 3
-    UNKNOWN = 9
-
 class FritzBoxError(Exception):
     """
     Base exception class for this module
@@ -68,6 +61,20 @@ class FritzBoxConnectionError(FritzBoxIgnoreableError):
     def __init__(self):
         self.message = "Fritz!Box cannot be reached"
 
+class FritzBoxCircuitOpenError(FritzBoxIgnoreableError):
+    """
+    Fritzbox exception class for requests rejected by the circuit breaker
+    """
+    def __init__(self):
+        self.message = "Fritz!Box request rejected: circuit open"
+
+class FritzBoxResponseError(FritzBoxIgnoreableError):
+    """
+    Fritzbox exception class for failed or invalid responses, e.g. while the Fritz!Box is booting
+    """
+    def __init__(self):
+        self.message = "Fritz!Box request failed: no valid response"
+
 class FritzBoxLoginError(FritzBoxError):
     """
     Fritzbox Login exception class for this module
@@ -85,10 +92,31 @@ class FritzBoxNoDeviceError(FritzBoxError):
 class FritzBox:
     """
     Class representing a Fritz!Box
+
+    The session is logged off with terminate() or at the end of a with statement.
     """
-    def __init__(self, url, user, pwd):
+    def __init__(self, url, user, pwd, autoMonitor=False, defaultMeasurements=None, breaker=None, timeout=10, transport=None, alignment=0, removeAfter=3):
         """
         Constructor for Fritz!Box
+
+        autoMonitor specifies whether devices found during runtime without
+        configuration shall be monitored with defaultMeasurements.
+        breaker is the CircuitBreaker protecting requests to the Fritz!Box.
+        Connection errors are recorded as failures. Success is recorded by the caller
+        after a complete measurement cycle so that login errors keep the backoff.
+        The breaker may be shared with a later instance after a failed login.
+        timeout is the timeout in seconds for requests.
+        transport provides get(url, timeout) like requests.Session,
+        e.g. a ReplayTransport, or is a function returning such a transport
+        for the HTTP session of the instance, e.g. CaptureRecorder.wrap.
+        Default is the HTTP session of the instance (attribute session),
+        which can be shared with other collectors, e.g. Tr064Collector.
+        alignment is the grid in seconds to which measurement times are truncated
+        (0 = no alignment), so that repeated queries within one interval
+        give samples with identical timestamps.
+        removeAfter is the number of consecutive cycles in which a device must be
+        missing from the device list before it is removed, so that devices are
+        kept while the Fritz!Box reports an incomplete list (e.g. after a reboot).
         """
         self.url = url
         if self.url[-1] != "/":
@@ -98,6 +126,32 @@ class FritzBox:
         self.user = user
         self.pwd = pwd
         self.devices = []
+        self.deviceConfig = []
+        self.addedDevices = []
+        self.removedDevices = []
+        # Number of consecutive cycles in which a device has been missing, by AIN
+        self.missingCycles = {}
+        self.removeAfter = max(1, removeAfter)
+        self.autoMonitor = autoMonitor
+        self.alignment = alignment
+        self.defaultMeasurements = defaultMeasurements
+        if self.defaultMeasurements is None:
+            self.defaultMeasurements = allMeasurements()
+
+        self.breaker = breaker
+        if self.breaker is None:
+            self.breaker = CircuitBreaker()
+        self.timeout = timeout
+        # Pooled keep-alive connections to the Fritz!Box, closed by terminate()
+        self.session = requests.Session()
+        if transport is None:
+            self.transport = self.session
+        elif callable(transport):
+            self.transport = transport(self.session)
+        else:
+            self.transport = transport
+        # Set after connection errors: new login is required before next request
+        self.outage = False
 
         self.loginSuccess = False
 
@@ -118,22 +172,37 @@ class FritzBox:
                 raise FritzBoxNoDeviceError
                 
         except FritzBoxError:
+            # Do not leave a session open if the instance is not returned
+            self.terminate()
             raise
 
-    def __del__(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
         self.terminate()
 
     def terminate(self):
-        self.logoff()
+        """
+        Log off if logged in and close the HTTP session
+        """
+        if self.sid != "0000000000000000":
+            try:
+                self.logoff()
+            except FritzBoxError:
+                # Fritz!Box not reachable: session will expire
+                pass
+            self.sid = "0000000000000000"
+        self.session.close()
 
     def login(self):
         """
         Login with Session-ID
         """
         #Try login with current sid
-        theUrl = self.url + "login_sid.lua" + "?sid=" + self.sid
-        resp = self.sendRequest(theUrl)
-        root = ET.fromstring(resp)
+        #version=2 requests a PBKDF2 challenge. Older Fritz!OS versions ignore it and send MD5 challenges
+        theUrl = self.url + "login_sid.lua" + "?version=2&sid=" + self.sid
+        root = self.parseResponse(self.sendRequest(theUrl))
         if root.findtext("SID") == "0000000000000000":
             #invalid SID. Need to get new SID
             challenge = root.findtext("Challenge")
@@ -154,18 +223,21 @@ class FritzBox:
         """
         Get the session ID
         """
-        md5 = hashlib.md5()
-        md5.update(challenge.encode('utf-16le'))
-        md5.update('-'.encode('utf-16le'))
-        md5.update(self.pwd.encode('utf-16le'))
-        response = challenge + '-' + md5.hexdigest()
-        theUrl = f"{self.url}login_sid.lua?username={self.user}&response={response}"
-        resp = self.sendRequest(theUrl)
-        if resp:
-            root = ET.fromstring(resp)
-            self.sid = root.findtext("SID")
-            logger.debug("SID: %s", self.sid)
+        if isPbkdf2Challenge(challenge):
+            logger.debug("Login with PBKDF2 challenge")
         else:
+            logger.debug("Login with MD5 challenge")
+        try:
+            response = loginResponse(challenge, self.pwd)
+        except ValueError as error:
+            logger.error("%s", error)
+            raise FritzBoxLoginError
+        theUrl = f"{self.url}login_sid.lua?version=2&username={self.user}&response={response}"
+        root = self.parseResponse(self.sendRequest(theUrl))
+        self.sid = root.findtext("SID")
+        logger.debug("SID: %s", self.sid)
+        if not self.sid or self.sid == "0000000000000000":
+            self.sid = "0000000000000000"
             raise FritzBoxLoginError
 
     def sendRequest(self, url):
@@ -173,25 +245,43 @@ class FritzBox:
         Send a request with given URL and return response
         """
         logger.debug("Request URL: %s", url)
+        if not self.breaker.allowRequest():
+            raise FritzBoxCircuitOpenError
         try:
-            resp = requests.get(url)
-            if resp.status_code == requests.codes.OK:
-                respTxt = resp.text.strip()
-                logger.debug("Response: %s", respTxt)
-                return respTxt
-            else:
-                logger.error("HTTP request [%s] failed with status code %s reason %s", resp.url, resp.status_code, resp.reason)
-                resp.raise_for_status
-                return None
+            resp = self.transport.get(url, timeout=self.timeout)
         except (requests.ConnectionError, \
                 requests.ConnectTimeout, \
                 requests.ReadTimeout \
         ):
-            if self.loginSuccess:
-                # Ignore connection error if FritzBox is temporarily not reacheable
-                raise FritzBoxConnectionError
-            else:
-                raise
+            # Ignore connection error if FritzBox is temporarily not reacheable
+            self.breaker.recordFailure()
+            self.outage = True
+            raise FritzBoxConnectionError
+
+        if resp.status_code == requests.codes.OK:
+            respTxt = resp.text.strip()
+            logger.debug("Response: %s", respTxt)
+            return respTxt
+        else:
+            logger.error("HTTP request [%s] failed with status code %s reason %s", resp.url, resp.status_code, resp.reason)
+            return None
+
+    def parseResponse(self, resp):
+        """
+        Return the XML root element of a response
+
+        Failed requests (sendRequest returned None) and invalid XML are
+        recorded as failures of the circuit breaker and raise FritzBoxResponseError,
+        so that they are retried like connection errors.
+        """
+        if resp is not None:
+            try:
+                return ET.fromstring(resp)
+            except ET.ParseError as error:
+                logger.error("Invalid response from Fritz!Box: %s", error)
+        self.breaker.recordFailure()
+        self.outage = True
+        raise FritzBoxResponseError
 
     def getHaDevices(self):
         """
@@ -200,58 +290,119 @@ class FritzBox:
         # Get the device list infos
         # This is preferred to get switch list because it includes all devices
         theUrl = self.url + "webservices/homeautoswitch.lua" + "?switchcmd=getdevicelistinfos&sid=" + self.sid
-        resp = self.sendRequest(theUrl)
-        root = ET.fromstring(resp)
+        root = self.parseResponse(self.sendRequest(theUrl))
 
         # Loop through devices
         for dev in root:
-            ain = dev.attrib['identifier']
-            ain = ain.strip()
-            ain = ain.replace(" ", "")
-            product = dev.attrib['productname']
-            haDev = FritzHaDevice(ain)
-
-            if product == "FRITZ!DECT 200" or product == "FRITZ!DECT 210":
-                haDev.type = HaDeviceType.SWITCH
-                haDev.hasState = True
-                switch = dev.find("switch")
-                haDev.state = switch.findtext("state")
-            elif product == "FRITZ!DECT Repeater 100":
-                haDev.type = HaDeviceType.REPEATER
-                haDev.hasTemperature = True
-            else:
-                haDev.type = HaDeviceType.UNKNOWN
-
-            haDev.name = dev.findtext("name")
-            haDev.present = dev.findtext("present")
+            self.devices.append(self.createHaDevice(dev))
 
-            if dev.find("powermeter"):
-                haDev.hasPower = True
-            if dev.find("temperature"):
-                haDev.hasTemperature = True
+    def createHaDevice(self, dev):
+        """
+        Create a Home Automation device from its device element of the device list
+        """
+        haDev = FritzHaDevice(normalizeAin(dev.attrib['identifier']))
+        decodeType(dev, haDev)
+        decodeValues(dev, haDev)
+        return haDev
 
-            self.devices.append(haDev)
+    def addHaDevice(self, dev):
+        """
+        Add a device which has been paired with the Fritz!Box during runtime
+        
+        The device is completed from configuration data, if available.
+        Otherwise, it is monitored with default measurements if autoMonitor is set.
+        """
+        haDev = self.createHaDevice(dev)
+        ref = None
+        for cand in self.deviceConfig:
+            if cand["ain"] == haDev.ain:
+                ref = cand
+                break
+        if ref:
+            haDev.completeData(ref)
+        elif self.autoMonitor:
+            haDev.completeData({"measurements" : dict(self.defaultMeasurements)})
+        self.devices.append(haDev)
+        logger.info("New device found ain=%s name=%s monitored=%s", haDev.ain, haDev.name, haDev.isMonitored)
+        return haDev
 
     def completeDeviceData(self, data):
         """
         Complete device data with given data        
         """
+        self.deviceConfig = data
         for dev in self.devices:
             ain = dev.ain
             for ref in data:
                 if ref["ain"] == ain:
                     dev.completeData(ref)
     
-    def evaluateDeviceInfo(self):
+    def updateDeviceData(self, data):
+        """
+        Update device data incrementally from changed configuration data
+
+        Returns lists of AINs for devices which have been added to monitoring,
+        changed or removed from monitoring.
+        Monitored devices without configuration keep being monitored with
+        default measurements if autoMonitor is set.
+        """
+        self.deviceConfig = data
+        added = []
+        changed = []
+        removed = []
+        for dev in self.devices:
+            ref = None
+            for cand in data:
+                if cand["ain"] == dev.ain:
+                    ref = cand
+                    break
+            if ref:
+                if dev.configChanged(ref):
+                    if dev.isMonitored:
+                        changed.append(dev.ain)
+                    else:
+                        added.append(dev.ain)
+                    dev.resetData()
+                    dev.completeData(ref)
+            elif dev.isMonitored and self.autoMonitor:
+                # Monitored without configuration: keep monitoring with default measurements
+                default = {"measurements" : dict(self.defaultMeasurements)}
+                if dev.configChanged(default):
+                    changed.append(dev.ain)
+                    dev.resetData()
+                    dev.completeData(default)
+            elif dev.isMonitored:
+                dev.resetData()
+                removed.append(dev.ain)
+        return added, changed, removed
+
+    def cycleTime(self):
+        """
+        Return the time zone aware timestamp of a measurement cycle starting now,
+        aligned as configured
+        """
+        return alignTime(datetime.datetime.now(datetime.timezone.utc), self.alignment)
+
+    def evaluateDeviceInfo(self, measurementTime=None):
         """
         Query device info from Fritzbox and update devices with measurements
+
+        measurementTime: timestamp of the measurements of this cycle (Default: cycleTime())
         """
         # Reset device upToDate status
         for sdev in self.devices:
             sdev.upToDate = False
             
         try:
-            measurementTime = datetime.datetime.now()
+            if self.outage:
+                # Fritz!Box may have been rebooted: new login before device query
+                self.login()
+                self.outage = False
+                logger.info("Fritz!Box session recovered after outage")
+
+            # One time zone aware timestamp shared by all devices of this cycle
+            if measurementTime is None:
+                measurementTime = self.cycleTime()
             theUrl = self.url + "webservices/homeautoswitch.lua" + "?switchcmd=getdevicelistinfos&sid=" + self.sid
             resp = self.sendRequest(theUrl)
             if not resp:
@@ -264,35 +415,45 @@ class FritzBox:
                     logger.error("Error sending request for getdevicelistinfos after successful login")
                     raise FritzBoxError
 
-            root = ET.fromstring(resp)
+            root = self.parseResponse(resp)
+            known = {}
+            for sdev in self.devices:
+                known[sdev.ain] = sdev
+            found = set()
+            self.addedDevices = []
+            self.removedDevices = []
             for dev in root:
-                ain = dev.attrib['identifier']
-                ain = ain.strip()
-                ain = ain.replace(" ", "")
-                device = None
-                for sdev in self.devices:
-                    if sdev.ain == ain:
-                        device = sdev
-                        break
-                if device:
-                    powermeter = dev.find("powermeter")
-                    if powermeter:
-                        voltage = powermeter.findtext("voltage")
-                        if voltage:
-                            device.voltage = int(voltage)/1000
-                        power = powermeter.findtext("power")
-                        if power:
-                            device.power = int(power)/1000
-                        energy = powermeter.findtext("energy")
-                        if energy:
-                            device.energy = int(energy)/1000
-                    temperature = dev.find("temperature")
-                    if temperature:
-                        celsius = temperature.findtext("celsius")
-                        if celsius:
-                            device.temperature = int(celsius)/10
-                    device.measurementTime = measurementTime
-                    device.upToDate = True
+                ain = normalizeAin(dev.attrib['identifier'])
+                found.add(ain)
+                device = known.get(ain)
+                if not device:
+                    device = self.addHaDevice(dev)
+                    self.addedDevices.append(device)
+                else:
+                    decodeValues(dev, device)
+                device.measurementTime = measurementTime
+                device.upToDate = True
+
+            # Remove devices which are no longer registered at the Fritz!Box.
+            # An empty list is reported while the Fritz!Box is starting: keep all devices
+            if len(found) == 0 and len(self.devices) > 0:
+                logger.warning("Empty device list from Fritz!Box: %s devices kept", len(self.devices))
+                return
+            missingCycles = {}
+            for sdev in self.devices:
+                if sdev.ain in found:
+                    continue
+                missing = self.missingCycles.get(sdev.ain, 0) + 1
+                if missing >= self.removeAfter:
+                    logger.warning("Device no longer found ain=%s name=%s", sdev.ain, sdev.name)
+                    self.removedDevices.append(sdev)
+                else:
+                    logger.info("Device missing in device list (%s) ain=%s name=%s", missing, sdev.ain, sdev.name)
+                    missingCycles[sdev.ain] = missing
+            self.missingCycles = missingCycles
+            if len(self.removedDevices) > 0:
+                removed = set(sdev.ain for sdev in self.removedDevices)
+                self.devices = [sdev for sdev in self.devices if sdev.ain not in removed]
 
         except FritzBoxError as error:
             raise
@@ -301,15 +462,17 @@ class FritzBox:
         """
         Write measurement values to a csv file
         """
-        f = None
         newFile=True
         if os.path.exists(fp):
             newFile = False
-        if newFile:
-            f = open(fp, 'w')
-        else:
-            f = open(fp, 'a')
-        logger.debug("File opened: %s", fp)
+        with open(fp, 'a') as f:
+            logger.debug("File opened: %s", fp)
+            self.writeCsvLines(f, newFile)
+
+    def writeCsvLines(self, f, newFile):
+        """
+        Write measurement values to the given open csv file
+        """
 
         sep = ","
         if newFile:
@@ -332,7 +495,7 @@ class FritzBox:
             if dev.upToDate:
                 txt = ""
                 if dev.measurementTime:
-                    ts = dev.measurementTime.strftime("%Y-%m-%d %H:%M:%S.%f")
+                    ts = dev.measurementTime.astimezone().strftime("%Y-%m-%d %H:%M:%S.%f")
                     txt = txt + ts + sep
                 else:
                     txt = txt + sep
@@ -380,18 +543,4 @@ class FritzBox:
                     txt = txt + format(dev.temperature)
                 txt = txt + "\n"
                 f.write(txt)
-
-        f.close()
-
-    def writeDataToInflux(self, write_api, org, bucket):
-        """
-        Write measurements to InfluxDB
-        """
-        try:
-            for dev in self.devices:
-                if dev.isMonitored:
-                    dev.writeMeasurmentsToInfluxDB(write_api, org, bucket)
-        except FritzHaDeviceInfluxWriteError as error:
-            logger.error("Error: %s", error.message)
-            raise FritzBoxIgnoreableError
             
\ No newline at end of file
@@ -6,8 +6,7 @@ This module includes classes for an abstraction of a Fritz Home Automation devic
 
 #Setup logging
 from math import fabs
-import influxdb_client
-from influxdb_client.client.write_api import WritePrecision
+from .LineProtocol import seriesKey, timestamp, formatLine, LineBuffer
 import logging
 import logging_plus
 
@@ -28,6 +27,25 @@ class FritzHaDeviceInfluxWriteError(FritzHaDeviceError):
     def __init__(self):
         self.message = "Error while writing data to InfluxDB"
 
+# Supported measurements: (measurement, device attribute, write zero values, default state tag)
+MEASUREMENTS = (
+    ("voltage", "voltage", False, None),
+    ("power", "power", False, None),
+    ("energy", "energy", False, None),
+    ("temperature", "temperature", False, "1"),
+    ("tist", "tist", True, None),
+    ("tsoll", "tsoll", True, None),
+    ("battery", "battery", True, None),
+    ("humidity", "humidity", True, None),
+    ("level", "level", True, None),
+)
+
+def defaultMeasurements():
+    """
+    Return a measurement configuration with all supported measurements enabled
+    """
+    return {measurement : True for measurement, attr, writeZero, defaultState in MEASUREMENTS}
+
 class FritzHaDevice:
     """
     Class representing a Fritz Home Automation device
@@ -49,19 +67,28 @@ class FritzHaDevice:
         self.power = None
         self.energy = None
         self.temperature = None
+        self.tist = None
+        self.tsoll = None
+        self.battery = None
+        self.humidity = None
+        self.level = None
         self.measurementTime = None
 
+        self.functionBitmask = None
         self.hasState = False
         self.hasTemperature = False
         self.hasPower = False
+        self.hasThermostat = False
+        self.hasHumidity = False
+        self.hasLevel = False
 
         self.measureVoltage = False
         self.measurements = {}
 
         self.isMonitored = False
 
-    def __del__(self):
-        pass
+        # Precompiled series keys per (measurement, state)
+        self._seriesKeys = {}
 
     def completeData(self, data):
         """
@@ -73,53 +100,95 @@ class FritzHaDevice:
             self.sublocation = data["sublocation"]
         if "measurements" in data:
             self.measurements = data["measurements"]
-        self.isMonitored = True            
+        self.isMonitored = True
+        # Tags may have changed: series keys need to be rebuilt
+        self._seriesKeys = {}
+
+    def resetData(self):
+        """
+        Reset data from configuration
+        """
+        self.location = None
+        self.sublocation = None
+        self.measurements = {}
+        self.isMonitored = False
+        self._seriesKeys = {}
+
+    def configChanged(self, data):
+        """
+        Check whether given configuration data differ from current device data
+        """
+        if not self.isMonitored:
+            return True
+        return self.location != data.get("location") \
+            or self.sublocation != data.get("sublocation") \
+            or self.measurements != data.get("measurements", {})
 
-    def writeMeasurmentsToInfluxDB(self, write_api, org, bucket):
-        ts = self.measurementTime.strftime("%Y-%m-%dT%H:%M:%S.%f+02")
+    def getSeriesKey(self, measurement, state):
+        """
+        Return the precompiled series key for a measurement and device state
+        """
+        key = self._seriesKeys.get((measurement, state))
+        if key is None:
+            key = seriesKey(measurement, {
+                "ain" : self.ain,
+                "location" : self.location,
+                "sublocation" : self.sublocation,
+                "state" : state
+            })
+            self._seriesKeys[(measurement, state)] = key
+        return key
+
+    def serializeMeasurements(self, buffer, precision="ns"):
+        """
+        Append measurements in line protocol to the given LineBuffer
+
+        The measurement time is written as timestamp with the given precision.
+        """
+        for measurement, line in self.measurementLines(precision):
+            buffer.appendLine(line)
+
+    def measurementValues(self):
+        """
+        Return (measurement, value, state tag) for all measurements to be written
+        """
+        if not self.upToDate:
+            return
+        for measurement, attr, writeZero, defaultState in MEASUREMENTS:
+            if self.measurements.get(measurement):
+                value = getattr(self, attr)
+                if value is None or (not value and not writeZero):
+                    continue
+                state = self.state
+                if not state and defaultState:
+                    state = defaultState
+                yield measurement, value, state
+
+    def measurementLines(self, precision="ns"):
+        """
+        Return (measurement, line) for all measurements to be written
+
+        Lines are formatted once, so that they can be routed to several destinations.
+        """
+        if not self.upToDate:
+            return
+        ts = None
+        if self.measurementTime:
+            ts = timestamp(self.measurementTime, precision)
+
+        for measurement, value, state in self.measurementValues():
+            line = formatLine(self.getSeriesKey(measurement, state), value, ts)
+            if line:
+                yield measurement, line
+
+    def writeMeasurmentsToInfluxDB(self, write_api, org, bucket, precision="ns"):
+        """
+        Write measurements of this device to InfluxDB
+        """
         try:
-            if self.upToDate:
-                if "voltage" in self.measurements:
-                    if self.measurements["voltage"] and self.voltage:
-                        point = influxdb_client.Point("voltage") \
-                            .tag("ain", self.ain) \
-                            .tag("location", self.location) \
-                            .tag("sublocation", self.sublocation) \
-                            .tag("state", self.state) \
-                            .field("value", self.voltage)
-                        write_api.write(bucket=bucket, org=org, record=point)
-
-                if "power" in self.measurements:
-                    if self.measurements["power"] and self.power:
-                        point = influxdb_client.Point("power") \
-                            .tag("ain", self.ain) \
-                            .tag("location", self.location) \
-                            .tag("sublocation", self.sublocation) \
-                            .tag("state", self.state) \
-                            .field("value", self.power)
-                        write_api.write(bucket=bucket, org=org, record=point)
-
-                if "energy" in self.measurements:
-                    if self.measurements["energy"] and self.energy:
-                        point = influxdb_client.Point("energy") \
-                            .tag("ain", self.ain) \
-                            .tag("location", self.location) \
-                            .tag("sublocation", self.sublocation) \
-                            .tag("state", self.state) \
-                            .field("value", self.energy)
-                        write_api.write(bucket=bucket, org=org, record=point)
-
-                if "temperature" in self.measurements:
-                    if self.measurements["temperature"] and self.temperature:
-                        state = self.state
-                        if not state:
-                            state = "1"
-                        point = influxdb_client.Point("temperature") \
-                            .tag("ain", self.ain) \
-                            .tag("location", self.location) \
-                            .tag("sublocation", self.sublocation) \
-                            .tag("state", state) \
-                            .field("value", self.temperature)
-                        write_api.write(bucket=bucket, org=org, record=point)
+            buffer = LineBuffer()
+            self.serializeMeasurements(buffer, precision)
+            if len(buffer) > 0:
+                write_api.write(bucket=bucket, org=org, record=buffer.getvalue(), write_precision=precision)
         except Exception:
             raise FritzHaDeviceInfluxWriteError
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+"""Module InfluxRouter
+
+This module includes classes for routing measurements to several InfluxDB destinations.
+
+Each destination (InfluxDB instance, organization and bucket) has its own sink
+with its own HTTP session, a batch buffer and a retry policy.
+Routes are configured per device and optionally per measurement.
+Every line is formatted only once and appended to the buffers of all
+destinations it is routed to.
+"""
+import time
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class InfluxDestination:
+    """
+    Class representing an InfluxDB destination with batch buffer and retry policy
+    """
+    def __init__(self, name, sink, org, bucket, retryAttempts=1, retryDelay=1.0, maxBufferLines=100000):
+        """
+        Constructor for InfluxDestination
+
+        sink:           object with write() method, e.g. InfluxSink
+        retryAttempts:  number of write attempts per cycle
+        retryDelay:     delay in seconds between attempts
+        maxBufferLines: maximum number of lines kept for the next cycle
+                        if writing fails. Oldest lines are dropped.
+        """
+        self.name = name
+        self.sink = sink
+        self.org = org
+        self.bucket = bucket
+        self.retryAttempts = max(1, retryAttempts)
+        self.retryDelay = retryDelay
+        self.maxBufferLines = maxBufferLines
+
+        self.buffer = bytearray()
+        self.lines = 0
+
+        self.written = 0
+        self.errors = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def check(self):
+        """
+        Check that the destination is reachable and writable
+
+        Raises the error of the sink, e.g. InfluxSinkError.
+        """
+        self.sink.check(self.bucket, self.org)
+
+    def append(self, line):
+        """
+        Append one line to the batch buffer
+        """
+        self.buffer += line
+        self.lines = self.lines + 1
+
+    def restore(self, record):
+        """
+        Put lines which have not been written back in front of the batch buffer
+        """
+        if record:
+            self.buffer[:0] = record
+            self.lines = self.lines + record.count(b"\n")
+
+    def flush(self, precision):
+        """
+        Write the batch buffer
+
+        Returns False if all attempts have failed. Lines are then kept for the next cycle.
+        Lines of earlier writes returned by the sink with the error
+        (e.g. by WriterSupervisor) are kept as well.
+        Lines rejected with a permanent error (attribute permanent of the error,
+        e.g. invalid data or token) are dropped without further attempts.
+        """
+        if self.lines == 0:
+            return True
+        for attempt in range(1, self.retryAttempts + 1):
+            try:
+                self.sink.write(bucket=self.bucket, org=self.org, record=bytes(self.buffer), write_precision=precision)
+                self.written = self.written + self.lines
+                del self.buffer[:]
+                self.lines = 0
+                return True
+            except Exception as error:
+                self.restore(getattr(error, "record", None))
+                self.errors = self.errors + 1
+                if getattr(error, "permanent", False):
+                    # Lines not rejected have been written
+                    rejected = min(self.lines, getattr(error, "lines", self.lines))
+                    self.written = self.written + self.lines - rejected
+                    self.rejected = self.rejected + rejected
+                    del self.buffer[:]
+                    self.lines = 0
+                    logger.error("InfluxDB destination %s: %s lines rejected and dropped: %s", self.name, rejected, error)
+                    return False
+                logger.error("Error while writing to InfluxDB destination %s (attempt %s): %s", self.name, attempt, error)
+                if attempt < self.retryAttempts:
+                    time.sleep(self.retryDelay)
+        self.trim()
+        return False
+
+    def trim(self):
+        """
+        Drop the oldest lines exceeding maxBufferLines
+        """
+        excess = self.lines - self.maxBufferLines
+        if excess <= 0:
+            return
+        end = -1
+        for i in range(0, excess):
+            end = self.buffer.find(b"\n", end + 1)
+        del self.buffer[:end + 1]
+        self.lines = self.lines - excess
+        self.dropped = self.dropped + excess
+        logger.error("InfluxDB destination %s: %s lines dropped", self.name, excess)
+
+    def close(self):
+        self.sink.close()
+
+class InfluxRouter:
+    """
+    Class representing the routing of device measurements to InfluxDB destinations
+    """
+    def __init__(self, destinations, defaultNames=("default",)):
+        """
+        Constructor for InfluxRouter
+
+        destinations: list of InfluxDestination
+        defaultNames: names of destinations for devices without routes
+        """
+        self.destinations = {}
+        for dest in destinations:
+            self.destinations[dest.name] = dest
+        self.defaultRoute = tuple(self.destinations[name] for name in defaultNames if name in self.destinations)
+        self.routes = {}
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def setRoutes(self, devices):
+        """
+        Set routes from the device configuration
+
+        The "destinations" of a device are a list of destination names
+        (all measurements) or {"destination": name, "measurements": [...]}.
+        Devices without "destinations" are routed to the default destinations.
+        """
+        self.routes = {}
+        for dev in devices:
+            dests = dev.get("destinations")
+            if dests is None:
+                continue
+            entries = []
+            for entry in dests:
+                if isinstance(entry, str):
+                    name = entry
+                    measurements = None
+                else:
+                    name = entry.get("destination")
+                    measurements = entry.get("measurements")
+                    if measurements is not None:
+                        measurements = frozenset(measurements)
+                dest = self.destinations.get(name)
+                if dest is None:
+                    logger.error("Unknown InfluxDB destination %s for device ain=%s", name, dev["ain"])
+                    continue
+                entries.append((dest, measurements))
+            self.routes[dev["ain"]] = entries
+        self._cache = {}
+
+    def route(self, ain, measurement):
+        """
+        Return the destinations for a measurement of a device
+        """
+        ref = (ain, measurement)
+        dests = self._cache.get(ref)
+        if dests is None:
+            entries = self.routes.get(ain)
+            if entries is None:
+                dests = self.defaultRoute
+            else:
+                found = []
+                for dest, measurements in entries:
+                    if (measurements is None or measurement in measurements) and dest not in found:
+                        found.append(dest)
+                dests = tuple(found)
+            self._cache[ref] = dests
+        return dests
+
+    def append(self, ain, measurement, line, source=None):
+        """
+        Append one line to the destinations of a measurement of a device
+
+        Lines derived from another measurement of the device (source) are
+        also appended to the destinations of the source measurement.
+        """
+        dests = self.route(ain, measurement)
+        if source is not None:
+            dests = dests + tuple(dest for dest in self.route(ain, source) if dest not in dests)
+        for dest in dests:
+            dest.append(line)
+
+    def writeDevices(self, devices, precision="ns"):
+        """
+        Route the measurements of the given devices and write all destinations
+        together with lines appended since the last write
+
+        Returns False if writing to any destination has failed.
+        """
+        for dev in devices:
+            if not dev.isMonitored:
+                continue
+            for measurement, line in dev.measurementLines(precision):
+                self.append(dev.ain, measurement, line)
+        ok = True
+        for dest in self.destinations.values():
+            if not dest.flush(precision):
+                ok = False
+        return ok
+
+    def takeBuffers(self):
+        """
+        Return and clear the lines buffered for retry as {destination name: lines}
+        """
+        buffers = {}
+        for name, dest in self.destinations.items():
+            if dest.lines > 0:
+                buffers[name] = bytes(dest.buffer)
+                del dest.buffer[:]
+                dest.lines = 0
+        return buffers
+
+    def restoreBuffers(self, buffers):
+        """
+        Put lines returned by takeBuffers() back into the destinations with the same name
+
+        Lines of destinations which no longer exist are dropped and logged.
+        """
+        for name, record in buffers.items():
+            dest = self.destinations.get(name)
+            if dest is None:
+                logger.error("InfluxDB destination %s removed: %s buffered lines dropped", name, record.count(b"\n"))
+                continue
+            dest.restore(record)
+            dest.trim()
+
+    def close(self):
+        """
+        Close the sinks of all destinations
+        """
+        for dest in self.destinations.values():
+            dest.close()
+
+    def getMetrics(self):
+        """
+        Return metrics summed over all destinations
+        """
+        return {
+            "routerLinesWritten" : sum(dest.written for dest in self.destinations.values()),
+            "routerLinesBuffered" : sum(dest.lines for dest in self.destinations.values()),
+            "routerLinesDropped" : sum(dest.dropped for dest in self.destinations.values()),
+            "routerLinesRejected" : sum(dest.rejected for dest in self.destinations.values()),
+            "routerErrors" : sum(dest.errors for dest in self.destinations.values()),
+        }
@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+"""Module InfluxSink
+
+This module includes classes for writing line protocol data to the InfluxDB V2 write API.
+
+Payloads are compressed with gzip above a minimum size and written with
+token-bucket rate limiting (bytes and points per second), so that backfills
+do not saturate slow links.
+Samples which have already been written (same series and timestamp) can be
+dropped before sending, so that retries and replays do not resend them.
+check() verifies reachability, token and bucket before the first write.
+"""
+import time
+import gzip
+import threading
+import requests
+from .SampleIdentity import IdentityWindow
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class InfluxSinkError(Exception):
+    """
+    Base exception class for this module
+
+    Errors are temporary unless permanent is set: sending the same lines
+    again may succeed (connection errors, timeouts, status 5xx and 429).
+    """
+    permanent = False
+
+    def __init__(self, message="Error while writing data to InfluxDB", record=None):
+        self.message = message
+        # Lines which have not been written, if not those of the failed call
+        self.record = record
+
+    def __str__(self):
+        return self.message
+
+class InfluxSinkAccessError(InfluxSinkError):
+    """
+    Exception raised if the token, organization or bucket is not valid
+
+    These errors persist until the configuration has been corrected.
+    """
+    permanent = True
+
+class InfluxSinkRejectedError(InfluxSinkError):
+    """
+    Exception raised if InfluxDB rejects lines, e.g. invalid line protocol or a field type conflict
+
+    Sending the same lines again fails as well.
+    """
+    permanent = True
+
+    def __init__(self, message="Lines rejected by InfluxDB", lines=0):
+        super().__init__(message)
+        # Number of lines rejected
+        self.lines = lines
+
+class TokenBucket:
+    """
+    Class representing a token bucket for rate limiting
+
+    Consumers may take more tokens than available. They are then delayed
+    until the debt has been refilled at the given rate.
+    The bucket may be shared by several threads.
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        Constructor for TokenBucket
+
+        rate:     tokens per second (0 = unlimited)
+        capacity: maximum number of tokens (Default: rate, i.e. 1 sec. burst)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        if self.capacity is None:
+            self.capacity = rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Consume tokens and return the time in seconds waited for them
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens = self.tokens - amount
+            if self.tokens >= 0:
+                return 0.0
+            # Sleep while holding the lock so that other threads queue up behind
+            wait = -self.tokens / self.rate
+            time.sleep(wait)
+            self.tokens = 0.0
+            self.last = time.monotonic()
+            return wait
+
+def splitLines(payload, maxBytes):
+    """
+    Split line protocol payload into chunks of at most maxBytes at line boundaries
+
+    Single lines longer than maxBytes are returned as chunk of their own.
+    """
+    if maxBytes <= 0 or len(payload) <= maxBytes:
+        yield payload
+        return
+    start = 0
+    size = len(payload)
+    while start < size:
+        end = start + maxBytes
+        if end >= size:
+            yield payload[start:]
+            return
+        cut = payload.rfind(b"\n", start, end)
+        if cut < 0:
+            cut = payload.find(b"\n", end)
+            if cut < 0:
+                yield payload[start:]
+                return
+        yield payload[start:cut + 1]
+        start = cut + 1
+
+class InfluxSink:
+    """
+    Class representing a connection to an InfluxDB V2
+
+    write() may be called from several threads.
+    """
+    def __init__(self, url, token, org, gzipLevel=6, gzipMinSize=1024, maxBytesPerSecond=0, maxPointsPerSecond=0, maxBatchBytes=1048576, timeout=10, dedupeWindow=0):
+        """
+        Constructor for InfluxSink
+
+        gzipLevel:          gzip compression level 1..9 (0 = no compression)
+        gzipMinSize:        minimum payload size in bytes for compression
+        maxBytesPerSecond:  limit for transferred bytes per second (0 = unlimited)
+        maxPointsPerSecond: limit for written points per second (0 = unlimited)
+        maxBatchBytes:      maximum uncompressed size of one request
+        timeout:            timeout in seconds for requests
+        dedupeWindow:       number of recently written sample identities kept
+                            for dropping duplicates (0 = no deduplication)
+        """
+        self.url = url
+        if self.url[-1] != "/":
+            self.url = self.url + "/"
+        self.org = org
+        self.gzipLevel = gzipLevel
+        self.gzipMinSize = gzipMinSize
+        self.maxBatchBytes = maxBatchBytes
+        self.timeout = timeout
+        self.byteBucket = TokenBucket(maxBytesPerSecond)
+        self.pointBucket = TokenBucket(maxPointsPerSecond)
+        self.window = None
+        if dedupeWindow > 0:
+            self.window = IdentityWindow(dedupeWindow)
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization" : "Token " + str(token),
+            "Content-Type" : "text/plain; charset=utf-8",
+            "Accept" : "application/json",
+        })
+
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.pointsSent = 0
+        self.bytesRaw = 0
+        self.bytesSent = 0
+        self.throttleTime = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the HTTP session
+        """
+        self.session.close()
+
+    def check(self, bucket, org=None):
+        """
+        Check that InfluxDB is reachable and the token may write to the bucket
+
+        The connection is kept in the HTTP session for the first write.
+        Raises InfluxSinkError with a diagnostic message otherwise.
+        """
+        if org is None:
+            org = self.org
+        try:
+            resp = self.session.get(self.url + "ping", timeout=self.timeout)
+        except requests.RequestException as error:
+            raise InfluxSinkError("InfluxDB %s cannot be reached: %s" % (self.url, error))
+        if resp.status_code != 204:
+            raise InfluxSinkError("InfluxDB %s ping failed with status code %s" % (self.url, resp.status_code))
+
+        # A write without points checks token, organization and bucket
+        params = {"org" : org, "bucket" : bucket}
+        try:
+            resp = self.session.post(self.url + "api/v2/write", params=params, data=b"", timeout=self.timeout)
+        except requests.RequestException as error:
+            raise InfluxSinkError("InfluxDB %s cannot be reached: %s" % (self.url, error))
+        if resp.status_code == 401:
+            raise InfluxSinkAccessError("InfluxDB %s: token is not valid" % self.url)
+        if resp.status_code == 403:
+            raise InfluxSinkAccessError("InfluxDB %s: token has no write permission for bucket %s of organization %s" % (self.url, bucket, org))
+        if resp.status_code == 404:
+            raise InfluxSinkAccessError("InfluxDB %s: organization %s or bucket %s not found: %s" % (self.url, org, bucket, resp.text.strip()))
+        # Depending on the version, a write without points is accepted or rejected as bad request
+        if resp.status_code not in (204, 400):
+            raise InfluxSinkError("InfluxDB %s write check failed with status code %s: %s" % (self.url, resp.status_code, resp.text.strip()))
+
+    def write(self, bucket, org=None, record=b"", write_precision="ns"):
+        """
+        Write line protocol data
+
+        The signature corresponds to the write API of influxdb_client
+        for records given as line protocol.
+        Chunks rejected by InfluxDB do not stop the other chunks from being
+        written; InfluxSinkRejectedError is raised afterwards.
+        """
+        if isinstance(record, str):
+            record = record.encode("utf-8")
+        if org is None:
+            org = self.org
+        if self.window:
+            record = self.window.filter(record)
+            if not record:
+                return
+        rejected = None
+        for chunk in splitLines(record, self.maxBatchBytes):
+            try:
+                self.writeChunk(bucket, org, chunk, write_precision)
+            except InfluxSinkRejectedError as error:
+                if rejected is None:
+                    rejected = error
+                else:
+                    rejected.lines = rejected.lines + error.lines
+                continue
+            if self.window:
+                self.window.add(chunk)
+        if rejected is not None:
+            raise rejected
+
+    def writeChunk(self, bucket, org, chunk, precision):
+        """
+        Compress, throttle and send one chunk of line protocol data
+        """
+        points = chunk.count(b"\n")
+        if not chunk.endswith(b"\n"):
+            points = points + 1
+        headers = {}
+        body = chunk
+        if self.gzipLevel > 0 and len(chunk) >= self.gzipMinSize:
+            body = gzip.compress(chunk, self.gzipLevel)
+            headers["Content-Encoding"] = "gzip"
+
+        throttled = self.pointBucket.consume(points)
+        throttled = throttled + self.byteBucket.consume(len(body))
+
+        theUrl = self.url + "api/v2/write"
+        params = {"org" : org, "bucket" : bucket, "precision" : str(precision)}
+        try:
+            resp = self.session.post(theUrl, params=params, data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as error:
+            raise InfluxSinkError("InfluxDB cannot be reached: " + str(error))
+        if resp.status_code in (401, 403, 404):
+            raise InfluxSinkAccessError("InfluxDB write failed with status code %s: %s" % (resp.status_code, resp.text.strip()))
+        if resp.status_code == 429 or resp.status_code >= 500:
+            raise InfluxSinkError("InfluxDB write failed with status code %s: %s" % (resp.status_code, resp.text.strip()))
+        if resp.status_code != 204:
+            raise InfluxSinkRejectedError("InfluxDB rejected %s lines with status code %s: %s" % (points, resp.status_code, resp.text.strip()), points)
+
+        with self.lock:
+            self.writes = self.writes + 1
+            self.pointsSent = self.pointsSent + points
+            self.bytesRaw = self.bytesRaw + len(chunk)
+            self.bytesSent = self.bytesSent + len(body)
+            self.throttleTime = self.throttleTime + throttled
+        logger.debug("Written %s points, %s bytes (%s bytes sent)", points, len(chunk), len(body))
+
+    def getMetrics(self):
+        """
+        Return metrics of the sink
+        """
+        return {
+            "influxWrites" : self.writes,
+            "influxPoints" : self.pointsSent,
+            "influxBytesRaw" : self.bytesRaw,
+            "influxBytesSent" : self.bytesSent,
+            "influxThrottleTime" : self.throttleTime,
+            "influxDuplicatesDropped" : self.window.dropped if self.window else 0,
+        }
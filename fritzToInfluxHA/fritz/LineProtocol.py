@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+"""Module LineProtocol
+
+This module includes helpers for serializing measurements into InfluxDB line protocol.
+
+Series keys (measurement plus tag set) are escaped and encoded only once.
+For every cycle, only field value and timestamp are appended to a reusable buffer.
+"""
+
+import math
+import datetime
+
+#Setup logging
+import logging
+import logging_plus
+
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Escape tables according to the InfluxDB line protocol specification
+_ESCAPE_MEASUREMENT = str.maketrans({
+    ",": r"\,",
+    " ": r"\ ",
+    "\n": r"\n",
+    "\r": r"\r",
+    "\t": r"\t",
+})
+
+_ESCAPE_TAG = str.maketrans({
+    ",": r"\,",
+    "=": r"\=",
+    " ": r"\ ",
+    "\n": r"\n",
+    "\r": r"\r",
+    "\t": r"\t",
+})
+
+# Supported timestamp precisions
+PRECISIONS = ("s", "ms", "us", "ns")
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def timestamp(dt, precision="ns"):
+    """
+    Return the integer line protocol timestamp for a datetime in the given precision
+
+    Naive datetimes are interpreted as local time.
+    The calculation uses integer arithmetic to avoid float rounding errors.
+    """
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    delta = dt - _EPOCH
+    us = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    if precision == "ns":
+        return us * 1000
+    if precision == "us":
+        return us
+    if precision == "ms":
+        return us // 1000
+    if precision == "s":
+        return us // 1000000
+    raise ValueError("Unsupported timestamp precision: " + str(precision))
+
+def seriesKey(measurement, tags, field="value"):
+    """
+    Return the escaped and encoded series key for the given measurement and tags
+
+    The key includes the field name and the separating "=" so that only the
+    field value needs to be appended.
+    Tags with empty values are omitted. Tags are sorted by key.
+    """
+    key = measurement.translate(_ESCAPE_MEASUREMENT)
+    for tag in sorted(tags):
+        value = tags[tag]
+        if value is None or value == "":
+            continue
+        key = key + "," + tag.translate(_ESCAPE_TAG) + "=" + str(value).translate(_ESCAPE_TAG)
+    key = key + " " + field.translate(_ESCAPE_TAG) + "="
+    return key.encode("utf-8")
+
+def formatFloat(value):
+    """
+    Return the line protocol representation of a float field value
+    """
+    s = repr(float(value))
+    if s.endswith(".0"):
+        s = s[:-2]
+    return s.encode("ascii")
+
+def convertPrecision(record, fromPrecision, toPrecision):
+    """
+    Return line protocol data with the timestamps converted to another precision
+
+    Lines without timestamp are kept unchanged.
+    Converting to a coarser precision truncates the timestamps.
+    """
+    if fromPrecision == toPrecision:
+        return record
+    if fromPrecision not in PRECISIONS or toPrecision not in PRECISIONS:
+        raise ValueError("Unsupported timestamp precision: %s, %s" % (fromPrecision, toPrecision))
+    steps = PRECISIONS.index(toPrecision) - PRECISIONS.index(fromPrecision)
+    lines = []
+    for line in record.splitlines():
+        head, sep, ts = line.rpartition(b" ")
+        if sep and ts.isdigit():
+            if steps > 0:
+                line = head + b" %d" % (int(ts) * 1000 ** steps)
+            else:
+                line = head + b" %d" % (int(ts) // 1000 ** -steps)
+        lines.append(line + b"\n")
+    return b"".join(lines)
+
+def formatLine(key, value, timestamp=None):
+    """
+    Return one line for a precompiled series key or None for invalid values
+    """
+    if value is None or not math.isfinite(value):
+        return None
+    line = key + formatFloat(value)
+    if timestamp is not None:
+        line = line + b" %d" % timestamp
+    return line + b"\n"
+
+class LineBuffer:
+    """
+    Class representing a reusable buffer for line protocol data
+    """
+    def __init__(self):
+        """
+        Constructor for LineBuffer
+        """
+        self.buffer = bytearray()
+        self.lines = 0
+
+    def append(self, key, value, timestamp=None):
+        """
+        Append one line for a precompiled series key
+        """
+        if value is None or not math.isfinite(value):
+            return
+        self.buffer += key
+        self.buffer += formatFloat(value)
+        if timestamp is not None:
+            self.buffer += b" %d" % timestamp
+        self.buffer += b"\n"
+        self.lines = self.lines + 1
+
+    def appendLine(self, line):
+        """
+        Append one line formatted with formatLine
+        """
+        self.buffer += line
+        self.lines = self.lines + 1
+
+    def getvalue(self):
+        """
+        Return buffer content
+        """
+        return bytes(self.buffer)
+
+    def clear(self):
+        """
+        Clear the buffer for the next cycle
+        """
+        del self.buffer[:]
+        self.lines = 0
+
+    def __len__(self):
+        return self.lines
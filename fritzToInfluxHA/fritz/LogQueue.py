@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+"""Module LogQueue
+
+This module includes classes for logging without blocking the measurement loop.
+
+Records are put into a bounded queue by a QueueHandler and written by the
+handlers of a QueueListener in a separate thread. If the queue is full,
+records are dropped and counted instead of waiting for slow log output
+(e.g. journald backpressure).
+Repeated warnings and errors (e.g. during outages of the Fritz!Box) are
+suppressed for a time interval and summarized with the next message.
+"""
+import time
+import queue
+import atexit
+import threading
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Class representing a QueueHandler which drops records if the queue is full
+    """
+    def __init__(self, maxSize=10000):
+        QueueHandler.__init__(self, queue.Queue(maxSize))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped = self.dropped + 1
+
+class DrainingQueueListener(QueueListener):
+    """
+    Class representing a QueueListener which can be stopped with a full queue
+    """
+    def enqueue_sentinel(self):
+        # The listener thread keeps draining the queue: wait for space
+        self.queue.put(self._sentinel)
+
+class RepeatFilter(logging.Filter):
+    """
+    Class representing a filter suppressing repeated records
+
+    Records are repeated if logger, level, message format and all
+    non-numeric arguments are equal, so that messages which only differ
+    in counters are suppressed as well.
+    Only records with at least minLevel are filtered.
+    """
+    def __init__(self, interval=60.0, minLevel=logging.WARNING):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.minLevel = minLevel
+        self.lock = threading.Lock()
+        # key: [time of last record passed, number of suppressed records]
+        self.seen = {}
+        self.suppressed = 0
+
+    @staticmethod
+    def recordKey(record):
+        args = record.args
+        if isinstance(args, tuple):
+            args = tuple(arg for arg in args if not isinstance(arg, (int, float)))
+        elif args is not None:
+            args = repr(args)
+        return (record.name, record.levelno, str(record.msg), args)
+
+    def filter(self, record):
+        if self.interval <= 0 or record.levelno < self.minLevel:
+            return True
+        key = self.recordKey(record)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] = entry[1] + 1
+                self.suppressed = self.suppressed + 1
+                return False
+            count = 0
+            if entry is not None:
+                count = entry[1]
+            if len(self.seen) > 1000:
+                # Forget records not repeated within the interval
+                self.seen = {k: e for k, e in self.seen.items() if now - e[0] < self.interval}
+            self.seen[key] = [now, 0]
+        if count > 0:
+            record.msg = str(record.msg) + " (%s similar messages suppressed)" % count
+        return True
+
+class LogQueue:
+    """
+    Class representing a queue between loggers and log handlers
+    """
+    def __init__(self, handlers, maxSize=10000, repeatInterval=60.0):
+        """
+        Constructor for LogQueue
+
+        handlers:       handlers which write the records, e.g. a StreamHandler
+        maxSize:        maximum number of queued records
+        repeatInterval: interval in seconds for suppression of repeated
+                        warnings and errors, 0 = no suppression
+        """
+        self.handler = BoundedQueueHandler(maxSize)
+        self.repeatFilter = RepeatFilter(repeatInterval)
+        self.handler.addFilter(self.repeatFilter)
+        self.listener = DrainingQueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self.running = True
+        # Write queued records also if the program ends with an exception
+        atexit.register(self.stop)
+
+    def configure(self, maxSize, repeatInterval):
+        """
+        Change queue size and repeat interval
+        """
+        self.handler.queue.maxsize = maxSize
+        self.repeatFilter.interval = repeatInterval
+
+    def stop(self):
+        """
+        Write all queued records and stop the listener thread
+        """
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def getMetrics(self):
+        """
+        Return metrics of the log queue
+        """
+        return {
+            "logDropped" : self.handler.dropped,
+            "logSuppressed" : self.repeatFilter.suppressed,
+        }
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""Module LoginResponse
+
+This module includes functions for calculating the response to a
+Fritz!Box login challenge (login_sid.lua).
+
+Fritz!OS 7.24 and later send PBKDF2 challenges (version 2):
+    2$<iter1>$<salt1>$<iter2>$<salt2>
+The first, expensive PBKDF2 round only depends on the password, iter1 and salt1,
+which stay the same until the password is changed. Its result is cached,
+so that a new login only costs the second round.
+Older versions send MD5 challenges, which are still supported.
+"""
+import hashlib
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class DerivedKeyCache:
+    """
+    Class representing a cache for the password-derived key of PBKDF2 challenges
+    """
+    def __init__(self):
+        self.ref = None
+        self.key = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pwd, iter1, salt1):
+        """
+        Return the key derived from the password with the given iterations and salt
+        """
+        ref = (pwd, iter1, salt1)
+        if ref == self.ref:
+            self.hits = self.hits + 1
+            return self.key
+        self.misses = self.misses + 1
+        logger.debug("Deriving key with %s iterations", iter1)
+        self.key = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), bytes.fromhex(salt1), iter1)
+        self.ref = ref
+        return self.key
+
+# Cache shared by all logins of this process
+keyCache = DerivedKeyCache()
+
+def isPbkdf2Challenge(challenge):
+    """
+    Check whether the challenge is a PBKDF2 (version 2) challenge
+    """
+    return challenge.startswith("2$")
+
+def md5Response(challenge, pwd):
+    """
+    Return the response to an MD5 challenge
+    """
+    md5 = hashlib.md5()
+    md5.update(challenge.encode('utf-16le'))
+    md5.update('-'.encode('utf-16le'))
+    md5.update(pwd.encode('utf-16le'))
+    return challenge + '-' + md5.hexdigest()
+
+def pbkdf2Response(challenge, pwd, cache=None):
+    """
+    Return the response to a PBKDF2 challenge
+
+    cache: DerivedKeyCache for the first round (Default: keyCache)
+    """
+    if cache is None:
+        cache = keyCache
+    parts = challenge.split("$")
+    if len(parts) != 5:
+        raise ValueError("Invalid PBKDF2 challenge: " + challenge)
+    iter1 = int(parts[1])
+    salt1 = parts[2]
+    iter2 = int(parts[3])
+    salt2 = parts[4]
+    hash1 = cache.get(pwd, iter1, salt1)
+    hash2 = hashlib.pbkdf2_hmac("sha256", hash1, bytes.fromhex(salt2), iter2)
+    return salt2 + "$" + hash2.hex()
+
+def loginResponse(challenge, pwd, cache=None):
+    """
+    Return the response to the given challenge, using PBKDF2 if offered
+    """
+    if isPbkdf2Challenge(challenge):
+        return pbkdf2Response(challenge, pwd, cache)
+    return md5Response(challenge, pwd)
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+"""Module SampleIdentity
+
+This module includes helpers for identifying samples and suppressing duplicates.
+
+The identity of a sample is its series key (measurement and tags including
+the AIN) together with its timestamp. Measurement times can be aligned to a
+fixed grid, so that a sample queried twice within one interval gets the same
+identity. InfluxDB overwrites points of the same identity, so duplicates do
+no harm in the database, but they cost bytes on the link.
+IdentityWindow keeps the recently written identities in a ring of fixed
+size, so that duplicates can be dropped before sending. Identities are kept
+as bytes, not as hashes, so that distinct samples are never taken for
+duplicates.
+"""
+import datetime
+import threading
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def alignTime(dt, alignment):
+    """
+    Return the datetime truncated to a multiple of alignment seconds since the epoch
+
+    alignment <= 0 returns the datetime unchanged.
+    """
+    if alignment <= 0:
+        return dt
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    us = int(alignment * 1000000)
+    delta = dt - _EPOCH
+    total = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return _EPOCH + datetime.timedelta(microseconds=total - total % us)
+
+def lineIdentity(line):
+    """
+    Return the identity of one line protocol line or None for lines without timestamp
+
+    The identity consists of series key, field name and timestamp, not the field value.
+    """
+    head, sep, ts = line.rstrip(b"\n").rpartition(b" ")
+    if not sep or not ts.isdigit():
+        return None
+    series, sep, value = head.rpartition(b"=")
+    if not sep:
+        return None
+    return series + b" " + ts
+
+class IdentityWindow:
+    """
+    Class representing a window of the identities of recently written samples
+
+    Identities are kept in a ring of fixed size; the oldest are replaced first.
+    The window may be shared by several threads.
+    """
+    def __init__(self, size):
+        """
+        Constructor for IdentityWindow
+
+        size: number of identities kept
+        """
+        self.size = size
+        self.ring = [None] * size
+        self.pos = 0
+        self.filled = 0
+        self.known = set()
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, payload):
+        """
+        Return the payload without lines whose identity has been written before
+
+        Duplicates within the payload are dropped as well.
+        """
+        lines = payload.splitlines(keepends=True)
+        kept = []
+        seen = set()
+        with self.lock:
+            for line in lines:
+                identity = lineIdentity(line)
+                if identity is not None:
+                    if identity in self.known or identity in seen:
+                        self.dropped = self.dropped + 1
+                        continue
+                    seen.add(identity)
+                kept.append(line)
+        if len(kept) == len(lines):
+            return payload
+        return b"".join(kept)
+
+    def add(self, payload):
+        """
+        Register the identities of written lines
+        """
+        with self.lock:
+            for line in payload.splitlines():
+                identity = lineIdentity(line)
+                if identity is None or identity in self.known:
+                    continue
+                if self.filled == self.size:
+                    self.known.discard(self.ring[self.pos])
+                else:
+                    self.filled = self.filled + 1
+                self.ring[self.pos] = identity
+                self.known.add(identity)
+                self.pos = (self.pos + 1) % self.size
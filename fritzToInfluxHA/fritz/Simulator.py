@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+"""Module Simulator
+
+This module includes a simulated Fritz!Box for tests without hardware.
+
+The simulator serves login_sid.lua (PBKDF2 or MD5 challenges),
+logout and the getdevicelistinfos command of homeautoswitch.lua
+for a number of simulated switches and thermostats.
+TR-064 actions of Tr064Collector are answered on the same port
+(without digest authentication).
+It also accepts writes to the InfluxDB V2 write API and pings, so that the
+complete pipeline can run against one local server.
+Outages (dropped connections) and expiry of sessions can be injected.
+"""
+import random
+import secrets
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .LoginResponse import md5Response, pbkdf2Response, DerivedKeyCache
+from .Tr064 import ACTIONS
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+INVALID_SID = "0000000000000000"
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the simulated Fritz!Box
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        box = self.server.box
+        if box.outage:
+            # Drop connection without response
+            self.close_connection = True
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/login_sid.lua":
+            self.reply(200, box.login(query))
+        elif url.path == "/webservices/homeautoswitch.lua":
+            sid = query.get("sid", [""])[0]
+            if not box.checkSid(sid):
+                self.reply(403, "")
+            elif query.get("switchcmd", [""])[0] == "getdevicelistinfos":
+                self.reply(200, box.deviceList())
+            else:
+                self.reply(400, "")
+        elif url.path == "/":
+            box.logout(query.get("sid", [""])[0])
+            self.reply(200, "")
+        elif url.path == "/ping":
+            self.reply(204, None)
+        else:
+            self.reply(404, "")
+
+    def do_POST(self):
+        box = self.server.box
+        length = int(self.headers.get("Content-Length", "0"))
+        self.rfile.read(length)
+        if box.outage:
+            self.close_connection = True
+            return
+        path = urlparse(self.path).path
+        if path == "/api/v2/write":
+            if box.influxToken and self.headers.get("Authorization") != "Token " + box.influxToken:
+                self.reply(401, "")
+                return
+            if length > 0:
+                box.writes = box.writes + 1
+            self.reply(204, None)
+        elif path.startswith("/upnp/control/"):
+            status, body = box.tr064(self.headers.get("SOAPAction", ""))
+            self.reply(status, body)
+        else:
+            self.reply(404, "")
+
+    def reply(self, status, body):
+        self.send_response(status)
+        if body is None:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = body.encode("utf-8")
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+class FritzBoxSimulator:
+    """
+    Class representing a simulated Fritz!Box
+    """
+    def __init__(self, user="user", pwd="password", switches=10, thermostats=5, pbkdf2=True, host="127.0.0.1", port=0, influxToken=None):
+        """
+        Constructor for FritzBoxSimulator
+
+        switches, thermostats: number of simulated devices
+        pbkdf2:                send PBKDF2 challenges (otherwise MD5)
+        port:                  port to listen on (0 = any free port)
+        influxToken:           token required by the simulated InfluxDB write API (None = any)
+        """
+        self.user = user
+        self.pwd = pwd
+        self.pbkdf2 = pbkdf2
+        self.influxToken = influxToken
+        self.outage = False
+        self.sessions = set()
+        self.challenge = None
+        self.keyCache = DerivedKeyCache()
+        self.lock = threading.Lock()
+
+        self.logins = 0
+        self.requests = 0
+        self.writes = 0
+        self.soapCalls = 0
+
+        self.devices = []
+        for ind in range(0, switches):
+            self.devices.append(("08761 %07d" % ind, "Switch %s" % ind, "switch"))
+        for ind in range(0, thermostats):
+            self.devices.append(("09995 %07d" % ind, "Thermostat %s" % ind, "thermostat"))
+        self.energy = [0] * len(self.devices)
+
+        self.server = ThreadingHTTPServer((host, port), SimulatorRequestHandler)
+        self.server.daemon_threads = True
+        self.server.box = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fritzbox-simulator", daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[0:2]
+        return "http://%s:%s/" % (host, port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Stop the simulator
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def newChallenge(self):
+        if self.pbkdf2:
+            return "2$10000$%s$1000$%s" % ("5a1711aa", secrets.token_hex(4))
+        return secrets.token_hex(4)
+
+    def login(self, query):
+        """
+        Handle a request to login_sid.lua and return the SessionInfo XML
+        """
+        with self.lock:
+            self.requests = self.requests + 1
+            sid = query.get("sid", [INVALID_SID])[0]
+            response = query.get("response", [None])[0]
+            if response is not None and self.challenge is not None:
+                if self.pbkdf2:
+                    expected = pbkdf2Response(self.challenge, self.pwd, self.keyCache)
+                else:
+                    expected = md5Response(self.challenge, self.pwd)
+                sid = INVALID_SID
+                if query.get("username", [""])[0] == self.user and response == expected:
+                    sid = secrets.token_hex(8)
+                    self.sessions.add(sid)
+                    self.logins = self.logins + 1
+            if sid not in self.sessions:
+                sid = INVALID_SID
+            self.challenge = self.newChallenge()
+            return "<SessionInfo><SID>%s</SID><Challenge>%s</Challenge><BlockTime>0</BlockTime></SessionInfo>" % (sid, self.challenge)
+
+    def logout(self, sid):
+        with self.lock:
+            self.sessions.discard(sid)
+
+    def checkSid(self, sid):
+        with self.lock:
+            self.requests = self.requests + 1
+            return sid in self.sessions
+
+    def expireSessions(self):
+        """
+        Invalidate all sessions, as after a Fritz!Box reboot
+        """
+        with self.lock:
+            self.sessions.clear()
+
+    def tr064(self, soapAction):
+        """
+        Return status and SOAP response with random values for a TR-064 action
+        """
+        with self.lock:
+            self.soapCalls = self.soapCalls + 1
+        service, _, action = soapAction.strip('"').partition("#")
+        for cand in ACTIONS.values():
+            if cand[0] == service and cand[2] == action:
+                args = "".join("<%s>%s</%s>" % (arg, random.randint(0, 100000), arg) for arg in cand[3])
+                return 200, (
+                    '<?xml version="1.0"?>'
+                    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+                    '<s:Body><u:%sResponse xmlns:u="%s">%s</u:%sResponse></s:Body></s:Envelope>' % (action, service, args, action))
+        return 500, (
+            '<?xml version="1.0"?>'
+            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+            '<s:Body><s:Fault><faultcode>s:Client</faultcode><faultstring>UPnPError</faultstring>'
+            '<detail><UPnPError xmlns="urn:dslforum-org:control-1-0"><errorCode>401</errorCode>'
+            '<errorDescription>Invalid Action</errorDescription></UPnPError></detail></s:Fault></s:Body></s:Envelope>')
+
+    def deviceList(self):
+        """
+        Return the device list with random measurements
+        """
+        parts = ['<devicelist version="1">']
+        for ind, (ain, name, kind) in enumerate(self.devices):
+            if kind == "switch":
+                self.energy[ind] = self.energy[ind] + random.randint(0, 50)
+                parts.append(
+                    '<device identifier="%s" id="%s" functionbitmask="35712" fwversion="04.25" manufacturer="AVM" productname="FRITZ!DECT 200">'
+                    '<present>1</present><name>%s</name>'
+                    '<switch><state>%s</state><mode>manuell</mode><lock>0</lock><devicelock>0</devicelock></switch>'
+                    '<powermeter><voltage>%s</voltage><power>%s</power><energy>%s</energy></powermeter>'
+                    '<temperature><celsius>%s</celsius><offset>0</offset></temperature>'
+                    '</device>' % (ain, ind, name, random.randint(0, 1), random.randint(228000, 232000),
+                        random.randint(0, 2000000), self.energy[ind], random.randint(150, 250)))
+            else:
+                parts.append(
+                    '<device identifier="%s" id="%s" functionbitmask="320" fwversion="05.08" manufacturer="AVM" productname="FRITZ!DECT 301">'
+                    '<present>1</present><name>%s</name>'
+                    '<temperature><celsius>%s</celsius><offset>0</offset></temperature>'
+                    '<hkr><tist>%s</tist><tsoll>%s</tsoll><battery>%s</battery></hkr>'
+                    '</device>' % (ain, ind, name, random.randint(150, 250), random.randint(30, 50),
+                        random.randint(32, 46), random.randint(0, 100)))
+        parts.append("</devicelist>")
+        return "".join(parts)
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+"""Module SqliteStore
+
+This module includes a class for storing measurements in a local SQLite database.
+
+The database runs in WAL mode, so that queries do not block writes.
+Devices (AIN, location, sublocation) and measurement names are stored once
+in dictionary tables. Samples reference them by integer ids and are stored
+in time-partitioned tables samples_<n> covering partitionDays each.
+The primary key (device, measurement, time) of the WITHOUT ROWID sample
+tables serves as covering index for time-range queries per device.
+Partitions older than the retention period are dropped as a whole.
+
+Samples can be exported to InfluxDB in time order. The position of the
+last exported sample is kept per destination, so that an export can be
+interrupted and resumed.
+"""
+import re
+import time
+import sqlite3
+import datetime
+from .LineProtocol import seriesKey, LineBuffer
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+_MS_PER_DAY = 86400000
+_RE_PARTITION = re.compile(r"^samples_(\d+)$")
+
+# Pruning of old partitions is checked at most once per interval (seconds)
+PRUNE_INTERVAL = 3600
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS devices ("
+    "id INTEGER PRIMARY KEY, ain TEXT NOT NULL, location TEXT NOT NULL, sublocation TEXT NOT NULL, "
+    "UNIQUE (ain, location, sublocation))",
+    "CREATE TABLE IF NOT EXISTS measurements ("
+    "id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS exports ("
+    "destination TEXT PRIMARY KEY, time INTEGER NOT NULL, device INTEGER NOT NULL, measurement INTEGER NOT NULL)",
+)
+
+class SqliteStore:
+    """
+    Class representing a local time-series store in SQLite
+    """
+    def __init__(self, path, partitionDays=7, retentionDays=365):
+        """
+        Constructor for SqliteStore
+
+        path:          database file
+        partitionDays: time range of one sample table in days
+        retentionDays: samples older than this are dropped, 0 = keep all
+        """
+        self.path = path
+        self.partitionMs = max(1, partitionDays) * _MS_PER_DAY
+        self.retentionMs = retentionDays * _MS_PER_DAY
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode, NORMAL is safe against corruption; a power loss may lose the last cycles
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            for stmt in _SCHEMA:
+                self.conn.execute(stmt)
+
+        self.loadDictionaries()
+        self.lastPrune = 0
+
+        self.samples = 0
+        self.errors = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the database
+        """
+        if self.conn:
+            self.conn.close()
+        self.conn = None
+
+    def loadDictionaries(self):
+        """
+        Load device and measurement ids and partitions from the database
+        """
+        self.deviceIds = {}
+        for id, ain, location, sublocation in self.conn.execute("SELECT id, ain, location, sublocation FROM devices"):
+            self.deviceIds[(ain, location, sublocation)] = id
+        self.measurementIds = {}
+        for id, name in self.conn.execute("SELECT id, name FROM measurements"):
+            self.measurementIds[name] = id
+        self.partitions = set()
+        for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+            match = _RE_PARTITION.match(name)
+            if match:
+                self.partitions.add(int(match.group(1)))
+
+    def getDeviceId(self, ain, location, sublocation):
+        key = (ain, location or "", sublocation or "")
+        id = self.deviceIds.get(key)
+        if id is None:
+            id = self.conn.execute("INSERT INTO devices (ain, location, sublocation) VALUES (?, ?, ?)", key).lastrowid
+            self.deviceIds[key] = id
+        return id
+
+    def getMeasurementId(self, name):
+        id = self.measurementIds.get(name)
+        if id is None:
+            id = self.conn.execute("INSERT INTO measurements (name) VALUES (?)", (name,)).lastrowid
+            self.measurementIds[name] = id
+        return id
+
+    def createPartition(self, partition):
+        """
+        Create the sample table of a partition
+        """
+        table = "samples_%d" % partition
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS %s ("
+            "device INTEGER NOT NULL, measurement INTEGER NOT NULL, time INTEGER NOT NULL, state INTEGER, value REAL NOT NULL, "
+            "PRIMARY KEY (device, measurement, time)) WITHOUT ROWID" % table)
+        # Index for export in time order
+        self.conn.execute("CREATE INDEX IF NOT EXISTS %s_time ON %s (time, device, measurement)" % (table, table))
+        self.partitions.add(partition)
+
+    def write(self, devices):
+        """
+        Store the measurements of up-to-date monitored devices in one transaction
+
+        Returns the number of samples stored. Errors are logged and the cycle is skipped.
+        """
+        rows = {}
+        count = 0
+        try:
+            with self.conn:
+                for dev in devices:
+                    if not dev.isMonitored or not dev.upToDate or not dev.measurementTime:
+                        continue
+                    t = int(dev.measurementTime.timestamp() * 1000)
+                    partition = t // self.partitionMs
+                    if partition not in self.partitions:
+                        self.createPartition(partition)
+                    deviceId = self.getDeviceId(dev.ain, dev.location, dev.sublocation)
+                    partRows = rows.setdefault(partition, [])
+                    for measurement, value, state in dev.measurementValues():
+                        if state is not None and state != "":
+                            state = int(state)
+                        else:
+                            state = None
+                        partRows.append((deviceId, self.getMeasurementId(measurement), t, state, value))
+                for partition, partRows in rows.items():
+                    self.conn.executemany("INSERT OR REPLACE INTO samples_%d VALUES (?, ?, ?, ?, ?)" % partition, partRows)
+                    count = count + len(partRows)
+        except sqlite3.Error as error:
+            self.errors = self.errors + 1
+            logger.error("Error while writing to %s: %s", self.path, error)
+            # Ids and partitions created in the rolled back transaction are invalid
+            self.loadDictionaries()
+            return 0
+        self.samples = self.samples + count
+        if time.monotonic() - self.lastPrune > PRUNE_INTERVAL:
+            self.prune()
+        return count
+
+    def prune(self, now=None):
+        """
+        Drop partitions which are completely older than the retention period
+        """
+        self.lastPrune = time.monotonic()
+        if self.retentionMs <= 0:
+            return
+        if now is None:
+            now = time.time()
+        limit = int(now * 1000) - self.retentionMs
+        for partition in sorted(self.partitions):
+            if (partition + 1) * self.partitionMs > limit:
+                break
+            try:
+                with self.conn:
+                    self.conn.execute("DROP TABLE samples_%d" % partition)
+            except sqlite3.Error as error:
+                self.errors = self.errors + 1
+                logger.error("Error while pruning %s: %s", self.path, error)
+                return
+            self.partitions.discard(partition)
+            logger.info("Dropped partition samples_%d of %s (retention)", partition, self.path)
+
+    def query(self, ain, measurement, start, end):
+        """
+        Return (time, value, state) of a device measurement for start <= time < end
+
+        start, end: time zone aware datetimes. Returned times are UTC datetimes.
+        """
+        measurementId = self.measurementIds.get(measurement)
+        ids = [id for key, id in self.deviceIds.items() if key[0] == ain]
+        if measurementId is None or not ids:
+            return []
+        startMs = int(start.timestamp() * 1000)
+        endMs = int(end.timestamp() * 1000)
+        marks = ",".join("?" * len(ids))
+        result = []
+        for partition in sorted(self.partitions):
+            if (partition + 1) * self.partitionMs <= startMs or partition * self.partitionMs >= endMs:
+                continue
+            stmt = ("SELECT time, value, state FROM samples_%d "
+                    "WHERE device IN (%s) AND measurement = ? AND time >= ? AND time < ? ORDER BY time" % (partition, marks))
+            for t, value, state in self.conn.execute(stmt, ids + [measurementId, startMs, endMs]):
+                result.append((datetime.datetime.fromtimestamp(t / 1000, datetime.timezone.utc), value, state))
+        return result
+
+    def export(self, sink, org, bucket, precision="ms", batchRows=5000, destination="default"):
+        """
+        Write samples not yet exported to the destination to InfluxDB
+
+        Samples are written in time order in batches of batchRows.
+        The export position is saved after every batch.
+        Errors of the sink are raised; a new export resumes after the last written batch.
+        Returns the number of exported samples.
+        """
+        factors = {"s" : None, "ms" : 1, "us" : 1000, "ns" : 1000000}
+        if precision not in factors:
+            raise ValueError("Unsupported timestamp precision: " + str(precision))
+        factor = factors[precision]
+
+        devices = {}
+        for (ain, location, sublocation), id in self.deviceIds.items():
+            devices[id] = (ain, location, sublocation)
+        measurements = {}
+        for name, id in self.measurementIds.items():
+            measurements[id] = name
+        keys = {}
+
+        row = self.conn.execute("SELECT time, device, measurement FROM exports WHERE destination = ?", (destination,)).fetchone()
+        position = row if row else (-1, 0, 0)
+
+        exported = 0
+        buffer = LineBuffer()
+        for partition in sorted(self.partitions):
+            if (partition + 1) * self.partitionMs <= position[0]:
+                continue
+            stmt = ("SELECT time, device, measurement, state, value FROM samples_%d "
+                    "WHERE (time, device, measurement) > (?, ?, ?) ORDER BY time, device, measurement LIMIT ?" % partition)
+            while True:
+                rows = self.conn.execute(stmt, position + (batchRows,)).fetchall()
+                if not rows:
+                    break
+                buffer.clear()
+                for t, device, measurement, state, value in rows:
+                    ref = (device, measurement, state)
+                    key = keys.get(ref)
+                    if key is None:
+                        ain, location, sublocation = devices[device]
+                        key = seriesKey(measurements[measurement], {
+                            "ain" : ain,
+                            "location" : location,
+                            "sublocation" : sublocation,
+                            "state" : state
+                        })
+                        keys[ref] = key
+                    if factor is None:
+                        ts = t // 1000
+                    else:
+                        ts = t * factor
+                    buffer.append(key, value, ts)
+                sink.write(bucket=bucket, org=org, record=buffer.getvalue(), write_precision=precision)
+                last = rows[-1]
+                position = (last[0], last[1], last[2])
+                with self.conn:
+                    self.conn.execute("INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?)", (destination,) + position)
+                exported = exported + len(rows)
+                logger.info("%s samples exported from %s", exported, self.path)
+        return exported
+
+    def getMetrics(self):
+        """
+        Return metrics of the store
+        """
+        return {
+            "sqliteSamples" : self.samples,
+            "sqliteErrors" : self.errors,
+            "sqlitePartitions" : len(self.partitions),
+        }
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+"""Module SystemdNotify
+
+This module includes a class for the systemd notification protocol (sd_notify)
+used by services with Type=notify.
+
+The notification socket and the watchdog interval are taken from the
+environment variables NOTIFY_SOCKET and WATCHDOG_USEC set by systemd.
+If NOTIFY_SOCKET is not set, all notifications are ignored.
+"""
+import os
+import time
+import socket
+import threading
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# First file descriptor passed with socket activation
+SD_LISTEN_FDS_START = 3
+
+def listenSockets():
+    """
+    Return the sockets passed by systemd socket activation
+
+    Returns an empty list if the process has not been socket-activated.
+    The environment variables are removed, so that sockets are taken only once.
+    """
+    pid = os.environ.pop("LISTEN_PID", None)
+    fds = os.environ.pop("LISTEN_FDS", "0")
+    os.environ.pop("LISTEN_FDNAMES", None)
+    if pid != str(os.getpid()):
+        return []
+    try:
+        count = int(fds)
+    except ValueError:
+        return []
+    return [socket.socket(fileno=fd) for fd in range(SD_LISTEN_FDS_START, SD_LISTEN_FDS_START + count)]
+
+class SystemdNotifier:
+    """
+    Class representing the connection to the systemd notification socket
+    """
+    def __init__(self, address=None, watchdogUsec=None):
+        """
+        Constructor for SystemdNotifier
+
+        address:      path of the notification socket (Default: NOTIFY_SOCKET).
+                      A leading "@" denotes an abstract socket.
+        watchdogUsec: watchdog interval in microseconds (Default: WATCHDOG_USEC)
+        """
+        if address is None:
+            address = os.environ.get("NOTIFY_SOCKET")
+        if watchdogUsec is None:
+            watchdogUsec = 0
+            watchdogPid = os.environ.get("WATCHDOG_PID")
+            if watchdogPid is None or watchdogPid == str(os.getpid()):
+                try:
+                    watchdogUsec = int(os.environ.get("WATCHDOG_USEC", "0"))
+                except ValueError:
+                    watchdogUsec = 0
+
+        self.address = address
+        if self.address and self.address[0] == "@":
+            self.address = "\0" + self.address[1:]
+        self.watchdogInterval = watchdogUsec / 1000000
+        self.isReady = False
+        self.lastPing = time.monotonic()
+        # Set to end waits early, e.g. on termination
+        self.wakeup = threading.Event()
+
+        self.sock = None
+        if self.address:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            logger.debug("systemd notification enabled. Watchdog interval: %s sec.", self.watchdogInterval)
+
+    @property
+    def enabled(self):
+        return self.sock is not None
+
+    def notify(self, *assignments):
+        """
+        Send the given assignments (e.g. "READY=1") to systemd
+        """
+        if not self.sock:
+            return
+        msg = "\n".join(assignments).encode("utf-8")
+        try:
+            self.sock.sendto(msg, self.address)
+        except OSError as error:
+            logger.debug("systemd notification failed: %s", error)
+
+    def ready(self, status=None):
+        """
+        Notify systemd that the service is ready. Only the first call is sent.
+        """
+        if self.isReady:
+            return
+        self.isReady = True
+        if status:
+            self.notify("READY=1", "STATUS=" + status)
+        else:
+            self.notify("READY=1")
+
+    def status(self, status):
+        """
+        Set the status line shown by systemctl status
+        """
+        self.notify("STATUS=" + status)
+
+    def watchdog(self):
+        """
+        Send a watchdog heartbeat
+        """
+        self.lastPing = time.monotonic()
+        if self.watchdogInterval > 0:
+            self.notify("WATCHDOG=1")
+
+    def stopping(self):
+        """
+        Notify systemd that the service is stopping
+        """
+        self.notify("STOPPING=1")
+
+    def sleep(self, seconds):
+        """
+        Sleep for the given time
+
+        Heartbeats are sent at half the watchdog interval, so that planned
+        waits longer than the watchdog interval do not trigger a restart.
+        The sleep ends early after interrupt().
+        """
+        if self.watchdogInterval <= 0:
+            self.wakeup.wait(max(0, seconds))
+            return
+        end = time.monotonic() + seconds
+        while not self.wakeup.is_set():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.wakeup.wait(min(remaining, self.watchdogInterval / 2)):
+                break
+            self.watchdog()
+
+    def interrupt(self):
+        """
+        End the current and all further sleeps immediately
+        """
+        self.wakeup.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the notification socket
+        """
+        if self.sock:
+            self.sock.close()
+        self.sock = None
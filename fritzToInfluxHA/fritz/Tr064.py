@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+"""Module Tr064
+
+This module includes a collector for Fritz!Box data available over TR-064.
+
+TR-064 actions are SOAP requests to the Fritz!Box (by default port 49000)
+authenticated with HTTP digest authentication. The collector uses the
+HTTP session and credentials of FritzBox, so that no separate login or
+connection pool is required. Actions are called concurrently and may run
+in parallel with the device query of FritzBox.
+Values are serialized to line protocol with precompiled series keys.
+"""
+import datetime
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.auth import HTTPDigestAuth
+from .LineProtocol import seriesKey, timestamp, formatLine
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+TR064_PORT = 49000
+
+# Route key of TR-064 measurements in InfluxRouter
+TR064_AIN = "tr064"
+
+# Supported actions:
+#   name: (service type, control URL, action, {argument: (measurement, tags, scale)})
+# tags are tuples of (tag, value) or None
+ACTIONS = {
+    "wan" : (
+        "urn:dslforum-org:service:WANCommonInterfaceConfig:1",
+        "/upnp/control/wancommonifconfig1",
+        "GetAddonInfos",
+        {
+            "NewByteSendRate" : ("wan_send_rate", None, 1),
+            "NewByteReceiveRate" : ("wan_receive_rate", None, 1),
+            "NewX_AVM_DE_TotalBytesSent64" : ("wan_bytes_sent", None, 1),
+            "NewX_AVM_DE_TotalBytesReceived64" : ("wan_bytes_received", None, 1),
+        }
+    ),
+    "dsl" : (
+        "urn:dslforum-org:service:WANDSLInterfaceConfig:1",
+        "/upnp/control/wandslifconfig1",
+        "GetInfo",
+        {
+            "NewUpstreamCurrRate" : ("dsl_upstream_rate", None, 1),
+            "NewDownstreamCurrRate" : ("dsl_downstream_rate", None, 1),
+            "NewUpstreamMaxRate" : ("dsl_upstream_max_rate", None, 1),
+            "NewDownstreamMaxRate" : ("dsl_downstream_max_rate", None, 1),
+            "NewUpstreamNoiseMargin" : ("dsl_upstream_noise_margin", None, 0.1),
+            "NewDownstreamNoiseMargin" : ("dsl_downstream_noise_margin", None, 0.1),
+            "NewUpstreamAttenuation" : ("dsl_upstream_attenuation", None, 0.1),
+            "NewDownstreamAttenuation" : ("dsl_downstream_attenuation", None, 0.1),
+        }
+    ),
+    "hosts" : (
+        "urn:dslforum-org:service:Hosts:1",
+        "/upnp/control/hosts",
+        "GetHostNumberOfEntries",
+        {
+            "NewHostNumberOfEntries" : ("hosts", None, 1),
+        }
+    ),
+    "wlan1" : (
+        "urn:dslforum-org:service:WLANConfiguration:1",
+        "/upnp/control/wlanconfig1",
+        "GetTotalAssociations",
+        {
+            "NewTotalAssociations" : ("wlan_associations", (("interface", "wlan1"),), 1),
+        }
+    ),
+    "wlan2" : (
+        "urn:dslforum-org:service:WLANConfiguration:2",
+        "/upnp/control/wlanconfig2",
+        "GetTotalAssociations",
+        {
+            "NewTotalAssociations" : ("wlan_associations", (("interface", "wlan2"),), 1),
+        }
+    ),
+    "wlan3" : (
+        "urn:dslforum-org:service:WLANConfiguration:3",
+        "/upnp/control/wlanconfig3",
+        "GetTotalAssociations",
+        {
+            "NewTotalAssociations" : ("wlan_associations", (("interface", "wlan3"),), 1),
+        }
+    ),
+    "dect" : (
+        "urn:dslforum-org:service:X_AVM-DE_Dect:1",
+        "/upnp/control/x_dect",
+        "GetNumberOfDectEntries",
+        {
+            "NewNumberOfEntries" : ("dect_devices", None, 1),
+        }
+    ),
+}
+
+_ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><u:{action} xmlns:u="{service}"></u:{action}></s:Body>'
+    '</s:Envelope>'
+)
+
+class Tr064Error(Exception):
+    """
+    Exception raised if a TR-064 action fails
+    """
+    def __init__(self, message="TR-064 action failed"):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+def localName(tag):
+    """
+    Return the tag of an element without namespace
+    """
+    return tag.rsplit("}", 1)[-1]
+
+def parseResponse(body, arguments):
+    """
+    Return the values of the given output arguments from a SOAP response
+
+    arguments: {argument: (measurement, tags, scale)}
+    Returns {(measurement, tags): value}
+    """
+    values = {}
+    root = ET.fromstring(body)
+    for elem in root.iter():
+        ref = arguments.get(localName(elem.tag))
+        if ref is None or elem.text is None:
+            continue
+        measurement, tags, scale = ref
+        try:
+            value = float(elem.text) * scale
+        except ValueError:
+            continue
+        values[(measurement, tags)] = value
+    return values
+
+def parseFault(body):
+    """
+    Return the UPnP error code and description of a SOAP fault
+    """
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        return None, None
+    code = None
+    description = None
+    for elem in root.iter():
+        name = localName(elem.tag)
+        if name == "errorCode":
+            code = elem.text
+        elif name == "errorDescription":
+            description = elem.text
+    return code, description
+
+class Tr064Collector:
+    """
+    Class representing a collector of TR-064 values of a Fritz!Box
+    """
+    def __init__(self, url, user, pwd, actions=None, workers=4, timeout=10):
+        """
+        Constructor for Tr064Collector
+
+        url:     TR-064 URL of the Fritz!Box. Without port, port 49000 is used.
+        actions: names of actions in ACTIONS to be called (Default: all)
+        workers: number of concurrent requests
+        """
+        parts = urlsplit(url)
+        port = parts.port
+        if port is None:
+            port = TR064_PORT
+        self.host = parts.hostname
+        self.url = "%s://%s:%s" % (parts.scheme or "http", parts.hostname, port)
+        self.auth = HTTPDigestAuth(user, pwd)
+        self.timeout = timeout
+        if actions is None:
+            actions = list(ACTIONS.keys())
+        self.actions = []
+        for name in actions:
+            if name in ACTIONS:
+                self.actions.append(name)
+            else:
+                logger.error("Unknown TR-064 action %s", name)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tr064")
+        self.pending = []
+        self.values = {}
+        self.measurementTime = None
+        # Actions not supported by the Fritz!Box are not called again
+        self.unsupported = set()
+        self._seriesKeys = {}
+
+        self.breaker = None
+
+        self.calls = 0
+        self.errors = 0
+        # Number of failed calls per action
+        self.actionErrors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def call(self, session, name):
+        """
+        Call one action and return its values
+        """
+        service, controlUrl, action, arguments = ACTIONS[name]
+        body = _ENVELOPE.format(action=action, service=service)
+        headers = {
+            "Content-Type" : 'text/xml; charset="utf-8"',
+            "SOAPAction" : '"%s#%s"' % (service, action),
+        }
+        resp = session.post(self.url + controlUrl, data=body.encode("utf-8"), headers=headers, auth=self.auth, timeout=self.timeout)
+        if resp.status_code == requests.codes.OK:
+            return parseResponse(resp.content, arguments)
+        if resp.status_code == requests.codes.UNAUTHORIZED:
+            raise Tr064Error("TR-064 action %s: authentication failed" % name)
+        code, description = parseFault(resp.content)
+        if code in ("401", "404"):
+            # Invalid action or service not available
+            self.unsupported.add(name)
+            raise Tr064Error("TR-064 action %s not supported: %s %s" % (name, code, description))
+        raise Tr064Error("TR-064 action %s failed with status code %s: %s %s" % (name, resp.status_code, code, description))
+
+    def start(self, session, measurementTime=None, breaker=None):
+        """
+        Start the calls of all supported actions with the given requests.Session
+
+        measurementTime: time zone aware timestamp of the values, e.g. that of the
+                         measurement cycle of the devices (Default: now)
+        breaker:         CircuitBreaker of the Fritz!Box. No calls are started unless
+                         the circuit is closed; connection failures are recorded.
+        """
+        self.finish()
+        self.values = {}
+        self.breaker = breaker
+        self.measurementTime = measurementTime
+        if self.measurementTime is None:
+            self.measurementTime = datetime.datetime.now(datetime.timezone.utc)
+        if self.breaker is not None and not self.breaker.closed:
+            logger.debug("Fritz!Box not available: TR-064 calls skipped")
+            return
+        for name in self.actions:
+            if name not in self.unsupported:
+                self.pending.append((name, self.executor.submit(self.call, session, name)))
+
+    def finish(self):
+        """
+        Wait for the calls started with start() and return the values
+
+        Returns {(measurement, tags): value}. Failed actions are logged and skipped.
+        """
+        if not self.pending:
+            return self.values
+        self.values = {}
+        unreachable = False
+        for name, future in self.pending:
+            self.calls = self.calls + 1
+            try:
+                self.values.update(future.result())
+            except (Tr064Error, requests.RequestException, ET.ParseError, ValueError) as error:
+                self.errors = self.errors + 1
+                self.actionErrors[name] = self.actionErrors.get(name, 0) + 1
+                if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+                    unreachable = True
+                if isinstance(error, Tr064Error):
+                    logger.error("%s", error)
+                else:
+                    logger.error("TR-064 action %s failed: %s", name, error)
+        self.pending = []
+        if unreachable and self.breaker is not None:
+            # One failure per cycle, however many calls have failed
+            self.breaker.recordFailure()
+        return self.values
+
+    def collect(self, session, measurementTime=None):
+        """
+        Call all supported actions and return the values
+        """
+        self.start(session, measurementTime)
+        return self.finish()
+
+    def getSeriesKey(self, measurement, tags):
+        ref = (measurement, tags)
+        key = self._seriesKeys.get(ref)
+        if key is None:
+            allTags = {"host" : self.host}
+            if tags:
+                allTags.update(dict(tags))
+            key = seriesKey(measurement, allTags)
+            self._seriesKeys[ref] = key
+        return key
+
+    def measurementLines(self, precision="ns"):
+        """
+        Generate (measurement, line) for the values of the last collection
+        """
+        ts = None
+        if self.measurementTime:
+            ts = timestamp(self.measurementTime, precision)
+        for (measurement, tags), value in self.values.items():
+            line = formatLine(self.getSeriesKey(measurement, tags), value, ts)
+            if line is not None:
+                yield measurement, line
+
+    def close(self):
+        """
+        Wait for running calls and stop the worker threads
+        """
+        self.executor.shutdown(wait=True)
+
+    def getMetrics(self):
+        """
+        Return metrics of the collector
+        """
+        metrics = {
+            "tr064Calls" : self.calls,
+            "tr064Errors" : self.errors,
+        }
+        for name, errors in self.actionErrors.items():
+            metrics["tr064Errors" + name.capitalize()] = errors
+        return metrics
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+"""Module ValueCache
+
+This module includes a class for an in-memory cache of the latest measurements.
+
+For every AIN, the cache keeps the device info and a ring buffer with the
+last samples. JSON responses are rendered once per measurement cycle and
+identified by an ETag, so that queries are answered from memory without
+access to the Fritz!Box or InfluxDB.
+"""
+import json
+import time
+import threading
+from collections import deque
+from .FritzHaDevice import MEASUREMENTS
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class ValueCache:
+    """
+    Class representing the last values and a short history per device
+    """
+    def __init__(self, historySize=60):
+        """
+        Constructor for ValueCache
+
+        historySize: number of samples kept per device
+        """
+        self.historySize = historySize
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.generation = 0
+        # ETags must differ from those of a previous run
+        self.instance = "%x" % int(time.time())
+        self._responses = {}
+
+    def update(self, devices):
+        """
+        Add a sample for each up-to-date device of a measurement cycle
+
+        Devices which are no longer given are removed from the cache.
+        """
+        with self.lock:
+            ains = set()
+            for dev in devices:
+                ains.add(dev.ain)
+                if not dev.upToDate:
+                    continue
+                sample = {}
+                if dev.measurementTime:
+                    sample["time"] = dev.measurementTime.isoformat()
+                for measurement, attr, writeZero, defaultState in MEASUREMENTS:
+                    value = getattr(dev, attr)
+                    if value is not None:
+                        sample[measurement] = value
+                entry = self.devices.get(dev.ain)
+                if entry is None:
+                    entry = {"info" : None, "history" : deque(maxlen=self.historySize)}
+                    self.devices[dev.ain] = entry
+                entry["info"] = {
+                    "ain" : dev.ain,
+                    "name" : dev.name,
+                    "type" : dev.type.name if dev.type else None,
+                    "location" : dev.location,
+                    "sublocation" : dev.sublocation,
+                    "state" : dev.state,
+                    "present" : dev.present,
+                }
+                entry["history"].append(sample)
+            for ain in list(self.devices.keys()):
+                if ain not in ains:
+                    del self.devices[ain]
+            self.generation = self.generation + 1
+            self._responses = {}
+
+    def etag(self):
+        """
+        Return the ETag for the current cache content
+        """
+        return '"%s-%s"' % (self.instance, self.generation)
+
+    def render(self, path):
+        """
+        Return the content for the given path or None if not found
+
+        /devices        last values of all devices
+        /devices/<ain>  last value and history of one device
+        """
+        parts = [p for p in path.split("/") if p]
+        if len(parts) == 0 or parts[0] != "devices" or len(parts) > 2:
+            return None
+        if len(parts) == 1:
+            devices = {}
+            for ain, entry in self.devices.items():
+                dev = dict(entry["info"])
+                dev["last"] = entry["history"][-1]
+                devices[ain] = dev
+            return {"generation" : self.generation, "devices" : devices}
+        entry = self.devices.get(parts[1])
+        if entry is None:
+            return None
+        dev = dict(entry["info"])
+        dev["last"] = entry["history"][-1]
+        dev["history"] = list(entry["history"])
+        dev["generation"] = self.generation
+        return dev
+
+    def getResponse(self, path):
+        """
+        Return (etag, JSON body) for the given path or None if not found
+
+        Bodies are rendered only once per cache generation.
+        """
+        with self.lock:
+            res = self._responses.get(path)
+            if res is None:
+                content = self.render(path)
+                if content is None:
+                    return None
+                res = (self.etag(), json.dumps(content).encode("utf-8"))
+                self._responses[path] = res
+            return res
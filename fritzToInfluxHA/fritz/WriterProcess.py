@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+"""Module WriterProcess
+
+This module includes classes for writing to InfluxDB from separate writer processes.
+
+The polling process serializes each cycle into one line protocol batch and
+hands it over to a writer process through a bounded queue. Queues are fed by a
+background thread, so a busy writer never blocks the polling process. If the
+queue of a writer is full, its oldest queued batch is dropped. Writers acknowledge
+every batch. Batches which have not been acknowledged are kept by the
+supervisor and sent again to a restarted writer if a writer has died.
+Batches which could not be written are returned with the error raised
+by the next write(), so that the caller can keep them for a retry.
+Batches rejected by InfluxDB with a permanent error are dropped and counted.
+Writers are started with the "spawn" method, because the polling
+process runs threads (logging, cache server, TR-064) when they are forked.
+Batches are handed over as line protocol bytes through the pipe of a
+multiprocessing.Queue. Pickling bytes only adds a small header, so a
+separate binary encoding or a shared-memory ring would not save a copy.
+"""
+import queue
+import time
+import multiprocessing
+from collections import deque
+from .InfluxSink import InfluxSink, InfluxSinkError
+
+#Setup logging
+import logging
+import logging_plus
+logger = logging_plus.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+def writerMain(ind, inQueue, outQueue, sinkArgs):
+    """
+    Main function of a writer process
+
+    Receives (seq, bucket, org, precision, payload) messages until None is received
+    and answers each with (ind, "ack", seq), (ind, "error", seq, message)
+    or, for permanent errors, (ind, "rejected", seq, message, lines).
+    """
+    sink = InfluxSink(**sinkArgs)
+    try:
+        while True:
+            msg = inQueue.get()
+            if msg is None:
+                break
+            seq, bucket, org, precision, payload = msg
+            try:
+                sink.write(bucket=bucket, org=org, record=payload, write_precision=precision)
+                outQueue.put((ind, "ack", seq))
+            except InfluxSinkError as error:
+                if error.permanent:
+                    outQueue.put((ind, "rejected", seq, error.message, getattr(error, "lines", payload.count(b"\n"))))
+                else:
+                    outQueue.put((ind, "error", seq, error.message))
+    finally:
+        sink.close()
+
+class WriterSupervisor:
+    """
+    Class representing a supervisor for writer processes
+
+    The supervisor provides write(), check(), close() and getMetrics() like InfluxSink.
+    write() raises InfluxSinkError with the lines of failed batches in attribute record.
+    """
+    def __init__(self, sinkArgs, writers=1, maxPending=100):
+        """
+        Constructor for WriterSupervisor
+
+        sinkArgs:   keyword arguments for InfluxSink in the writer processes
+        writers:    number of writer processes
+        maxPending: maximum number of batches queued per writer.
+                    If exceeded, the oldest queued batch is dropped.
+        """
+        self.sinkArgs = sinkArgs
+        self.maxPending = max(1, maxPending)
+        self.seq = 0
+        self.next = 0
+        self.context = multiprocessing.get_context("spawn")
+
+        self.processes = [None] * writers
+        self.queues = [None] * writers
+        self.results = self.context.Queue()
+        self.pending = [deque() for i in range(0, writers)]
+        # Payloads of batches which could not be written
+        self.failed = []
+
+        self.acked = 0
+        self.errors = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.restarts = 0
+
+        for ind in range(0, writers):
+            self.startWriter(ind)
+
+    def startWriter(self, ind):
+        """
+        Start writer process with given index
+        """
+        inQueue = self.context.Queue(self.maxPending)
+        proc = self.context.Process(target=writerMain, args=(ind, inQueue, self.results, self.sinkArgs), name="fritzToInfluxHA-writer-%s" % ind, daemon=True)
+        proc.start()
+        self.processes[ind] = proc
+        self.queues[ind] = inQueue
+        logger.debug("Writer process %s started with pid %s", ind, proc.pid)
+
+    def submit(self, bucket, org, payload, precision):
+        """
+        Hand over a batch of line protocol data to a writer process
+        """
+        if len(payload) == 0:
+            return
+        self.poll()
+        self.seq = self.seq + 1
+        ind = self.next
+        self.next = (self.next + 1) % len(self.processes)
+        self.handOver(ind, (self.seq, bucket, org, precision, payload))
+
+    def handOver(self, ind, msg):
+        """
+        Put a batch into the queue of a writer, dropping the oldest queued batch if the queue is full
+        """
+        pending = self.pending[ind]
+        try:
+            self.queues[ind].put_nowait(msg)
+        except queue.Full:
+            try:
+                old = self.queues[ind].get_nowait()
+                self.forget(ind, old[0])
+                self.dropped = self.dropped + 1
+                logger.error("Writer %s not responding: oldest batch dropped", ind)
+                self.queues[ind].put_nowait(msg)
+            except (queue.Empty, queue.Full):
+                # The writer has taken a batch in the meantime or the queue is still full
+                try:
+                    self.queues[ind].put_nowait(msg)
+                except queue.Full:
+                    self.dropped = self.dropped + 1
+                    logger.error("Writer %s not responding: batch dropped", ind)
+                    return
+        pending.append(msg)
+
+    def forget(self, ind, seq):
+        """
+        Remove a batch from the unacknowledged batches of a writer and return it
+        """
+        pending = self.pending[ind]
+        for msg in pending:
+            if msg[0] == seq:
+                pending.remove(msg)
+                return msg
+        return None
+
+    def write(self, bucket, org=None, record=b"", write_precision="ns"):
+        """
+        Write line protocol data through a writer process
+
+        The signature corresponds to InfluxSink.write so that the supervisor
+        can be used in place of a sink. Errors are reported with the next call:
+        if batches have failed since the last call, InfluxSinkError is raised with
+        their lines in attribute record and the given record is not written.
+        """
+        if isinstance(record, str):
+            record = record.encode("utf-8")
+        if org is None:
+            org = self.sinkArgs.get("org")
+        self.poll()
+        if self.failed:
+            failed = b"".join(self.failed)
+            count = len(self.failed)
+            self.failed = []
+            raise InfluxSinkError("%s batches could not be written to InfluxDB" % count, failed)
+        self.submit(bucket, org, record, write_precision)
+
+    def poll(self):
+        """
+        Process acknowledgements and restart writers which have died
+        """
+        while True:
+            try:
+                reply = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.receive(reply)
+        for ind in range(0, len(self.processes)):
+            if not self.processes[ind].is_alive():
+                self.restartWriter(ind)
+
+    def receive(self, reply):
+        """
+        Process a reply from a writer
+        """
+        ind = reply[0]
+        msg = self.forget(ind, reply[2])
+        if reply[1] == "ack":
+            self.acked = self.acked + 1
+        elif reply[1] == "rejected":
+            # Sending the batch again would fail as well
+            self.errors = self.errors + 1
+            self.rejected = self.rejected + reply[4]
+            logger.error("InfluxDB rejected batch: %s lines dropped: %s", reply[4], reply[3])
+        else:
+            self.errors = self.errors + 1
+            logger.error("Error while writing data to InfluxDB: %s", reply[3])
+            if msg is not None:
+                self.failed.append(msg[4])
+
+    def restartWriter(self, ind):
+        """
+        Restart a writer which has died and send its unacknowledged batches again
+        """
+        logger.error("Writer process %s died with exit code %s: restarting", ind, self.processes[ind].exitcode)
+        # Messages still queued for the dead writer are discarded
+        self.queues[ind].cancel_join_thread()
+        self.queues[ind].close()
+        self.restarts = self.restarts + 1
+        self.startWriter(ind)
+        unacked = list(self.pending[ind])
+        self.pending[ind].clear()
+        for msg in unacked:
+            self.handOver(ind, msg)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def check(self, bucket, org=None):
+        """
+        Check InfluxDB access from the polling process
+
+        Writers connect with their first batch.
+        """
+        with InfluxSink(**self.sinkArgs) as sink:
+            sink.check(bucket, org)
+
+    def close(self, timeout=10):
+        """
+        Stop writer processes after all batches have been written
+
+        Writers which have died, cannot take the stop message or do not stop
+        within timeout seconds are terminated.
+        """
+        end = time.monotonic() + timeout
+        for ind in range(0, len(self.processes)):
+            if not self.processes[ind].is_alive():
+                continue
+            try:
+                self.queues[ind].put(None, timeout=max(0, end - time.monotonic()))
+            except queue.Full:
+                logger.error("Writer %s not responding: terminated", ind)
+                self.processes[ind].terminate()
+        for ind in range(0, len(self.processes)):
+            self.processes[ind].join(max(0, end - time.monotonic()))
+            if self.processes[ind].is_alive():
+                self.processes[ind].terminate()
+                self.processes[ind].join(1)
+            self.queues[ind].cancel_join_thread()
+            self.queues[ind].close()
+        while True:
+            try:
+                self.receive(self.results.get(timeout=0.1))
+            except queue.Empty:
+                break
+        pending = sum(len(pending) for pending in self.pending) + len(self.failed)
+        if pending > 0:
+            logger.error("%s batches have not been written to InfluxDB", pending)
+        self.results.cancel_join_thread()
+        self.results.close()
+
+    def getMetrics(self):
+        """
+        Return metrics of the writer processes
+        """
+        return {
+            "writerPending" : sum(len(pending) for pending in self.pending) + len(self.failed),
+            "writerAcked" : self.acked,
+            "writerErrors" : self.errors,
+            "writerDropped" : self.dropped,
+            "writerLinesRejected" : self.rejected,
+            "writerRestarts" : self.restarts,
+        }
@@ -6,14 +6,20 @@ This module reads data from Fritz!Box Home Automation modules
 and and stores related measurement date in an InfluxDB
 """
 import argparse
-import hashlib
+try:
+    from .fritz.LoginResponse import loginResponse
+except ImportError:
+    # Started as script from the package directory
+    from fritz.LoginResponse import loginResponse
 
 parser = argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
     description=
 """
 This program calculates the response value for Fritz!Box login
-from challenge and password
+from challenge and password.
+
+PBKDF2 challenges (starting with "2$") and MD5 challenges are supported.
 """
 )
 parser.add_argument("-c", "--challenge", help="Challenge")
@@ -32,11 +38,7 @@ if args.password:
 if not challenge or not password:
     print("challenge or password missing")
 else:
-    md5 = hashlib.md5()
-    md5.update(challenge.encode('utf-16le'))
-    md5.update('-'.encode('utf-16le'))
-    md5.update(password.encode('utf-16le'))
-    response = challenge + '-' + md5.hexdigest()
+    response = loginResponse(challenge, password)
 
     print("response: " + response)
 
@@ -6,14 +6,48 @@ This module periodically reads data from Fritz!Box Home Automation modules
 and and stores related measurement date in an InfluxDB
 """
 
+import sys
 import time
 import datetime
 import math
 import os.path
 import json
-import influxdb_client
-from influxdb_client.client.write_api import SYNCHRONOUS
-from fritz.FritzBox import FritzBox, FritzBoxError, FritzBoxIgnoreableError
+import copy
+import signal
+import threading
+import contextlib
+import importlib
+from urllib.parse import urlsplit
+from concurrent.futures import Future, wait
+try:
+    from .fritz.FritzBox import FritzBox, FritzBoxError, FritzBoxIgnoreableError, FritzBoxLoginError
+    from .fritz.FritzHaDevice import defaultMeasurements
+    from .fritz.LineProtocol import PRECISIONS, LineBuffer, seriesKey, timestamp, convertPrecision
+    from .fritz.CircuitBreaker import CircuitBreaker
+    from .fritz.InfluxSink import InfluxSink, InfluxSinkError, InfluxSinkAccessError
+    from .fritz.SystemdNotify import SystemdNotifier, listenSockets
+    from .fritz.InfluxRouter import InfluxDestination, InfluxRouter
+except ImportError:
+    # Started as script from the package directory
+    from fritz.FritzBox import FritzBox, FritzBoxError, FritzBoxIgnoreableError, FritzBoxLoginError
+    from fritz.FritzHaDevice import defaultMeasurements
+    from fritz.LineProtocol import PRECISIONS, LineBuffer, seriesKey, timestamp, convertPrecision
+    from fritz.CircuitBreaker import CircuitBreaker
+    from fritz.InfluxSink import InfluxSink, InfluxSinkError, InfluxSinkAccessError
+    from fritz.SystemdNotify import SystemdNotifier, listenSockets
+    from fritz.InfluxRouter import InfluxDestination, InfluxRouter
+
+def fritzModule(name):
+    """
+    Import and return the module with the given name from package fritz
+
+    Optional components are imported only when they are enabled,
+    so that one-shot runs do not pay for their imports.
+    """
+    if __package__:
+        return importlib.import_module(".fritz." + name, __package__)
+    # Started as script from the package directory
+    return importlib.import_module("fritz." + name)
 
 # Set up logging
 import logging
@@ -23,6 +57,9 @@ logger = logging_plus.getLogger("main")
 
 testRun = False
 servRun = False
+importFiles = []
+exportStore = False
+recordFile = None
 
 # Configuration defaults
 cfgFile = ""
@@ -36,13 +73,116 @@ cfg = {
     "InfluxOrg" : None,
     "InfluxToken" : None,
     "InfluxBucket" : None,
+    "InfluxPrecision" : "s",
+    "InfluxWrite" : {
+        "gzipLevel" : 6,
+        "gzipMinSize" : 1024,
+        "maxBytesPerSecond" : 0,
+        "maxPointsPerSecond" : 0,
+        "maxBatchBytes" : 1048576,
+        "timeout" : 10,
+        "dedupeWindow" : 20000
+    },
+    "InfluxRetry" : {
+        "attempts" : 1,
+        "delay" : 1.0,
+        "maxBufferLines" : 100000
+    },
+    "InfluxDestinations" : [],
     "csvOutput" : False,
     "csvFile" : "",
+    "autoMonitorNewDevices" : False,
+    "timestampAlignment" : 0,
+    "defaultMeasurements" : defaultMeasurements(),
+    "circuitBreaker" : {
+        "failureThreshold" : 3,
+        "baseDelay" : 2.0,
+        "maxDelay" : 600.0,
+        "jitter" : 0.2
+    },
+    "metricsOutput" : False,
+    "multiProcess" : {
+        "enabled" : False,
+        "writers" : 1,
+        "maxPending" : 100
+    },
+    "csvImport" : {
+        "batchRows" : 5000,
+        "workers" : 4
+    },
+    "cacheServer" : {
+        "enabled" : False,
+        "host" : "127.0.0.1",
+        "port" : 8095,
+        "socket" : "",
+        "historySize" : 60
+    },
+    "analytics" : {
+        "enabled" : False,
+        "alpha" : 0.1,
+        "onThreshold" : 5.0,
+        "standbyThreshold" : 2.0,
+        "standbyCycles" : 30,
+        "dutyCycleMin" : None,
+        "dutyCycleMax" : None,
+        "maxTemperature" : 40.0,
+        "anomalyZScore" : 4.0,
+        "minSamples" : 10
+    },
+    "aggregates" : {
+        "enabled" : False,
+        "sublocations" : True
+    },
+    "tr064" : {
+        "enabled" : False,
+        "url" : "",
+        "actions" : [],
+        "workers" : 4,
+        "timeout" : 10
+    },
+    "sqliteStore" : {
+        "enabled" : False,
+        "file" : "",
+        "partitionDays" : 7,
+        "retentionDays" : 365,
+        "exportBatchRows" : 5000
+    },
+    "logQueue" : {
+        "maxSize" : 10000,
+        "repeatInterval" : 60
+    },
+    "startup" : {
+        "timeout" : 60,
+        "checkInflux" : True,
+        "failFast" : True
+    },
     "devices" : []
 }
 
+cfgDefaults = copy.deepcopy(cfg)
+
+# Fritz!Box and InfluxDB access
+fb = None
+recorder = None
+notifier = None
+influxSink = None
+influxRouter = None
+valueCache = None
+cacheServer = None
+# Sockets passed by systemd socket activation, kept for cache servers created on reload
+activatedSockets = None
+analytics = None
+aggregates = None
+tr064 = None
+sqliteStore = None
+logQueue = None
+cfgMtime = None
+reloadRequested = False
+stopRequested = False
+
 # Constants
 CFGFILENAME = "fritzToInfluxHA.json"
+METRICSMEASUREMENT = "collector"
 
 def getCl():
     """
@@ -53,9 +193,13 @@ def getCl():
     import os.path
 
     global logger
+    global logQueue
     global testRun
     global servRun
     global cfgFile
+    global importFiles
+    global exportStore
+    global recordFile
 
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -80,6 +224,9 @@ def getCl():
     parser.add_argument("-f", "--file", help="Logging configuration from specified JSON dictionary file")
     parser.add_argument("-v", "--verbose", action = "store_true", help="Verbose - log INFO level")
     parser.add_argument("-c", "--config", help="Path to config file to be used")
+    parser.add_argument("-i", "--importcsv", nargs="+", metavar="CSVFILE", help="Import CSV files (also .gz) written with csvOutput into InfluxDB and exit")
+    parser.add_argument("-E", "--export", action = "store_true", help="Export samples of the SQLite store (sqliteStore) not yet exported into InfluxDB and exit")
+    parser.add_argument("-R", "--record", metavar="CAPTUREFILE", help="Record Fritz!Box requests and responses with credentials scrubbed (see replayCapture.py)")
 
     args = parser.parse_args()
 
@@ -97,24 +244,31 @@ def getCl():
     formatter2 = logging.Formatter('%(asctime)s %(name)-33s %(levelname)-8s %(message)s')
     handler.setFormatter(formatter)
 
+    # Records are written by a separate thread, so that the measurement loop does not wait for log output
+    queueHandler = None
+    if args.log or args.Log or args.Full or args.verbose or args.service:
+        LogQueue = fritzModule("LogQueue").LogQueue
+        logQueue = LogQueue([handler], cfg["logQueue"]["maxSize"], cfg["logQueue"]["repeatInterval"])
+        queueHandler = logQueue.handler
+
     if args.log:
         # Shallow logging
         handler.setFormatter(formatter2)
-        logger.addHandler(handler)
+        logger.addHandler(queueHandler)
         logger.setLevel(logging.DEBUG)
 
     if args.Log:
         # Deep logging
         handler.setFormatter(formatter2)
-        logger.addHandler(handler)
+        logger.addHandler(queueHandler)
         logger.setLevel(logging.DEBUG)
-        fLogger.addHandler(handler)
+        fLogger.addHandler(queueHandler)
         fLogger.setLevel(logging.DEBUG)
 
     if args.Full:
         # Full logging
         handler.setFormatter(formatter2)
-        rLogger.addHandler(handler)
+        rLogger.addHandler(queueHandler)
         rLogger.setLevel(logging.DEBUG)
         # Activate logging of function entry and exit
         logging_plus.registerAutoLogEntryExit()
@@ -147,9 +301,9 @@ def getCl():
 
     if args.verbose or args.service:
         if not args.log and not args.Log and not args.Full:
-            logger.addHandler(handler)
+            logger.addHandler(queueHandler)
             logger.setLevel(logging.INFO)
-            fLogger.addHandler(handler)
+            fLogger.addHandler(queueHandler)
             fLogger.setLevel(logging.WARNING)
 
     if args.test:
@@ -168,6 +322,17 @@ def getCl():
     else:
         logger.debug("Service run mode deactivated")
 
+    if args.importcsv:
+        importFiles = args.importcsv
+        logger.debug("CSV files to import: %s", importFiles)
+
+    if args.export:
+        exportStore = True
+
+    if args.record:
+        recordFile = args.record
+        logger.debug("Capture file: %s", recordFile)
+
     if args.config:
         cfgFile = args.config
         logger.debug("Config file: %s", cfgFile)
@@ -182,6 +347,7 @@ def getConfig():
     Get configuration for fritzToInfluxHA
     """
     global cfgFile
+    global cfgMtime
     global cfg
     global logger
 
@@ -218,52 +384,481 @@ def getConfig():
         logger.info("No config file available. Using default configuration")
     else:
         logger.info("Using cfgFile: %s", cfgFile)
-        with open(cfgFile, 'r') as f:
-            conf = json.load(f)
-            if "measurementInterval" in conf:
-                cfg["measurementInterval"] = conf["measurementInterval"]
-            if "FritzBoxURL" in conf:
-                cfg["FritzBoxURL"] = conf["FritzBoxURL"]
-            if "FritzBoxUser" in conf:
-                cfg["FritzBoxUser"] = conf["FritzBoxUser"]
-            if "FritzBoxPassword" in conf:
-                cfg["FritzBoxPassword"] = conf["FritzBoxPassword"]
-            if "InfluxOutput" in conf:
-                cfg["InfluxOutput"] = conf["InfluxOutput"]
-            if "InfluxURL" in conf:
-                cfg["InfluxURL"] = conf["InfluxURL"]
-            if "InfluxOrg" in conf:
-                cfg["InfluxOrg"] = conf["InfluxOrg"]
-            if "InfluxToken" in conf:
-                cfg["InfluxToken"] = conf["InfluxToken"]
-            if "InfluxBucket" in conf:
-                cfg["InfluxBucket"] = conf["InfluxBucket"]
-            if "csvOutput" in conf:
-                cfg["csvOutput"] = conf["csvOutput"]
-            if "csvFile" in conf:
-                cfg["csvFile"] = conf["csvFile"]
-            if cfg["csvFile"] == "":
-                cfg["csvOutput"] = False
-            if "devices" in conf:
-                cfg["devices"] = conf["devices"]
+        readConfigFile(cfgFile, cfg)
+        cfgMtime = os.path.getmtime(cfgFile)
+
+    if logQueue:
+        logQueue.configure(cfg["logQueue"]["maxSize"], cfg["logQueue"]["repeatInterval"])
+    logConfig(cfg)
+
+def readConfigFile(fileName, config):
+    """
+    Read configuration file and update the given configuration
+    """
+    with open(fileName, 'r') as f:
+        conf = json.load(f)
+        if "measurementInterval" in conf:
+            config["measurementInterval"] = conf["measurementInterval"]
+        if "FritzBoxURL" in conf:
+            config["FritzBoxURL"] = conf["FritzBoxURL"]
+        if "FritzBoxUser" in conf:
+            config["FritzBoxUser"] = conf["FritzBoxUser"]
+        if "FritzBoxPassword" in conf:
+            config["FritzBoxPassword"] = conf["FritzBoxPassword"]
+        if "InfluxOutput" in conf:
+            config["InfluxOutput"] = conf["InfluxOutput"]
+        if "InfluxURL" in conf:
+            config["InfluxURL"] = conf["InfluxURL"]
+        if "InfluxOrg" in conf:
+            config["InfluxOrg"] = conf["InfluxOrg"]
+        if "InfluxToken" in conf:
+            config["InfluxToken"] = conf["InfluxToken"]
+        if "InfluxBucket" in conf:
+            config["InfluxBucket"] = conf["InfluxBucket"]
+        if "InfluxPrecision" in conf:
+            config["InfluxPrecision"] = conf["InfluxPrecision"]
+        if config["InfluxPrecision"] not in PRECISIONS:
+            raise ValueError("Invalid InfluxPrecision in configuration file: " + str(config["InfluxPrecision"]))
+        if "InfluxWrite" in conf:
+            config["InfluxWrite"].update(conf["InfluxWrite"])
+        if "InfluxRetry" in conf:
+            config["InfluxRetry"].update(conf["InfluxRetry"])
+        if "InfluxDestinations" in conf:
+            config["InfluxDestinations"] = conf["InfluxDestinations"]
+        if "csvOutput" in conf:
+            config["csvOutput"] = conf["csvOutput"]
+        if "csvFile" in conf:
+            config["csvFile"] = conf["csvFile"]
+        if config["csvFile"] == "":
+            config["csvOutput"] = False
+        if "autoMonitorNewDevices" in conf:
+            config["autoMonitorNewDevices"] = conf["autoMonitorNewDevices"]
+        if "timestampAlignment" in conf:
+            config["timestampAlignment"] = conf["timestampAlignment"]
+        if "defaultMeasurements" in conf:
+            config["defaultMeasurements"] = conf["defaultMeasurements"]
+        if "circuitBreaker" in conf:
+            config["circuitBreaker"].update(conf["circuitBreaker"])
+        if "metricsOutput" in conf:
+            config["metricsOutput"] = conf["metricsOutput"]
+        if "multiProcess" in conf:
+            config["multiProcess"].update(conf["multiProcess"])
+        if "csvImport" in conf:
+            config["csvImport"].update(conf["csvImport"])
+        if "cacheServer" in conf:
+            config["cacheServer"].update(conf["cacheServer"])
+        if "analytics" in conf:
+            config["analytics"].update(conf["analytics"])
+        if "aggregates" in conf:
+            config["aggregates"].update(conf["aggregates"])
+        if "tr064" in conf:
+            config["tr064"].update(conf["tr064"])
+        if "sqliteStore" in conf:
+            config["sqliteStore"].update(conf["sqliteStore"])
+        if "logQueue" in conf:
+            config["logQueue"].update(conf["logQueue"])
+        if "startup" in conf:
+            config["startup"].update(conf["startup"])
+        if config["sqliteStore"]["file"] == "":
+            config["sqliteStore"]["enabled"] = False
+        if "devices" in conf:
+            config["devices"] = conf["devices"]
 
+def logConfig(config):
+    """
+    Log the given configuration
+    """
     logger.info("Configuration:")
-    logger.info("    measurementInterval:%s", cfg["measurementInterval"])
-    logger.info("    FritzBoxURL:%s", cfg["FritzBoxURL"])
-    logger.info("    FritzBoxUser:%s", cfg["FritzBoxUser"])
-    logger.info("    FritzBoxPassword:%s", cfg["FritzBoxPassword"])
-    logger.info("    InfluxOutput:%s", cfg["InfluxOutput"])
-    logger.info("    InfluxURL:%s", cfg["InfluxURL"])
-    logger.info("    InfluxOrg:%s", cfg["InfluxOrg"])
-    logger.info("    InfluxToken:%s", cfg["InfluxToken"])
-    logger.info("    InfluxBucket:%s", cfg["InfluxBucket"])
-    logger.info("    csvOutput:%s", cfg["csvOutput"])
-    logger.info("    csvFile:%s", cfg["csvFile"])
-    logger.info("    Devices:%s", len(cfg["devices"]))
-    for ind in range(0, len(cfg["devices"])):
-        dev = cfg["devices"][ind]
+    logger.info("    measurementInterval:%s", config["measurementInterval"])
+    logger.info("    FritzBoxURL:%s", config["FritzBoxURL"])
+    logger.info("    FritzBoxUser:%s", config["FritzBoxUser"])
+    logger.info("    FritzBoxPassword:%s", config["FritzBoxPassword"])
+    logger.info("    InfluxOutput:%s", config["InfluxOutput"])
+    logger.info("    InfluxURL:%s", config["InfluxURL"])
+    logger.info("    InfluxOrg:%s", config["InfluxOrg"])
+    logger.info("    InfluxToken:%s", config["InfluxToken"])
+    logger.info("    InfluxBucket:%s", config["InfluxBucket"])
+    logger.info("    InfluxPrecision:%s", config["InfluxPrecision"])
+    logger.info("    InfluxWrite:%s", config["InfluxWrite"])
+    logger.info("    InfluxRetry:%s", config["InfluxRetry"])
+    for dest in config["InfluxDestinations"]:
+        logger.info("    InfluxDestination %s: %s %s %s", dest.get("name"), dest.get("InfluxURL"), dest.get("InfluxOrg"), dest.get("InfluxBucket"))
+    logger.info("    csvOutput:%s", config["csvOutput"])
+    logger.info("    csvFile:%s", config["csvFile"])
+    logger.info("    autoMonitorNewDevices:%s", config["autoMonitorNewDevices"])
+    logger.info("    timestampAlignment:%s", config["timestampAlignment"])
+    logger.info("    defaultMeasurements:%s", config["defaultMeasurements"])
+    logger.info("    circuitBreaker:%s", config["circuitBreaker"])
+    logger.info("    metricsOutput:%s", config["metricsOutput"])
+    logger.info("    multiProcess:%s", config["multiProcess"])
+    logger.info("    csvImport:%s", config["csvImport"])
+    logger.info("    cacheServer:%s", config["cacheServer"])
+    logger.info("    analytics:%s", config["analytics"])
+    logger.info("    aggregates:%s", config["aggregates"])
+    logger.info("    tr064:%s", config["tr064"])
+    logger.info("    sqliteStore:%s", config["sqliteStore"])
+    logger.info("    logQueue:%s", config["logQueue"])
+    logger.info("    startup:%s", config["startup"])
+    logger.info("    Devices:%s", len(config["devices"]))
+    for ind in range(0, len(config["devices"])):
+        dev = config["devices"][ind]
         logger.info("       %s (%s - %s)", dev["ain"], dev["location"], dev["sublocation"])
 
+def requestConfigReload(signum, frame):
+    """
+    Signal handler for SIGHUP: request reload of the configuration
+    """
+    global reloadRequested
+    reloadRequested = True
+
+def requestStop(signum, frame):
+    """
+    Signal handler for SIGTERM: end the measurement loop after the current cycle
+    """
+    global stopRequested
+    stopRequested = True
+    if notifier:
+        notifier.interrupt()
+
+def configReloadRequired():
+    """
+    Check whether the configuration needs to be reloaded
+
+    This is the case after SIGHUP or if the configuration file has been modified.
+    """
+    global reloadRequested
+
+    if reloadRequested:
+        reloadRequested = False
+        logger.info("Configuration reload requested by signal")
+        return True
+    if cfgFile == "":
+        return False
+    try:
+        mtime = os.path.getmtime(cfgFile)
+    except OSError:
+        return False
+    if mtime != cfgMtime:
+        logger.info("Configuration file has been modified: %s", cfgFile)
+        return True
+    return False
+
+def reloadConfig():
+    """
+    Reload configuration and apply changes without new login at the Fritz!Box
+
+    Changes of Fritz!Box URL or credentials are only effective after restart.
+    Changed InfluxDB connection parameters lead to a new InfluxDB client.
+    Device configuration is updated incrementally.
+    """
+    global cfg
+    global cfgMtime
+    global influxSink
+
+    if cfgFile == "":
+        return
+    try:
+        cfgMtime = os.path.getmtime(cfgFile)
+        newCfg = copy.deepcopy(cfgDefaults)
+        readConfigFile(cfgFile, newCfg)
+    except (OSError, ValueError) as error:
+        logger.error("Configuration not reloaded. Invalid configuration file %s: %s", cfgFile, error)
+        return
+
+    for key in ["FritzBoxURL", "FritzBoxUser", "FritzBoxPassword"]:
+        if newCfg[key] != cfg[key]:
+            logger.warning("Change of %s requires restart. Using previous value", key)
+            newCfg[key] = cfg[key]
+
+    influxChanged = False
+    for key in ["InfluxOutput", "InfluxURL", "InfluxOrg", "InfluxToken", "InfluxBucket", "InfluxPrecision", "InfluxWrite", "InfluxRetry", "InfluxDestinations", "multiProcess"]:
+        if newCfg[key] != cfg[key]:
+            influxChanged = True
+    cacheChanged = newCfg["cacheServer"] != cfg["cacheServer"]
+    analyticsChanged = newCfg["analytics"] != cfg["analytics"]
+    aggregatesChanged = newCfg["aggregates"] != cfg["aggregates"]
+    tr064Changed = newCfg["tr064"] != cfg["tr064"]
+    storeChanged = newCfg["sqliteStore"] != cfg["sqliteStore"]
+    oldPrecision = cfg["InfluxPrecision"]
+
+    cfg = newCfg
+    if logQueue:
+        logQueue.configure(cfg["logQueue"]["maxSize"], cfg["logQueue"]["repeatInterval"])
+    logConfig(cfg)
+
+    if influxChanged:
+        # Lines buffered for retry are moved to the new destinations
+        buffers = {}
+        if influxRouter:
+            buffers = influxRouter.takeBuffers()
+        closeInfluxClient()
+        if buffers and cfg["InfluxPrecision"] != oldPrecision:
+            # Buffered timestamps must match the precision they are written with
+            for name in buffers:
+                buffers[name] = convertPrecision(buffers[name], oldPrecision, cfg["InfluxPrecision"])
+            logger.info("Timestamps of buffered lines converted from precision %s to %s", oldPrecision, cfg["InfluxPrecision"])
+        if cfg["InfluxOutput"]:
+            createInfluxClient()
+            influxRouter.restoreBuffers(buffers)
+        elif buffers:
+            logger.error("InfluxOutput disabled: %s buffered lines dropped", sum(record.count(b"\n") for record in buffers.values()))
+    elif influxRouter:
+        influxRouter.setRoutes(cfg["devices"])
+
+    if cacheChanged:
+        closeCacheServer()
+        if cfg["cacheServer"]["enabled"]:
+            createCacheServer()
+
+    if tr064Changed:
+        closeTr064Collector()
+        createTr064Collector()
+
+    if storeChanged:
+        closeSqliteStore()
+        createSqliteStore()
+
+    if analyticsChanged:
+        createAnalytics()
+    elif analytics:
+        analytics.setDeviceParams(cfg["devices"])
+
+    if aggregatesChanged:
+        createAggregates()
+
+    if fb:
+        fb.autoMonitor = cfg["autoMonitorNewDevices"]
+        fb.alignment = cfg["timestampAlignment"]
+        fb.defaultMeasurements = cfg["defaultMeasurements"]
+        added, changed, removed = fb.updateDeviceData(cfg["devices"])
+        logger.info("Device configuration reloaded: %s added, %s changed, %s removed", len(added), len(changed), len(removed))
+        logDeviceInconsistencies(cfg["devices"], fb.devices)
+
+def getSinkArgs(dest=None):
+    """
+    Return the arguments for InfluxSink from the configuration
+
+    For an additional destination, its connection parameters and InfluxWrite options are used.
+    """
+    if dest is None:
+        dest = cfg
+    write = dict(cfg["InfluxWrite"])
+    write.update(dest.get("InfluxWrite", {}))
+    return {
+        "url" : dest["InfluxURL"],
+        "token" : dest["InfluxToken"],
+        "org" : dest["InfluxOrg"],
+        "gzipLevel" : write["gzipLevel"],
+        "gzipMinSize" : write["gzipMinSize"],
+        "maxBytesPerSecond" : write["maxBytesPerSecond"],
+        "maxPointsPerSecond" : write["maxPointsPerSecond"],
+        "maxBatchBytes" : write["maxBatchBytes"],
+        "timeout" : write["timeout"],
+        "dedupeWindow" : write["dedupeWindow"]
+    }
+
+def createSink(sinkArgs):
+    """
+    Instantiate a sink for the given arguments
+    """
+    if cfg["multiProcess"]["enabled"]:
+        # Writes are done by separate writer processes
+        WriterSupervisor = fritzModule("WriterProcess").WriterSupervisor
+        return WriterSupervisor(
+            sinkArgs,
+            cfg["multiProcess"]["writers"],
+            cfg["multiProcess"]["maxPending"]
+        )
+    return InfluxSink(**sinkArgs)
+
+def createDestination(name, dest, sink):
+    """
+    Instantiate an InfluxDB destination with the retry policy of the given configuration
+    """
+    retry = dict(cfg["InfluxRetry"])
+    retry.update(dest.get("retry", {}))
+    return InfluxDestination(
+        name,
+        sink,
+        dest["InfluxOrg"],
+        dest["InfluxBucket"],
+        retry["attempts"],
+        retry["delay"],
+        retry["maxBufferLines"]
+    )
+
+def createInfluxClient():
+    """
+    Instantiate InfluxDB access
+
+    The default destination is given by InfluxURL, InfluxOrg and InfluxBucket.
+    Additional destinations have their own sinks.
+    """
+    global influxSink
+    global influxRouter
+
+    influxSink = createSink(getSinkArgs())
+    destinations = [createDestination("default", cfg, influxSink)]
+    for dest in cfg["InfluxDestinations"]:
+        name = dest.get("name")
+        if not name or name == "default":
+            logger.error("InfluxDB destination ignored: missing or reserved name %s", name)
+            continue
+        try:
+            destinations.append(createDestination(name, dest, createSink(getSinkArgs(dest))))
+        except KeyError as error:
+            logger.error("InfluxDB destination %s ignored: missing %s", name, error)
+    influxRouter = InfluxRouter(destinations)
+    influxRouter.setRoutes(cfg["devices"])
+    logger.debug("Influx interface instantiated with %s destinations", len(destinations))
+
+def closeInfluxClient():
+    """
+    Close InfluxDB access
+    """
+    global influxSink
+    global influxRouter
+
+    if influxRouter:
+        influxRouter.close()
+    influxRouter = None
+    influxSink = None
+
+def createCacheServer():
+    """
+    Instantiate the last-value cache and its HTTP server
+
+    A socket passed by systemd socket activation takes precedence over the configured address.
+    It is taken from the environment only once and kept open across configuration reloads.
+    """
+    global valueCache
+    global cacheServer
+    global activatedSockets
+
+    ValueCache = fritzModule("ValueCache").ValueCache
+    CacheServer = fritzModule("CacheServer").CacheServer
+    valueCache = ValueCache(cfg["cacheServer"]["historySize"])
+    if activatedSockets is None:
+        activatedSockets = listenSockets()
+    sock = None
+    if len(activatedSockets) > 0:
+        sock = activatedSockets[0]
+    try:
+        cacheServer = CacheServer(
+            valueCache,
+            cfg["cacheServer"]["host"],
+            cfg["cacheServer"]["port"],
+            cfg["cacheServer"]["socket"],
+            sock
+        )
+    except OSError as error:
+        logger.error("Cache server could not be started: %s", error)
+        valueCache = None
+        cacheServer = None
+
+def closeCacheServer():
+    """
+    Stop the cache server
+    """
+    global valueCache
+    global cacheServer
+
+    if cacheServer:
+        cacheServer.close()
+    cacheServer = None
+    valueCache = None
+
+def createTr064Collector():
+    """
+    Create the TR-064 collector if enabled
+
+    Without url, the host of FritzBoxURL with the TR-064 port is used.
+    """
+    global tr064
+
+    tr064 = None
+    if cfg["tr064"]["enabled"]:
+        url = cfg["tr064"]["url"]
+        if not url:
+            url = "http://" + urlsplit(cfg["FritzBoxURL"]).hostname
+        actions = cfg["tr064"]["actions"]
+        if len(actions) == 0:
+            actions = None
+        Tr064Collector = fritzModule("Tr064").Tr064Collector
+        tr064 = Tr064Collector(
+            url,
+            cfg["FritzBoxUser"],
+            cfg["FritzBoxPassword"],
+            actions,
+            cfg["tr064"]["workers"],
+            cfg["tr064"]["timeout"]
+        )
+
+def closeTr064Collector():
+    """
+    Stop the TR-064 collector
+    """
+    global tr064
+
+    if tr064:
+        tr064.close()
+    tr064 = None
+
+def createSqliteStore():
+    """
+    Open the SQLite store if enabled
+    """
+    global sqliteStore
+
+    sqliteStore = None
+    if cfg["sqliteStore"]["enabled"]:
+        import sqlite3
+        SqliteStore = fritzModule("SqliteStore").SqliteStore
+        try:
+            sqliteStore = SqliteStore(
+                cfg["sqliteStore"]["file"],
+                cfg["sqliteStore"]["partitionDays"],
+                cfg["sqliteStore"]["retentionDays"]
+            )
+        except sqlite3.Error as error:
+            logger.error("SQLite store %s could not be opened: %s", cfg["sqliteStore"]["file"], error)
+
+def closeSqliteStore():
+    """
+    Close the SQLite store
+    """
+    global sqliteStore
+
+    if sqliteStore:
+        sqliteStore.close()
+    sqliteStore = None
+
+def createAnalytics():
+    """
+    Create the analytics stage if enabled
+
+    Statistics start from scratch.
+    """
+    global analytics
+
+    analytics = None
+    if cfg["analytics"]["enabled"]:
+        params = dict(cfg["analytics"])
+        del params["enabled"]
+        Analytics = fritzModule("Analytics").Analytics
+        analytics = Analytics(params)
+        analytics.setDeviceParams(cfg["devices"])
+
+def createAggregates():
+    """
+    Create the aggregation per location if enabled
+    """
+    global aggregates
+
+    aggregates = None
+    if cfg["aggregates"]["enabled"]:
+        Aggregates = fritzModule("Aggregates").Aggregates
+        aggregates = Aggregates(cfg["aggregates"]["sublocations"])
 
 def waitForNextCycle():
     """
@@ -290,7 +885,7 @@ def waitForNextCycle():
         period = math.floor(seconds/cfg["measurementInterval"])
         waitTimeSec = (period + 1) * cfg["measurementInterval"] - (60 * tNow.minute + tNow.second + tNow.microsecond / 1000000)
         logger.debug("At %s waiting for %s sec.", datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"), waitTimeSec)
-        time.sleep(waitTimeSec)
+        notifier.sleep(waitTimeSec)
     elif (cfg["measurementInterval"] % 2 == 0)\
       or (cfg["measurementInterval"] % 4 == 0)\
       or (cfg["measurementInterval"] % 5 == 0)\
@@ -305,11 +900,231 @@ def waitForNextCycle():
             period = math.floor(seconds/cfg["measurementInterval"])
             waitTimeSec = (period + 1) * cfg["measurementInterval"] - seconds
             logger.debug("At %s waiting for %s sec.", datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"), waitTimeSec)
-            time.sleep(waitTimeSec)
+            notifier.sleep(waitTimeSec)
     else:
         waitTimeSec =cfg["measurementInterval"]
         logger.debug("At %s waiting for %s sec.", datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S,"), waitTimeSec)
-        time.sleep(waitTimeSec)
+        notifier.sleep(waitTimeSec)
+
+def connectFritzBox(breaker):
+    """
+    Log in to the Fritz!Box, discover devices and complete them from configuration
+    """
+    fritzBox = FritzBox(
+        cfg["FritzBoxURL"],
+        cfg["FritzBoxUser"],
+        cfg["FritzBoxPassword"],
+        cfg["autoMonitorNewDevices"],
+        cfg["defaultMeasurements"],
+        breaker,
+        transport=recorder.wrap if recorder else None,
+        alignment=cfg["timestampAlignment"]
+    )
+    logger.debug("FritzBox fb instantiated")
+
+    # Complete device data from configiration data
+    fritzBox.completeDeviceData(cfg["devices"])
+    logger.debug("Device data completed from config for %s devices", len(cfg["devices"]))
+
+    # Log inconsistencies between configured devices and devices found on FritzBox
+    logDeviceInconsistencies(cfg["devices"], fritzBox.devices)
+    return fritzBox
+
+def terminateLate(future):
+    """
+    Log off from a Fritz!Box session whose login completed after the startup timeout
+    """
+    if future.exception() is None and isinstance(future.result(), FritzBox):
+        future.result().terminate()
+
+def startTask(function, *args):
+    """
+    Run a function in a daemon thread and return a Future for its result
+
+    Daemon threads do not delay the exit of the program if a task hangs.
+    """
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(function(*args))
+        except Exception as error:
+            future.set_exception(error)
+
+    threading.Thread(target=run, name="startup", daemon=True).start()
+    return future
+
+def startUp(breaker):
+    """
+    Log in to the Fritz!Box and check the InfluxDB destinations concurrently
+
+    Fritz!Box login and device discovery run in parallel with a ping and
+    a write check of every destination, limited by startup.timeout in total.
+    The HTTP sessions keep their connections open for the first cycle.
+    Returns the FritzBox instance (None if the login has failed) and a list
+    of (error message, permanent). Permanent errors are failed logins,
+    invalid InfluxDB tokens, organizations or buckets and configuration errors.
+    Others (e.g. Fritz!Box or InfluxDB not reachable yet) are retried in the measurement loop.
+    """
+    tasks = {}
+    tasks[startTask(connectFritzBox, breaker)] = "Fritz!Box " + cfg["FritzBoxURL"]
+    if influxRouter and cfg["startup"]["checkInflux"]:
+        for name, dest in influxRouter.destinations.items():
+            tasks[startTask(dest.check)] = "InfluxDB destination " + name
+    timeout = cfg["startup"]["timeout"]
+    if timeout <= 0:
+        timeout = None
+    done, notDone = wait(tasks, timeout)
+
+    fritzBox = None
+    errors = []
+    for future, task in tasks.items():
+        if future in notDone:
+            errors.append(("%s: no response within %s s" % (task, timeout), False))
+            future.add_done_callback(terminateLate)
+            continue
+        try:
+            result = future.result()
+        except (FritzBoxLoginError, InfluxSinkAccessError) as error:
+            errors.append(("%s: %s" % (task, error.message), True))
+            continue
+        except (FritzBoxError, InfluxSinkError) as error:
+            errors.append(("%s: %s" % (task, error.message), False))
+            continue
+        except Exception as error:
+            errors.append(("%s: %s" % (task, repr(error)), True))
+            continue
+        if isinstance(result, FritzBox):
+            fritzBox = result
+    return fritzBox, errors
+
+def closeFritzBox():
+    """
+    Log off from the Fritz!Box
+    """
+    global fb
+
+    if fb:
+        fb.terminate()
+    fb = None
+
+def logRecording():
+    """
+    Log the number of recorded Fritz!Box requests
+    """
+    logger.info("%s Fritz!Box requests recorded to %s", recorder.entries, recorder.path)
+
+def waitForRetry(breaker, error):
+    """
+    Wait before the next attempt after an error
+
+    If the circuit breaker is open, wait until retries are allowed again.
+    Otherwise retry after a short delay.
+    """
+    waitTimeSec = breaker.retryIn()
+    if waitTimeSec <= 0:
+        waitTimeSec = cfg["circuitBreaker"]["baseDelay"]
+    logger.debug("Retry in %.1f sec.", waitTimeSec)
+    notifier.status("Error: %s. Retry in %.0f sec." % (error, waitTimeSec))
+    notifier.sleep(waitTimeSec)
+
+def reportCycle(latency):
+    """
+    Report a completed cycle to systemd (watchdog heartbeat and status line)
+
+    Lines not yet written are those buffered by the router for retry
+    and those in batches pending in writer processes.
+    """
+    buffered = 0
+    pending = 0
+    if influxRouter:
+        buffered = influxRouter.getMetrics()["routerLinesBuffered"]
+        for dest in influxRouter.destinations.values():
+            pending = pending + dest.sink.getMetrics().get("writerPending", 0)
+    notifier.watchdog()
+    notifier.status("Last cycle: %.2f sec., %s devices, %s lines buffered, %s batches pending" % (latency, len(fb.devices), buffered, pending))
+
+def writeMetricsToInflux(breaker):
+    """
+    Write runtime metrics of fritzToInfluxHA to InfluxDB
+    """
+    metrics = breaker.getMetrics()
+    metrics.update(influxSink.getMetrics())
+    metrics.update(influxRouter.getMetrics())
+    if analytics:
+        metrics.update(analytics.getMetrics())
+    if aggregates:
+        metrics.update(aggregates.getMetrics())
+    if tr064:
+        metrics.update(tr064.getMetrics())
+    if sqliteStore:
+        metrics.update(sqliteStore.getMetrics())
+    if logQueue:
+        metrics.update(logQueue.getMetrics())
+    buffer = LineBuffer()
+    ts = timestamp(datetime.datetime.now(datetime.timezone.utc), cfg["InfluxPrecision"])
+    for metric in metrics:
+        buffer.append(seriesKey(METRICSMEASUREMENT, {"metric" : metric}), metrics[metric], ts)
+    try:
+        influxSink.write(bucket=cfg["InfluxBucket"], org=cfg["InfluxOrg"], record=buffer.getvalue(), write_precision=cfg["InfluxPrecision"])
+    except Exception as error:
+        logger.error("Error while writing metrics to InfluxDB: %s", error)
+        # Failed batches of writer processes are retried with the default destination
+        influxRouter.destinations["default"].restore(getattr(error, "record", None))
+
+def importCsvFiles(files):
+    """
+    Import CSV files written with csvOutput into InfluxDB
+    """
+    if not cfg["InfluxURL"]:
+        logger.critical("CSV import requires InfluxDB configuration")
+        return
+    csvImport = fritzModule("CsvImport")
+    CsvImport = csvImport.CsvImport
+    CsvImportError = csvImport.CsvImportError
+    # Imports use their own worker threads and need synchronous errors
+    sink = InfluxSink(**getSinkArgs())
+    imp = CsvImport(
+        sink,
+        cfg["InfluxOrg"],
+        cfg["InfluxBucket"],
+        cfg["InfluxPrecision"],
+        cfg["csvImport"]["batchRows"],
+        cfg["csvImport"]["workers"]
+    )
+    try:
+        for fp in files:
+            imp.importFile(fp)
+        logger.info("CSV import completed: %s points written, %s rows skipped", imp.points, imp.skipped)
+    except (OSError, CsvImportError, InfluxSinkError) as error:
+        logger.critical("CSV import failed: %s. Restart to resume from checkpoint", error)
+    finally:
+        sink.close()
+
+def exportSqliteStore():
+    """
+    Export samples of the SQLite store into InfluxDB
+    """
+    if not cfg["InfluxURL"] or not cfg["sqliteStore"]["file"]:
+        logger.critical("Export requires InfluxDB configuration and sqliteStore file")
+        return
+    import sqlite3
+    SqliteStore = fritzModule("SqliteStore").SqliteStore
+    sink = InfluxSink(**getSinkArgs())
+    try:
+        with SqliteStore(cfg["sqliteStore"]["file"], cfg["sqliteStore"]["partitionDays"], cfg["sqliteStore"]["retentionDays"]) as store:
+            exported = store.export(
+                sink,
+                cfg["InfluxOrg"],
+                cfg["InfluxBucket"],
+                cfg["InfluxPrecision"],
+                cfg["sqliteStore"]["exportBatchRows"]
+            )
+        logger.info("Export completed: %s samples written", exported)
+    except (sqlite3.Error, InfluxSinkError) as error:
+        logger.critical("Export failed: %s. Restart to resume", error)
+    finally:
+        sink.close()
 
 def logDeviceInconsistencies(cfgDefs, fritzDevs):
     for dev in fritzDevs:
@@ -325,144 +1140,280 @@ def logDeviceInconsistencies(cfgDefs, fritzDevs):
         if cnt == 0:
             logger.error("No device found for configuration ain=%s", devc["ain"])
 
-#============================================================================================
-# Start __main__
-#============================================================================================
-#
-# Get Command line options
-getCl()
+def logTermination():
+    """
+    Log the end of the program
+    """
+    logger.info("=============================================================")
+    logger.info("fritzToInfluxHA terminated")
+    logger.info("=============================================================")
 
-logger.info("=============================================================")
-logger.info("fritzToInfluxHA started")
-logger.info("=============================================================")
+def closeComponents():
+    """
+    Close the components which are recreated on configuration reload
+    """
+    closeInfluxClient()
+    closeCacheServer()
+    closeTr064Collector()
+    closeSqliteStore()
 
-# Get configuration
-getConfig()
+def main(maxCycles=0, onCycle=None, accelerated=False):
+    """
+    Main program: get configuration, log in to the Fritz!Box and run the measurement loop
 
-fb = None
-influxClient = None
-influxWriteAPI = None
+    maxCycles:   stop after the given number of cycles (Default: 0 = no limit)
+    onCycle:     function called with the number of the cycle before each cycle
+    accelerated: run cycles without waiting for the measurement interval (e.g. soak tests)
+    """
+    global fb
+    global influxSink
+    global notifier
+    global recorder
+    global testRun
 
-try:
-    # Log in to FritzBox
-    fb = FritzBox(cfg["FritzBoxURL"], cfg["FritzBoxUser"], cfg["FritzBoxPassword"])
-    logger.debug("FritzBox fb instantiated")
+    # Get Command line options
+    getCl()
 
-    # Complete device data from configiration data
-    fb.completeDeviceData(cfg["devices"])
-    logger.debug("Device data completed from config for %s devices", len(cfg["devices"]))
+    logger.info("=============================================================")
+    logger.info("fritzToInfluxHA started")
+    logger.info("=============================================================")
 
-    # Log inconsistencies between configured devices and devices found on FritzBox
-    logDeviceInconsistencies(cfg["devices"], fb.devices)
-
-    # Instatntiate InfluxDB access
-    if cfg["InfluxOutput"]:
-        influxClient = influxdb_client.InfluxDBClient(
-            url=cfg["InfluxURL"],
-            token=cfg["InfluxToken"],
-            org=cfg["InfluxOrg"]
-        )
-        influxWriteAPI = influxClient.write_api(write_options=SYNCHRONOUS)
-        logger.debug("Influx interface instantiated")
+    # Get configuration
+    getConfig()
 
-    noWait = False
-    stop = False
+    if len(importFiles) > 0 or exportStore:
+        if len(importFiles) > 0:
+            importCsvFiles(importFiles)
+        if exportStore:
+            exportSqliteStore()
+        logTermination()
+        return
 
-except FritzBoxError as error:
-    logger.critical("Unexpected error: %s", error.message)
-    stop = True
     fb = None
-    influxClient = None
-    influxWriteAPI = None
+    influxSink = None
+    recorder = None
 
-failcount = 0
-while not stop:
-    try:
-        # Wait unless noWait is set in case of sensor error.
-        # Akip waiting for test run
-        if not noWait and not testRun:
-            waitForNextCycle()
-        noWait = False
+    # Everything entered here is closed in reverse order when main ends, also after errors
+    with contextlib.ExitStack() as stack:
+        stack.callback(logTermination)
+
+        # systemd notifications (only active if started by systemd with Type=notify)
+        notifier = stack.enter_context(SystemdNotifier())
+
+        # Recording of Fritz!Box requests
+        if recordFile:
+            CaptureRecorder = fritzModule("Capture").CaptureRecorder
+            stack.callback(logRecording)
+            recorder = stack.enter_context(CaptureRecorder(recordFile))
+
+        # Components may be recreated on configuration reload: close the current ones
+        stack.callback(closeComponents)
+        stack.callback(notifier.stopping)
+        stack.callback(closeFritzBox)
 
-        ### Test FritzBox down (simulated through invalid URL)
-        ### Start Test
-        #if failcount == 0:
-        #    testRun = False
-        #    # Make URL invalid
-        #    fb.url = "http://fritzy.box"
-        #    # Make sid invalid which would be the case for a FritzBox update
-        #    fb.sid = "xyz"
-        #if failcount == 2:
-        #    fb.url = cfg["FritzBoxURL"]
-        #    testRun = True
-        ### End Test
-
-        # Get measurements for all devices
-        fb.evaluateDeviceInfo()
-        if not servRun:
-            logger.info("Measurement completed")
-
-        # Write data to CSV
-        if cfg["csvOutput"]:
-            fp = cfg["csvFile"]
-            fb.writeDataToCsv(fp)
-
-        # Write data to InfluxDB
+        # Stop on SIGTERM (e.g. systemctl stop), also while waiting
+        signal.signal(signal.SIGTERM, requestStop)
+
+        # Circuit breaker for Fritz!Box requests, kept if a new login is required
+        breaker = CircuitBreaker(
+            cfg["circuitBreaker"]["failureThreshold"],
+            cfg["circuitBreaker"]["baseDelay"],
+            cfg["circuitBreaker"]["maxDelay"],
+            cfg["circuitBreaker"]["jitter"]
+        )
+
+        # Instatntiate InfluxDB access
         if cfg["InfluxOutput"]:
-            fb.writeDataToInflux(influxWriteAPI, cfg["InfluxOrg"], cfg["InfluxBucket"])
-            if not servRun:
-                logger.info("Data written to InfluxDB")
-
-        if testRun:
-            # Stop in case of test run
-            stop = True
-
-    except FritzBoxIgnoreableError as error:
-        failcount = failcount + 1
-        logger.error("Ignored FritzBoxIgnoreableError (%s): %s", failcount, error.message)
-
-        noWait = True
-        if testRun:
-            # Stop in case of test run
-            stop = True
-        else:
-            time.sleep(2.0)
-            continue
+            createInfluxClient()
 
-    except FritzBoxError as error:
-        logger.critical("Unexpected error: %s", error.message)
-        if fb:
-            del fb
-        if influxClient:
-            del influxClient
-        if influxWriteAPI:
-            del influxWriteAPI
-
-    except Exception as e:
-        logger.critical("Unexpected error (%s): %s", e.__class__, e.__cause__)
-        if fb:
-            del fb
-        if influxClient:
-            del influxClient
-        if influxWriteAPI:
-            del influxWriteAPI
-        raise error
-
-    except KeyboardInterrupt:
+        # Serve last values to local consumers
+        if cfg["cacheServer"]["enabled"]:
+            createCacheServer()
+
+        # Streaming statistics and events
+        createAnalytics()
+
+        # Aggregates per location
+        createAggregates()
+
+        # Additional data sources over TR-064
+        createTr064Collector()
+
+        # Local time-series store
+        createSqliteStore()
+
+        # Log in to the Fritz!Box and check InfluxDB access concurrently
+        fb, errors = startUp(breaker)
+        failed = False
+        for error, permanent in errors:
+            if permanent and cfg["startup"]["failFast"]:
+                logger.critical("Startup check failed: %s", error)
+                failed = True
+            elif permanent:
+                logger.error("Startup check failed: %s", error)
+            else:
+                logger.error("Startup check failed: %s. Will be retried", error)
+        if failed:
+            sys.exit(1)
         if fb:
-            del fb
-        if influxClient:
-            del influxClient
-        if influxWriteAPI:
-            del influxWriteAPI
-
-if fb:
-    del fb
-if influxClient:
-    del influxClient
-if influxWriteAPI:
-    del influxWriteAPI
-
-logger.info("=============================================================")
-logger.info("fritzToInfluxHA terminated")
-logger.info("=============================================================")
+            notifier.ready("Logged in to Fritz!Box")
+        elif not testRun and not accelerated:
+            # Fritz!Box not available yet: retry with backoff of the circuit breaker
+            waitForRetry(breaker, "Fritz!Box not available at startup")
+
+        # Reload configuration on SIGHUP
+        signal.signal(signal.SIGHUP, requestConfigReload)
+
+        noWait = False
+        stop = False
+
+        failcount = 0
+        cycle = 0
+        while not stop and not stopRequested:
+            if maxCycles > 0 and cycle >= maxCycles:
+                break
+            cycle = cycle + 1
+            if onCycle:
+                onCycle(cycle)
+            try:
+                if not fb:
+                    # Log in to FritzBox
+                    fb = connectFritzBox(breaker)
+                    notifier.ready("Logged in to Fritz!Box")
+
+                # Wait unless noWait is set in case of sensor error.
+                # Akip waiting for test run
+                if not noWait and not testRun and not accelerated:
+                    waitForNextCycle()
+                noWait = False
+                if stopRequested:
+                    break
+
+                # Apply configuration changes
+                if configReloadRequired():
+                    reloadConfig()
+
+                ### Test FritzBox down (simulated through invalid URL)
+                ### Start Test
+                #if failcount == 0:
+                #    testRun = False
+                #    # Make URL invalid
+                #    fb.url = "http://fritzy.box"
+                #    # Make sid invalid which would be the case for a FritzBox update
+                #    fb.sid = "xyz"
+                #if failcount == 2:
+                #    fb.url = cfg["FritzBoxURL"]
+                #    testRun = True
+                ### End Test
+
+                # Get measurements for all devices
+                cycleStart = time.monotonic()
+                # TR-064 calls run in parallel with the device query and share its timestamp
+                measurementTime = fb.cycleTime()
+                if tr064:
+                    tr064.start(fb.session, measurementTime, fb.breaker)
+                fb.evaluateDeviceInfo(measurementTime)
+                breaker.recordSuccess()
+                if tr064:
+                    tr064.finish()
+                if not servRun:
+                    logger.info("Measurement completed")
+
+                # Update last-value cache
+                if valueCache:
+                    valueCache.update(fb.devices)
+
+                # Update statistics and detect events
+                if analytics:
+                    lines = analytics.update(fb.devices, cfg["InfluxPrecision"])
+                    if influxRouter:
+                        for ain, measurement, source, line in lines:
+                            influxRouter.append(ain, measurement, line, source)
+
+                # Aggregate per location
+                if aggregates:
+                    lines = aggregates.update(fb.devices, cfg["InfluxPrecision"])
+                    if influxRouter:
+                        ain = fritzModule("Aggregates").AGGREGATES_AIN
+                        for measurement, line in lines:
+                            influxRouter.append(ain, measurement, line)
+
+                # Route TR-064 values
+                if tr064 and influxRouter:
+                    ain = fritzModule("Tr064").TR064_AIN
+                    for measurement, line in tr064.measurementLines(cfg["InfluxPrecision"]):
+                        influxRouter.append(ain, measurement, line)
+
+                # Log inconsistencies if devices have been paired or removed
+                if len(fb.addedDevices) > 0 or len(fb.removedDevices) > 0:
+                    logDeviceInconsistencies(cfg["devices"], fb.devices)
+
+                # Write data to CSV
+                if cfg["csvOutput"]:
+                    fp = cfg["csvFile"]
+                    fb.writeDataToCsv(fp)
+
+                # Write data to the SQLite store
+                if sqliteStore:
+                    sqliteStore.write(fb.devices)
+
+                # Write data to InfluxDB
+                if cfg["InfluxOutput"]:
+                    # Failed writes are kept by the destinations and retried in the next cycle
+                    if influxRouter.writeDevices(fb.devices, cfg["InfluxPrecision"]):
+                        if not servRun:
+                            logger.info("Data written to InfluxDB")
+
+                # Write metrics to InfluxDB
+                if cfg["InfluxOutput"] and cfg["metricsOutput"]:
+                    writeMetricsToInflux(breaker)
+
+                reportCycle(time.monotonic() - cycleStart)
+
+                if testRun:
+                    # Stop in case of test run
+                    stop = True
+                failcount = 0
+
+            except FritzBoxIgnoreableError as error:
+                failcount = failcount + 1
+                logger.error("Ignored FritzBoxIgnoreableError (%s): %s", failcount, error.message)
+
+                noWait = True
+                if testRun:
+                    # Stop in case of test run
+                    stop = True
+                else:
+                    waitForRetry(breaker, error.message)
+                    continue
+
+            except FritzBoxError as error:
+                # Login failed: new login with backoff
+                failcount = failcount + 1
+                logger.critical("Unexpected error (%s): %s", failcount, error.message)
+                closeFritzBox()
+                breaker.recordFailure()
+
+                noWait = True
+                if testRun:
+                    # Stop in case of test run
+                    stop = True
+                else:
+                    waitForRetry(breaker, error.message)
+
+            except Exception as e:
+                logger.critical("Unexpected error (%s): %s", e.__class__, e.__cause__)
+                raise
+
+            except KeyboardInterrupt:
+                stop = True
+
+        if stopRequested:
+            logger.info("Termination requested by signal")
+
+#============================================================================================
+# Start __main__
+#============================================================================================
+#
+if __name__ == "__main__":
+    main()
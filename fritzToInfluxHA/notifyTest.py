@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+"""
+Module notifyTest
+
+This module tests the systemd notifications of fritzToInfluxHA
+against a stub notification socket.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from .fritz.SystemdNotify import SystemdNotifier
+    from .fritz.Simulator import FritzBoxSimulator
+except ImportError:
+    # Started as script from the package directory
+    from fritz.SystemdNotify import SystemdNotifier
+    from fritz.Simulator import FritzBoxSimulator
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=
+"""
+This program tests the systemd notifications of fritzToInfluxHA.
+
+A stub notification socket receives the messages which systemd would receive.
+First, SystemdNotifier is checked with the socket given as address.
+Then fritzToInfluxHA is started with NOTIFY_SOCKET and WATCHDOG_USEC against
+a simulated Fritz!Box and stopped with SIGTERM while waiting for the next cycle.
+The test fails (exit code 1) if expected messages are missing or
+fritzToInfluxHA does not terminate in time.
+"""
+)
+parser.add_argument("-i", "--interval", type=int, default=2, help="Measurement interval of fritzToInfluxHA in seconds (Default: 2)")
+parser.add_argument("-w", "--watchdog", type=float, default=1.0, help="Watchdog interval in seconds (Default: 1.0)")
+parser.add_argument("--timeout", type=float, default=30.0, help="Maximum time for each step in seconds (Default: 30.0)")
+
+args = parser.parse_args()
+
+curDir = os.path.dirname(os.path.realpath(__file__))
+failures = []
+
+class StubSocket:
+    """
+    Stub of the systemd notification socket collecting received messages
+    """
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.messages = []
+
+    def receive(self, timeout):
+        """
+        Receive messages until the timeout expires without a message
+        """
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                self.messages.append(self.sock.recv(4096).decode("utf-8"))
+        except socket.timeout:
+            pass
+
+    def waitFor(self, assignment, timeout):
+        """
+        Receive messages until one contains the given assignment
+
+        Returns False if no such message has been received within the timeout.
+        """
+        end = time.monotonic() + timeout
+        while not any(assignment in msg.split("\n") for msg in self.messages):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.sock.settimeout(remaining)
+            try:
+                self.messages.append(self.sock.recv(4096).decode("utf-8"))
+            except socket.timeout:
+                return False
+        return True
+
+    def count(self, assignment):
+        return sum(1 for msg in self.messages if assignment in msg.split("\n"))
+
+    def close(self):
+        self.sock.close()
+
+def check(condition, failure):
+    print("%-6s %s" % ("ok" if condition else "FAILED", failure))
+    if not condition:
+        failures.append(failure)
+
+def testNotifier(path):
+    """
+    Check the messages sent by SystemdNotifier with the stub socket as address
+    """
+    stub = StubSocket(path)
+    notifier = SystemdNotifier(path, int(args.watchdog * 1000000))
+    check(notifier.enabled, "notifier enabled with address")
+    notifier.ready("Test")
+    notifier.ready("Test")
+    notifier.status("Waiting")
+    notifier.sleep(args.watchdog * 1.6)
+    notifier.interrupt()
+    start = time.monotonic()
+    notifier.sleep(60)
+    check(time.monotonic() - start < 1, "sleep ends after interrupt")
+    notifier.stopping()
+    notifier.close()
+    stub.receive(0.2)
+    stub.close()
+    check(stub.messages[0:2] == ["READY=1\nSTATUS=Test", "STATUS=Waiting"], "READY sent once with status")
+    check(stub.count("WATCHDOG=1") >= 2, "heartbeats sent while sleeping")
+    check(stub.messages[-1] == "STOPPING=1", "STOPPING sent")
+
+def testService(path, tmpDir):
+    """
+    Check the notifications of fritzToInfluxHA and termination with SIGTERM
+    """
+    with FritzBoxSimulator(switches=2, thermostats=1) as box:
+        cfgPath = os.path.join(tmpDir, "fritzToInfluxHA.json")
+        with open(cfgPath, "w") as f:
+            json.dump({
+                "measurementInterval" : args.interval,
+                "FritzBoxURL" : box.url,
+                "FritzBoxUser" : box.user,
+                "FritzBoxPassword" : box.pwd,
+                "InfluxOutput" : False
+            }, f)
+        stub = StubSocket(path)
+        env = dict(os.environ)
+        env["NOTIFY_SOCKET"] = path
+        env["WATCHDOG_USEC"] = str(int(args.watchdog * 1000000))
+        env.pop("WATCHDOG_PID", None)
+        proc = subprocess.Popen([sys.executable, "fritzToInfluxHA.py", "-s", "-c", cfgPath], cwd=curDir, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            check(stub.waitFor("READY=1", args.timeout), "READY sent after login")
+            stub.messages = []
+            check(stub.waitFor("WATCHDOG=1", args.timeout), "heartbeat sent")
+            # Let one cycle complete, then stop while waiting for the next one
+            completed = False
+            end = time.monotonic() + args.timeout
+            while not completed and time.monotonic() < end:
+                stub.receive(0.2)
+                completed = any(msg.startswith("STATUS=Last cycle") for msg in stub.messages)
+            check(completed, "cycle status reported")
+            start = time.monotonic()
+            proc.send_signal(signal.SIGTERM)
+            check(stub.waitFor("STOPPING=1", args.timeout), "STOPPING sent after SIGTERM")
+            try:
+                rc = proc.wait(args.timeout)
+            except subprocess.TimeoutExpired:
+                rc = None
+            check(rc == 0, "terminated with exit code 0 after %.1f sec." % (time.monotonic() - start))
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            stub.close()
+
+with tempfile.TemporaryDirectory() as tmpDir:
+    path = os.path.join(tmpDir, "notify")
+    testNotifier(path)
+    os.unlink(path)
+    testService(path, tmpDir)
+
+if failures:
+    print("FAILED: " + ", ".join(failures))
+    sys.exit(1)
+print("PASSED")
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""
+Module replayCapture
+
+This module replays Fritz!Box requests recorded with fritzToInfluxHA -R
+through the measurement pipeline and reports the processing times.
+"""
+import argparse
+import json
+import statistics
+import time
+
+# Set up logging
+import logging
+
+try:
+    from .fritz.FritzBox import FritzBox, FritzBoxError, FritzBoxIgnoreableError
+    from .fritz.FritzHaDevice import defaultMeasurements
+    from .fritz.CircuitBreaker import CircuitBreaker
+    from .fritz.InfluxSink import InfluxSink
+    from .fritz.InfluxRouter import InfluxRouter, InfluxDestination
+    from .fritz.ValueCache import ValueCache
+    from .fritz.Capture import ReplayTransport, CaptureEndError
+except ImportError:
+    # Started as script from the package directory
+    from fritz.FritzBox import FritzBox, FritzBoxError, FritzBoxIgnoreableError
+    from fritz.FritzHaDevice import defaultMeasurements
+    from fritz.CircuitBreaker import CircuitBreaker
+    from fritz.InfluxSink import InfluxSink
+    from fritz.InfluxRouter import InfluxRouter, InfluxDestination
+    from fritz.ValueCache import ValueCache
+    from fritz.Capture import ReplayTransport, CaptureEndError
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=
+"""
+This program replays a capture recorded with fritzToInfluxHA -R.
+
+Recorded responses are fed to FritzBox in recorded order and processed like
+measurement cycles: parsing of the device list, update of the last-value cache
+and serialization to line protocol through the router pipeline. By default,
+line protocol is discarded. With -u, it is written to the given InfluxDB.
+
+The time per phase and cycle is reported, so that changes of parser and
+sink can be compared on real-world payloads.
+"""
+)
+parser.add_argument("capture", metavar="CAPTUREFILE", help="Capture file")
+parser.add_argument("-s", "--speed", type=float, default=0.0, help="Replay speed relative to recording, 0 = no delays (Default: 0)")
+parser.add_argument("-r", "--repeat", type=int, default=1, help="Number of replays of the capture (Default: 1)")
+parser.add_argument("-c", "--config", help="Configuration file with devices to be monitored (Default: all devices and measurements)")
+parser.add_argument("-p", "--precision", default="s", help="Timestamp precision (Default: s)")
+parser.add_argument("-u", "--url", help="URL of InfluxDB to write to")
+parser.add_argument("-o", "--org", default="", help="InfluxDB organization")
+parser.add_argument("-b", "--bucket", default="", help="InfluxDB bucket")
+parser.add_argument("-k", "--token", default="", help="InfluxDB token")
+parser.add_argument("-v", "--verbose", action="store_true", help="Verbose - log INFO level")
+
+args = parser.parse_args()
+
+if args.verbose:
+    logging.basicConfig(level=logging.INFO)
+else:
+    logging.basicConfig(level=logging.CRITICAL)
+
+class NullSink:
+    """
+    Sink discarding line protocol data
+    """
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, bucket, org=None, record=b"", write_precision="ns"):
+        self.writes = self.writes + 1
+        self.bytes = self.bytes + len(record)
+
+    def close(self):
+        pass
+
+def deviceConfig(fb):
+    """
+    Return the device configuration from the configuration file or for all devices
+    """
+    if args.config:
+        with open(args.config, "r") as f:
+            return json.load(f).get("devices", [])
+    measurements = defaultMeasurements()
+    return [{"ain" : dev.ain, "location" : "", "sublocation" : "", "measurements" : measurements} for dev in fb.devices]
+
+def report(name, times):
+    if len(times) == 0:
+        return
+    print("%-20s n %6s   mean %8.3f ms   median %8.3f ms   max %8.3f ms" % (
+        name,
+        len(times),
+        1000 * statistics.mean(times),
+        1000 * statistics.median(times),
+        1000 * max(times)))
+
+if args.url:
+    sink = InfluxSink(args.url, args.token, args.org)
+else:
+    sink = NullSink()
+
+transport = ReplayTransport(args.capture, args.speed)
+print("Capture %s: %s requests" % (args.capture, len(transport)))
+
+# Replayed errors must not delay the replay
+breaker = CircuitBreaker(3, 0.0, 0.0, 0.0)
+cache = ValueCache()
+loginTimes = []
+queryTimes = []
+cacheTimes = []
+writeTimes = []
+failed = 0
+start = time.perf_counter()
+
+with InfluxRouter([InfluxDestination("default", sink, args.org, args.bucket)]) as router:
+    for run in range(0, args.repeat):
+        transport.rewind()
+        fb = None
+        while True:
+            try:
+                if fb is None:
+                    t = time.perf_counter()
+                    fb = FritzBox("http://fritz.box/", "user", "password", True, None, breaker, transport=transport)
+                    fb.completeDeviceData(deviceConfig(fb))
+                    loginTimes.append(time.perf_counter() - t)
+                t = time.perf_counter()
+                fb.evaluateDeviceInfo()
+                queryTimes.append(time.perf_counter() - t)
+                breaker.recordSuccess()
+                t = time.perf_counter()
+                cache.update(fb.devices)
+                cacheTimes.append(time.perf_counter() - t)
+                t = time.perf_counter()
+                ok = router.writeDevices(fb.devices, args.precision)
+                writeTimes.append(time.perf_counter() - t)
+                if not ok:
+                    failed = failed + 1
+            except CaptureEndError:
+                break
+            except FritzBoxIgnoreableError:
+                failed = failed + 1
+            except FritzBoxError:
+                failed = failed + 1
+                if fb:
+                    try:
+                        fb.terminate()
+                    except CaptureEndError:
+                        break
+                fb = None
+                breaker.recordFailure()
+
+elapsed = time.perf_counter() - start
+print("Replayed %s cycles (%s failed) in %.3f sec." % (len(writeTimes), failed, elapsed))
+report("Login + device list", loginTimes)
+report("Query + parse", queryTimes)
+report("Cache update", cacheTimes)
+report("Serialize + write", writeTimes)
+if isinstance(sink, NullSink):
+    print("Line protocol: %s batches, %s bytes" % (sink.writes, sink.bytes))
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+"""
+Module soakTest
+
+This module runs a soak test of fritzToInfluxHA against a simulated Fritz!Box
+and checks that memory, objects and file descriptors do not keep growing.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Set up logging
+import logging
+
+try:
+    from . import fritzToInfluxHA
+    from .fritz.FritzHaDevice import defaultMeasurements
+    from .fritz.Simulator import FritzBoxSimulator
+except ImportError:
+    # Started as script from the package directory
+    import fritzToInfluxHA
+    from fritz.FritzHaDevice import defaultMeasurements
+    from fritz.Simulator import FritzBoxSimulator
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=
+"""
+This program runs a soak test of fritzToInfluxHA.
+
+The measurement loop of fritzToInfluxHA (main) runs for a given number of
+cycles without waiting against a local simulated Fritz!Box which also accepts
+InfluxDB writes and TR-064 calls. Cache server, analytics, aggregates, TR-064,
+SQLite store, metrics and writer processes are enabled. Outages, expired
+sessions and configuration reloads are injected periodically.
+
+After a warmup, RSS, traced memory (tracemalloc), the number of objects and
+the number of open file descriptors are sampled. The test fails (exit code 1)
+if traced memory, objects or file descriptors have grown beyond the limits.
+For file descriptors, the maximum of the later half of the samples is compared
+with that of the earlier half, since open keep-alive connections vary.
+"""
+)
+parser.add_argument("-n", "--cycles", type=int, default=5000, help="Number of measurement cycles (Default: 5000)")
+parser.add_argument("-w", "--warmup", type=int, default=500, help="Cycles before the baseline is taken (Default: 500)")
+parser.add_argument("-s", "--switches", type=int, default=10, help="Number of simulated switches (Default: 10)")
+parser.add_argument("-t", "--thermostats", type=int, default=5, help="Number of simulated thermostats (Default: 5)")
+parser.add_argument("-o", "--outage", type=int, default=100, help="Inject an outage every OUTAGE cycles, 0 = never (Default: 100)")
+parser.add_argument("-e", "--expire", type=int, default=37, help="Expire sessions every EXPIRE cycles, 0 = never (Default: 37)")
+parser.add_argument("-r", "--reload", type=int, default=250, help="Modify the configuration every RELOAD cycles, 0 = never (Default: 250)")
+parser.add_argument("--md5", action="store_true", help="Simulate MD5 instead of PBKDF2 login")
+parser.add_argument("--single-process", action="store_true", help="Write to InfluxDB from the polling process instead of writer processes")
+parser.add_argument("--max-growth", type=int, default=256, help="Maximum growth of traced memory in KiB (Default: 256)")
+parser.add_argument("--max-objects", type=int, default=2000, help="Maximum growth of the number of objects (Default: 2000)")
+parser.add_argument("--max-fds", type=int, default=4, help="Maximum growth of the number of file descriptors (Default: 4)")
+parser.add_argument("-v", "--verbose", action="store_true", help="Verbose - log INFO level")
+
+def rss():
+    """
+    Return the resident set size in bytes
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def openFds():
+    """
+    Return the number of open file descriptors
+    """
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+def sample(cycle):
+    gc.collect()
+    return {
+        "cycle" : cycle,
+        "rss" : rss(),
+        "traced" : tracemalloc.get_traced_memory()[0],
+        "objects" : len(gc.get_objects()),
+        "fds" : openFds(),
+    }
+
+def report(s):
+    print("%8s %10.1f %10.1f %10s %5s" % (s["cycle"], s["rss"] / 1024, s["traced"] / 1024, s["objects"], s["fds"]))
+
+def deviceConfig(box):
+    """
+    Return a device configuration monitoring all measurements of all simulated devices
+    """
+    measurements = defaultMeasurements()
+    return [{
+        "ain" : ain.replace(" ", ""),
+        "location" : "Soak",
+        "sublocation" : name,
+        "measurements" : measurements
+    } for ain, name, kind in box.devices]
+
+def writeConfig(path, box, dbFile, generation):
+    """
+    Write the configuration for fritzToInfluxHA
+
+    The InfluxDB retry delay and the aggregation of sublocations alternate with
+    the generation, so that a reload recreates InfluxDB access and aggregates.
+    """
+    config = {
+        "FritzBoxURL" : box.url,
+        "FritzBoxUser" : box.user,
+        "FritzBoxPassword" : box.pwd,
+        "InfluxOutput" : True,
+        "InfluxURL" : box.url,
+        "InfluxOrg" : "org",
+        "InfluxToken" : "token",
+        "InfluxBucket" : "bucket",
+        "InfluxRetry" : {"attempts" : 1, "delay" : 0.001 * (1 + generation % 2)},
+        "metricsOutput" : True,
+        "multiProcess" : {"enabled" : not args.single_process},
+        "circuitBreaker" : {"failureThreshold" : 2, "baseDelay" : 0.001, "maxDelay" : 0.01, "jitter" : 0.2},
+        "cacheServer" : {"enabled" : True, "port" : 0},
+        "analytics" : {"enabled" : True},
+        "aggregates" : {"enabled" : True, "sublocations" : generation % 2 == 0},
+        "tr064" : {"enabled" : True, "url" : box.url},
+        "sqliteStore" : {"enabled" : True, "file" : dbFile},
+        "startup" : {"timeout" : 10},
+        "devices" : deviceConfig(box)
+    }
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+def run(samples):
+    """
+    Run fritzToInfluxHA against a simulated Fritz!Box and append samples after the warmup
+
+    Returns the tracemalloc snapshot taken with the first sample.
+    """
+    baseline = []
+    interval = max(1, (args.cycles - args.warmup) // 10)
+
+    def onCycle(cycle):
+        # Inject failures and take samples before a cycle of fritzToInfluxHA
+        if args.outage > 0:
+            # Outage for 3 cycles
+            box.outage = cycle % args.outage < 3
+        if args.expire > 0 and cycle % args.expire == 0:
+            box.expireSessions()
+        if args.reload > 0 and cycle % args.reload == 0:
+            writeConfig(cfgPath, box, dbFile, cycle // args.reload)
+        completed = cycle - 1
+        if completed == args.warmup:
+            s = sample(completed)
+            samples.append(s)
+            report(s)
+            baseline.append(tracemalloc.take_snapshot())
+        elif completed > args.warmup and (completed - args.warmup) % interval == 0:
+            s = sample(completed)
+            samples.append(s)
+            report(s)
+
+    with tempfile.TemporaryDirectory() as tmpDir, \
+         FritzBoxSimulator(switches=args.switches, thermostats=args.thermostats, pbkdf2=not args.md5) as box:
+        cfgPath = os.path.join(tmpDir, "fritzToInfluxHA.json")
+        dbFile = os.path.join(tmpDir, "soak.db")
+        writeConfig(cfgPath, box, dbFile, 0)
+        sys.argv = [sys.argv[0], "-c", cfgPath]
+        print("%8s %10s %10s %10s %5s" % ("Cycle", "RSS KiB", "Trace KiB", "Objects", "FDs"))
+        start = time.perf_counter()
+        # One more cycle so that the last sample is taken after all cycles
+        fritzToInfluxHA.main(maxCycles=args.cycles + 1, onCycle=onCycle, accelerated=True)
+        elapsed = time.perf_counter() - start
+        print("Cycles: %s in %.1f sec. Logins: %s, writes: %s" % (args.cycles, elapsed, box.logins, box.writes))
+    if len(baseline) > 0:
+        return baseline[0]
+    return None
+
+def check(samples, baseline):
+    """
+    Check the growth between the samples and return the failures
+    """
+    first = samples[0]
+    last = samples[-1]
+    failures = []
+    if last["traced"] - first["traced"] > args.max_growth * 1024:
+        failures.append("traced memory grew by %.1f KiB" % ((last["traced"] - first["traced"]) / 1024))
+    if last["objects"] - first["objects"] > args.max_objects:
+        failures.append("objects grew by %s" % (last["objects"] - first["objects"]))
+    # Keep-alive connections are opened and closed by the server at any time:
+    # compare the maximum of the later samples with that of the earlier ones
+    half = len(samples) // 2
+    fdGrowth = max(s["fds"] for s in samples[half:]) - max(s["fds"] for s in samples[0:half])
+    if fdGrowth > args.max_fds:
+        failures.append("file descriptors grew by %s" % fdGrowth)
+    return failures
+
+# Writer processes are spawned and import this module as __mp_main__: run the test only once
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.CRITICAL)
+
+    tracemalloc.start()
+    samples = []
+    baseline = run(samples)
+
+    if len(samples) < 2:
+        print("Not enough samples: increase cycles or reduce warmup")
+        sys.exit(1)
+
+    failures = check(samples, baseline)
+    if failures:
+        print("FAILED: " + ", ".join(failures))
+        print("Largest allocations since baseline:")
+        for stat in tracemalloc.take_snapshot().compare_to(baseline, "lineno")[0:10]:
+            print("    %s" % stat)
+        sys.exit(1)
+    print("PASSED")
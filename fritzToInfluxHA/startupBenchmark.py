@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+"""
+Module startupBenchmark
+
+This module measures the startup time of fritzToInfluxHA,
+i.e. the time needed to start the interpreter and import the program modules.
+"""
+import argparse
+import json
+import os.path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from .fritz.Simulator import FritzBoxSimulator
+except ImportError:
+    # Started as script from the package directory
+    from fritz.Simulator import FritzBoxSimulator
+
+parser = argparse.ArgumentParser(
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    description=
+"""
+This program measures the startup time of fritzToInfluxHA.
+
+Each run starts a new interpreter which imports the main module
+without running the measurement loop.
+For comparison, the import time of other modules
+(e.g. influxdb_client) can be measured with option -m.
+
+Finally, a test run (-t) with a minimal configuration against a simulated
+Fritz!Box checks that optional components which are not enabled have not
+been imported. The program fails (exit code 1) if they have.
+"""
+)
+parser.add_argument("-n", "--runs", type=int, default=10, help="Number of runs (Default: 10)")
+parser.add_argument("-m", "--module", action="append", default=[], help="Additional module to be imported")
+parser.add_argument("-i", "--imports", action="store_true", help="Show the 10 slowest imports")
+
+args = parser.parse_args()
+
+curDir = os.path.dirname(os.path.realpath(__file__))
+modules = ["fritzToInfluxHA"] + args.module
+code = "import " + ", ".join(modules)
+
+# Modules which must be imported only if the respective component is enabled
+OPTIONAL_MODULES = (
+    "sqlite3",
+    "multiprocessing",
+    "http.server",
+    "fritz.WriterProcess",
+    "fritz.CacheServer",
+    "fritz.ValueCache",
+    "fritz.Tr064",
+    "fritz.SqliteStore",
+    "fritz.CsvImport",
+    "fritz.Capture",
+    "fritz.Analytics",
+    "fritz.Aggregates",
+    "fritz.LogQueue",
+)
+
+# Test run printing the imported modules
+testRunCode = """
+import sys, json
+sys.argv = ["fritzToInfluxHA", "-t", "-c", sys.argv[1]]
+import fritzToInfluxHA
+fritzToInfluxHA.main()
+print("MODULES " + json.dumps(sorted(sys.modules)))
+"""
+
+def runOnce(cmd):
+    """
+    Run the given command and return the wall time in seconds
+    """
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=curDir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def report(name, times):
+    print("%-30s min %8.1f ms   median %8.1f ms   max %8.1f ms" % (
+        name,
+        1000 * min(times),
+        1000 * statistics.median(times),
+        1000 * max(times)))
+
+base = [runOnce([sys.executable, "-c", "pass"]) for i in range(0, args.runs)]
+prog = [runOnce([sys.executable, "-c", code]) for i in range(0, args.runs)]
+
+print("Runs: %s" % args.runs)
+report("Interpreter only", base)
+report(", ".join(modules), prog)
+report("Import overhead", [p - b for p, b in zip(sorted(prog), sorted(base))])
+
+if args.imports:
+    # Evaluate output of -X importtime (cumulative time in us is the second column)
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=curDir, check=True, capture_output=True, text=True)
+    entries = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        cols = line[len("import time:"):].split("|")
+        if len(cols) != 3 or not cols[1].strip().isdigit():
+            continue
+        entries.append((int(cols[1]), cols[2].strip()))
+    entries.sort(reverse=True)
+    print("Slowest imports (cumulative):")
+    for cumulative, name in entries[0:10]:
+        print("    %8.1f ms  %s" % (cumulative / 1000, name))
+
+def loadedOptionalModules():
+    """
+    Run a test run with a minimal configuration and return the optional modules imported
+    """
+    with FritzBoxSimulator(switches=2, thermostats=1) as box, tempfile.TemporaryDirectory() as tmpDir:
+        cfgPath = os.path.join(tmpDir, "fritzToInfluxHA.json")
+        with open(cfgPath, "w") as f:
+            json.dump({
+                "FritzBoxURL" : box.url,
+                "FritzBoxUser" : box.user,
+                "FritzBoxPassword" : box.pwd,
+                "InfluxOutput" : False
+            }, f)
+        res = subprocess.run([sys.executable, "-c", testRunCode, cfgPath], cwd=curDir, check=True, capture_output=True, text=True)
+    for line in res.stdout.splitlines():
+        if line.startswith("MODULES "):
+            loaded = set(json.loads(line[len("MODULES "):]))
+            return [name for name in OPTIONAL_MODULES if name in loaded]
+    raise RuntimeError("Test run did not report imported modules")
+
+optional = loadedOptionalModules()
+if optional:
+    print("FAILED: test run with minimal configuration imported %s" % ", ".join(optional))
+    sys.exit(1)
+print("Test run with minimal configuration: no optional modules imported")
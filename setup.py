@@ -176,6 +176,7 @@ setup(
     # For example, the following would provide a command called `sample` which
     # executes the function `main` from this package when invoked:
     # entry_points={"console_scripts": ["sample=sample:main"]},  # Optional
+    entry_points={"console_scripts": ["fritzToInfluxHA=fritzToInfluxHA.fritzToInfluxHA:main"]},
     # List additional URLs that are relevant to your project as a dict.
     #
     # This field corresponds to the "Project-URL" metadata fields: